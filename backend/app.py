@@ -11,13 +11,18 @@ from utils import sigchld_handler
 from dotenv import load_dotenv
 
 from enironment import Environment, wrap_in_cached, SharedStateHolder, get_step
-from steps.git import GitClone
-from steps.step import CachingStep
+from steps.git import AutoBranchGC, GitClone
+from steps.step import CachingStep, JobInProgressException, add_job_listener
+from warmup import WarmupTimeline, run_warmup
+from maintenance import MAINTENANCE_INTERVAL, MaintenanceThread
+import tracing
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+PROCESSING_THREAD_NAME = "processing"
+
 # Load environment variables from .env file
 load_dotenv("local.env")
 load_dotenv('/run/secrets/brencher-secrets')
@@ -27,9 +32,20 @@ class App:
 
 	def __init__(self, environments: Dict[str, Environment]) -> None:
 		self.environments: Dict[str, Environment] = {id: wrap_in_cached(e) for id, e in environments.items()}
+		# Auto branches on a remote are shared by all environments cloning it
+		for env in self.environments.values():
+			for step in env.pipeline:
+				inner = step._step if isinstance(step, CachingStep) else step
+				if isinstance(inner, AutoBranchGC):
+					inner.environments = list(self.environments.values())
 		self.state_lock = threading.Lock()
 		self.environment_update_event = threading.Event()
 		self.emit_callback: Optional[Callable[[], None]] = None
+		self.warmup_timeline: Optional[WarmupTimeline] = None
+		self.maintenance: Optional[MaintenanceThread] = None
+		# Wake the processing loop as soon as a background job finishes
+		add_job_listener(self.environment_update_event.set)
+		tracing.instrument_libraries()
 
 	def get_local_envs_to_emit(self) -> Dict[str, Dict[str, Any]]:
 		env_dtos: Dict[str, Dict[str, Any]] = {}
@@ -42,7 +58,13 @@ class App:
 					else:
 						result = r.progress()
 
-					if isinstance(result, BaseException):
+					if isinstance(result, JobInProgressException):
+						pipeline_state.append({
+							"name": r.name,
+							"status": result.job.snapshot(),
+							"is_running": True,
+						})
+					elif isinstance(result, BaseException):
 						stack = traceback.format_exception(type(result), result, result.__traceback__)
 						pipeline_state.append({
 							"name": r.name,
@@ -73,6 +95,8 @@ class App:
 				env_dtos[env.id]['dry'] = shared_state.dry
 			except BaseException:
 				pass
+			if self.warmup_timeline is not None:
+				env_dtos[env.id]['startup'] = self.warmup_timeline.for_environment(env.id)
 		return env_dtos
 
 	def get_local_branches_to_emit(self) -> Dict[str, Dict[str, List[Any]]]:
@@ -88,7 +112,14 @@ class App:
 
 		return branches
 
+	def warmup(self) -> None:
+		emit = self.emit_callback or (lambda: None)
+		with self.state_lock:
+			self.warmup_timeline = run_warmup(list(self.environments.values()), emit)
+		emit()
+
 	def processing_thread(self) -> None:
+		self.warmup()
 		while True:
 			import processing
 
@@ -96,19 +127,30 @@ class App:
 
 			with self.state_lock:
 				logger.info(f"Processing")
-				if processing.process_all_jobs(list(self.environments.values()), emit):
-					self.environment_update_event.wait(timeout=1 * 5)
-				else:
-					self.environment_update_event.wait(timeout=1 * 60)
-				self.environment_update_event.clear()
+				has_error = processing.process_all_jobs(list(self.environments.values()), emit)
+			# Wait outside the lock: git maintenance runs between ticks
+			if has_error:
+				self.environment_update_event.wait(timeout=1 * 5)
+			else:
+				self.environment_update_event.wait(timeout=1 * 60)
+			self.environment_update_event.clear()
+
+	def start_maintenance(self) -> None:
+		if MAINTENANCE_INTERVAL > 0 and self.maintenance is None:
+			self.maintenance = MaintenanceThread(list(self.environments.values()), MAINTENANCE_INTERVAL,
+			                                     lock=self.state_lock)
+			self.maintenance.start()
 
 	def run(self) -> None:
-		processing = threading.Thread(target=self.processing_thread)
+		processing = threading.Thread(target=self.processing_thread, name=PROCESSING_THREAD_NAME)
 		processing.daemon = True
 		processing.start()
+		self.start_maintenance()
 
 	def runHeadless(self) -> None:
 		"""Run the processing loop on the current thread; blocks forever."""
+		threading.current_thread().name = PROCESSING_THREAD_NAME
+		self.start_maintenance()
 		self.processing_thread()
 
 	def runWeb(self, port: int) -> None:
@@ -1,8 +1,8 @@
 from configs.brencher2 import checkPingF
 from enironment import Environment
-from steps.checks import SimpleLog, UrlCheck
+from steps.checks import LoadProbe, SimpleLog, UrlCheck
 from steps.docker import DockerComposeBuild, DockerSwarmCheck, DockerSwarmDeploy
-from steps.git import GitClone, CheckoutMerged, GitUnmerge
+from steps.git import GitClone, CheckoutMerged, GitUnmerge, deployed_version
 from steps.shared_state import SharedStateHolderInMemory
 
 clone = GitClone(url="https://github.com/rudolf1/brencher.git")
@@ -48,6 +48,18 @@ deployDocker = DockerSwarmDeploy(
 checkPing = UrlCheck(
 	url="https://brencher.rudolf.keenetic.link/state",
 	expected=checkPingF,
+	samples=5,
+	latency_budget_ms=1000,
+	on_budget_exceeded="warn",
+	version=lambda: deployed_version(dockerSwarmCheck.progress()),
+)
+loadProbe = LoadProbe(
+	url="https://brencher.rudolf.keenetic.link/state",
+	deploy=deployDocker,
+	request_count=30,
+	concurrency=5,
+	version=lambda: deployed_version(dockerSwarmCheck.progress()),
+	max_p95_regression_pct=50,
 )
 logUrls = SimpleLog(message={
 	"userLinks": {
@@ -69,6 +81,7 @@ brencher = Environment(
 		unmerge,
 		deployDocker,
 		checkPing,
+		loadProbe,
 		logUrls
 	]
 )
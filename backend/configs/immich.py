@@ -1,10 +1,12 @@
 from enironment import Environment
 from steps.checks import SimpleLog, UrlCheck
 from steps.docker import DockerSwarmCheck, DockerSwarmDeploy
-from steps.git import GitClone, CheckoutMerged, GitUnmerge
+from steps.git import GitClone, CheckoutMerged, GitUnmerge, deployed_version
 from steps.shared_state import SharedStateHolderInMemory
 
-clone = GitClone(url="https://github.com/rudolf1/uber_backup.git", branchNamePrefix="ansible")
+# Only the stack directory of the big backup repository is needed: blobs are fetched for it alone
+clone = GitClone(url="https://github.com/rudolf1/uber_backup.git", branchNamePrefix="ansible",
+                 clone_filter="blob:none", sparse_paths=["poc/immich"])
 
 dockerSwarmCheck = DockerSwarmCheck(
 	stack_name="immich",
@@ -29,11 +31,16 @@ deployDocker = DockerSwarmDeploy(
 	},
 	stack_name="immich",
 	docker_compose_path="poc/immich/stack-compose.yml",
+	targeted=True,
 )
 
 checkPing = UrlCheck(
 	url="https://immich.rudolf.keenetic.link/api/server/ping",
 	expected={"res": "pong"},
+	samples=5,
+	latency_budget_ms=500,
+	on_budget_exceeded="warn",
+	version=lambda: deployed_version(dockerSwarmCheck.progress()),
 )
 logUrls = SimpleLog(message={
 	"userLinks": {
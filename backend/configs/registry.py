@@ -1,7 +1,7 @@
 from enironment import Environment
 from steps.checks import SimpleLog, UrlCheck
 from steps.docker import DockerSwarmCheck, DockerSwarmDeploy
-from steps.git import GitClone, CheckoutMerged, GitUnmerge
+from steps.git import GitClone, CheckoutMerged, GitUnmerge, deployed_version
 from steps.shared_state import SharedStateHolderInMemory
 
 clone = GitClone(url="https://github.com/rudolf1/uber_backup.git", branchNamePrefix="ansible")
@@ -34,6 +34,10 @@ deployDocker = DockerSwarmDeploy(
 checkPing = UrlCheck(
 	url="https://registry.rudolf.keenetic.link/v2/",
 	expected={},
+	samples=5,
+	latency_budget_ms=500,
+	on_budget_exceeded="warn",
+	version=lambda: deployed_version(dockerSwarmCheck.progress()),
 )
 logUrls = SimpleLog(message={
 	"userLinks": {
@@ -1,8 +1,11 @@
+import ast
 import importlib
+import importlib.util
 import logging
 import pkgutil
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional
+from types import ModuleType
+from typing import Dict, List, Optional, Set
 
 from enironment import Environment, SharedStateHolder
 from steps.step import CachingStep
@@ -30,12 +33,86 @@ def parse_arguments(cli_env_ids_str: str) -> ParsedEnvArgs:
 	return ParsedEnvArgs(includes=includes)
 
 
-def _discover_environments() -> Dict[str, Environment]:
-	import configs
+@dataclass
+class ConfigIndex:
+	modules: Dict[str, List[str]] = field(default_factory=dict)  # module name -> environment ids declared in it
+	unknown: List[str] = field(default_factory=list)  # modules whose ids can't be read without importing them
+
+	def module_of(self, env_id: str) -> Optional[str]:
+		for module, ids in self.modules.items():
+			if env_id in ids:
+				return module
+		return None
+
+
+def _declared_environment_ids(path: str) -> Optional[List[str]]:
+	"""
+	Ids of Environment(id="...") calls with a literal id, read from the module source without importing it.
+	None when the module declares an environment whose id is not a literal.
+	"""
+	with open(path, encoding="utf-8") as f:
+		tree = ast.parse(f.read(), filename=path)
+	ids: List[str] = []
+	for node in ast.walk(tree):
+		if not isinstance(node, ast.Call):
+			continue
+		func = node.func
+		name = func.id if isinstance(func, ast.Name) else func.attr if isinstance(func, ast.Attribute) else None
+		if name != "Environment":
+			continue
+		id_arg = next((kw.value for kw in node.keywords if kw.arg == "id"), node.args[0] if node.args else None)
+		if not isinstance(id_arg, ast.Constant) or not isinstance(id_arg.value, str):
+			return None
+		ids.append(id_arg.value)
+	return ids
+
+
+def index_configs(package: ModuleType) -> ConfigIndex:
+	index = ConfigIndex()
+	for module_info in pkgutil.iter_modules(package.__path__, prefix=f"{package.__name__}."):
+		spec = importlib.util.find_spec(module_info.name)
+		path = spec.origin if spec is not None else None
+		ids: Optional[List[str]] = None
+		if not module_info.ispkg and path is not None and path.endswith(".py"):
+			try:
+				ids = _declared_environment_ids(path)
+			except SyntaxError as e:
+				logger.warning(f"Unable to scan config {module_info.name}: {str(e)}")
+		if ids is None:
+			index.unknown.append(module_info.name)
+		else:
+			index.modules[module_info.name] = ids
+	return index
+
+
+def _modules_to_import(index: ConfigIndex, args: ParsedEnvArgs) -> List[str]:
+	everything = list(index.modules) + index.unknown
+	if args.excludes:
+		return [m for m in everything if m in index.unknown or not set(index.modules[m]) <= set(args.excludes)]
+	if args.includes:
+		selected: Set[str] = set(index.unknown)
+		for env_id in args.includes:
+			module = index.module_of(env_id)
+			if module is None:
+				logger.info(f"Environment {env_id} not found in config index, importing all configs")
+				return everything
+			selected.add(module)
+		return [m for m in everything if m in selected]
+	return everything
+
+
+def _discover_environments(args: Optional[ParsedEnvArgs] = None,
+                           package: Optional[ModuleType] = None) -> Dict[str, Environment]:
+	"""Import config modules (only those that can declare the requested environments) and collect their environments."""
+	if package is None:
+		import configs
+		package = configs
+	modules = _modules_to_import(index_configs(package), args or ParsedEnvArgs())
+	logger.info(f"Importing configs {modules}")
 	found: Dict[str, Environment] = {}
 	seen: set[int] = set()
-	for module_info in pkgutil.iter_modules(configs.__path__, prefix=f"{configs.__name__}."):
-		module = importlib.import_module(module_info.name)
+	for module_name in modules:
+		module = importlib.import_module(module_name)
 		for value in vars(module).values():
 			if isinstance(value, Environment) and id(value) not in seen:
 				seen.add(id(value))
@@ -44,8 +121,8 @@ def _discover_environments() -> Dict[str, Environment]:
 
 
 def build_environments(cli_env_ids_str: str) -> Dict[str, Environment]:
-    environments: Dict[str, Environment] = _discover_environments()
     args: ParsedEnvArgs = parse_arguments(cli_env_ids_str)
+    environments: Dict[str, Environment] = _discover_environments(args)
 
     if args.excludes:
         environments = {k: e for k, e in environments.items() if k not in args.excludes}
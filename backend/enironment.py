@@ -3,9 +3,12 @@ from __future__ import annotations
 import logging
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import List, runtime_checkable, Protocol, Tuple, TypeAlias, Any
+from typing import List, runtime_checkable, Protocol, Tuple, TypeAlias, Any, Callable, TYPE_CHECKING
 from typing import TypeVar
 
+if TYPE_CHECKING:
+	from steps.step import BackgroundJob, StepLog
+
 logger = logging.getLogger(__name__)
 
 T = TypeVar('T')
@@ -54,13 +57,19 @@ class SharedStateHolder(Protocol):
 
 class AbstractStep[T](ABC):
 	_env: Environment | None = None
+	_job: BackgroundJob[Any] | None = None
+	_log: StepLog | None = None
 
 	name: str
+	# Output depends only on the outputs (and fingerprints) of the dependencies: periodic cache resets skip the step
+	deterministic: bool = False
 
 	def __init__(self, n: str | None = None) -> None:
 		if n is None:
 			n = self.__class__.__name__
 		self.name = n
+		from steps.step import StepLog
+		self._log = StepLog()
 
 	@property
 	def env(self) -> Environment:
@@ -74,10 +83,44 @@ class AbstractStep[T](ABC):
 			raise BaseException(f"Environment not set for {self.name}")
 		self._env = value
 
+	@property
+	def log(self) -> StepLog:
+		"""Recent output lines of this step (build output, deploy output), streamed to the UI on demand."""
+		if self._log is None:
+			raise BaseException(f"Log not initialized for {self.name}")
+		return self._log
+
 	@abstractmethod
 	def progress(self) -> T:
 		pass
 
+	def fingerprint(self) -> str | None:
+		"""Version of the state behind the output, for steps whose output stays the same when it changes (a path)."""
+		return None
+
+	def run_job[R](self, key: str, work: Callable[[BackgroundJob[R]], R], background: bool = False) -> R:
+		"""
+		Run long step work identified by key.
+		In background mode the work is started once in its own thread and polled on later calls:
+		JobInProgressException is raised until it finishes. A failed job is dropped so the next call retries.
+		A new key never starts while the previous job still runs: the running job is reported until it is done.
+		"""
+		from steps.step import BackgroundJob, JobInProgressException
+		if not background:
+			return BackgroundJob(key, self.name, work).run()
+		job = self._job
+		if job is not None and job.job_id != key:
+			if not job.done:
+				logger.info(f"{self.name}: job {key[:8]} waits for running job {job.job_id[:8]}")
+				raise JobInProgressException(job)
+			job = None
+		if job is None:
+			job = BackgroundJob(key, self.name, work).start()
+			self._job = job
+		if job.failed:
+			self._job = None
+		return job.result()
+
 
 def wrap_in_cached(e: Environment) -> Environment:
 	from dataclasses import replace
@@ -0,0 +1,133 @@
+import logging
+import os
+import threading
+import time
+from contextlib import AbstractContextManager, nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple
+
+import git
+
+import metrics
+import tracing
+from enironment import Environment
+from steps.git import GitClone
+from steps.step import CachingStep
+
+logger = logging.getLogger(__name__)
+
+# Seconds between maintenance runs of the managed clones, 0 disables maintenance
+MAINTENANCE_INTERVAL = int(os.getenv("GIT_MAINTENANCE_INTERVAL", "3600"))
+# Unreachable objects younger than this are kept: merges in flight write objects before a ref points at them
+PRUNE_EXPIRE = os.getenv("GIT_MAINTENANCE_PRUNE_EXPIRE", "2.weeks.ago")
+MIDX_BATCH_SIZE = os.getenv("GIT_MAINTENANCE_MIDX_BATCH_SIZE", "512m")
+
+# Same tasks as `git maintenance run --task=...`, plus bloom filters for the commit-graph and a prune
+MAINTENANCE_TASKS: List[Tuple[str, List[List[str]]]] = [
+	("pack-refs", [["pack-refs", "--all", "--prune"]]),
+	("loose-objects", [["repack", "-d", "-l", "--no-write-bitmap-index"], ["prune-packed"]]),
+	("incremental-repack", [
+		["multi-pack-index", "write"],
+		["multi-pack-index", "expire"],
+		["multi-pack-index", "repack", f"--batch-size={MIDX_BATCH_SIZE}"],
+	]),
+	("prune", [["prune", f"--expire={PRUNE_EXPIRE}"]]),
+	("commit-graph", [["commit-graph", "write", "--reachable", "--split", "--changed-paths"]]),
+]
+
+maintenance_duration = metrics.REGISTRY.register(metrics.Histogram(
+	"brencher_git_maintenance_duration_seconds", "Duration of git maintenance tasks on managed clones", ("task",)))
+maintenance_errors = metrics.REGISTRY.register(metrics.Counter(
+	"brencher_git_maintenance_errors_total", "Failed git maintenance tasks", ("task",)))
+
+
+@dataclass
+class MaintenanceTask:
+	task: str
+	duration_s: float
+	error: str | None = None
+
+
+@dataclass
+class MaintenanceReport:
+	repo_path: str
+	started_at: float
+	total_s: float = 0.0
+	tasks: List[MaintenanceTask] = field(default_factory=list)
+
+	def summary(self) -> str:
+		tasks = ", ".join(f"{t.task} {t.duration_s:.2f}s{' FAILED' if t.error else ''}" for t in self.tasks)
+		return f"{self.repo_path} in {self.total_s:.2f}s: {tasks}"
+
+
+def managed_repositories(environments: List[Environment]) -> List[str]:
+	"""Working directories of all GitClone steps that are already cloned, each once."""
+	paths: Dict[str, None] = {}
+	for env in environments:
+		for step in env.pipeline:
+			inner = step._step if isinstance(step, CachingStep) else step
+			if isinstance(inner, GitClone):
+				path = inner.resolve_repo_path()
+				if os.path.exists(os.path.join(path, ".git")):
+					paths[path] = None
+	return list(paths)
+
+
+def maintain_repository(repo_path: str) -> MaintenanceReport:
+	"""Run the maintenance tasks one after another; a failed task is reported and the next ones still run."""
+	report = MaintenanceReport(repo_path=repo_path, started_at=time.time())
+	repo = git.Repo(repo_path)
+	for task, commands in MAINTENANCE_TASKS:
+		started = time.perf_counter()
+		error = None
+		with tracing.span("git.maintenance", task=task, repo=repo_path):
+			try:
+				for command in commands:
+					repo.git.execute(["git", *command])
+			except git.GitCommandError as e:
+				error = str(e)
+				maintenance_errors.inc(task)
+				logger.warning(f"Git maintenance {task} failed for {repo_path}: {error}")
+		duration = time.perf_counter() - started
+		maintenance_duration.observe(duration, task)
+		report.tasks.append(MaintenanceTask(task, round(duration, 3), error))
+	report.total_s = round(time.time() - report.started_at, 3)
+	return report
+
+
+def run_maintenance(environments: List[Environment],
+                    lock: AbstractContextManager[Any] | None = None) -> List[MaintenanceReport]:
+	"""
+	Maintain every managed clone, each one while holding lock: pack-refs, repack and prune must not race
+	the fetch and checkout of the processing thread (a ref lock conflict there ends in a full reclone).
+	"""
+	reports = []
+	for repo_path in managed_repositories(environments):
+		with lock if lock is not None else nullcontext():
+			report = maintain_repository(repo_path)
+		logger.info(f"Git maintenance of {report.summary()}")
+		reports.append(report)
+	return reports
+
+
+class MaintenanceThread(threading.Thread):
+	"""Runs run_maintenance every interval seconds, the first time one interval after start."""
+
+	def __init__(self, environments: List[Environment], interval: float = MAINTENANCE_INTERVAL,
+	             lock: AbstractContextManager[Any] | None = None) -> None:
+		super().__init__(name="git-maintenance", daemon=True)
+		self.environments = environments
+		self.interval = interval
+		self.lock = lock
+		self.reports: List[MaintenanceReport] = []
+		self.stopped = threading.Event()
+
+	def run(self) -> None:
+		while not self.stopped.wait(self.interval):
+			try:
+				self.reports = run_maintenance(self.environments, self.lock)
+			except BaseException as e:
+				logger.error(f"Git maintenance failed: {str(e)}")
+
+	def stop(self) -> None:
+		self.stopped.set()
@@ -0,0 +1,160 @@
+import bisect
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _escape(value: str) -> str:
+	return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+	if not names:
+		return ""
+	return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+	if value == float("inf"):
+		return "+Inf"
+	return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric(ABC):
+	kind = "untyped"
+
+	def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+		self.name = name
+		self.documentation = documentation
+		self.label_names = tuple(labels)
+		self._lock = threading.Lock()
+
+	def _key(self, labels: Sequence[str]) -> LabelValues:
+		if len(labels) != len(self.label_names):
+			raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+		return tuple(str(it) for it in labels)
+
+	@abstractmethod
+	def samples(self) -> List[str]:
+		pass
+
+	def render(self) -> str:
+		lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+		return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+	kind = "counter"
+
+	def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+		super().__init__(name, documentation, labels)
+		self._values: Dict[LabelValues, float] = {}
+
+	def inc(self, *labels: str, amount: float = 1) -> None:
+		key = self._key(labels)
+		with self._lock:
+			self._values[key] = self._values.get(key, 0) + amount
+
+	def value(self, *labels: str) -> float:
+		with self._lock:
+			return self._values.get(self._key(labels), 0)
+
+	def samples(self) -> List[str]:
+		with self._lock:
+			items = sorted(self._values.items())
+		return [f"{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+	kind = "gauge"
+
+	def set(self, value: float, *labels: str) -> None:
+		key = self._key(labels)
+		with self._lock:
+			self._values[key] = value
+
+	def dec(self, *labels: str, amount: float = 1) -> None:
+		self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+	kind = "histogram"
+
+	def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+	             buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+		super().__init__(name, documentation, labels)
+		self.buckets = tuple(sorted(buckets))
+		self._counts: Dict[LabelValues, List[int]] = {}
+		self._sums: Dict[LabelValues, float] = {}
+
+	def observe(self, value: float, *labels: str) -> None:
+		key = self._key(labels)
+		with self._lock:
+			counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+			counts[bisect.bisect_left(self.buckets, value)] += 1
+			self._sums[key] = self._sums.get(key, 0) + value
+
+	def count(self, *labels: str) -> int:
+		with self._lock:
+			return sum(self._counts.get(self._key(labels), []))
+
+	def samples(self) -> List[str]:
+		with self._lock:
+			items = sorted((k, list(v), self._sums[k]) for k, v in self._counts.items())
+		lines: List[str] = []
+		for key, counts, total in items:
+			cumulative = 0
+			for bound, count in zip(self.buckets + (float("inf"),), counts):
+				cumulative += count
+				labels = _format_labels(self.label_names + ("le",), key + (_format_value(bound),))
+				lines.append(f"{self.name}_bucket{labels} {cumulative}")
+			labels = _format_labels(self.label_names, key)
+			lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+			lines.append(f"{self.name}_count{labels} {cumulative}")
+		return lines
+
+
+class Registry:
+	def __init__(self) -> None:
+		self._metrics: Dict[str, Metric] = {}
+		self._lock = threading.Lock()
+
+	def register[M: Metric](self, metric: M) -> M:
+		with self._lock:
+			if metric.name in self._metrics:
+				raise ValueError(f"Metric {metric.name} already registered")
+			self._metrics[metric.name] = metric
+		return metric
+
+	def render(self) -> str:
+		"""All metrics in the Prometheus text exposition format."""
+		with self._lock:
+			metrics = list(self._metrics.values())
+		return "\n".join(m.render() for m in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+step_executions = REGISTRY.register(Counter(
+	"brencher_step_executions_total", "Step executions (cache misses) by result", ("env", "step", "result")))
+step_cache_hits = REGISTRY.register(Counter(
+	"brencher_step_cache_hits_total", "CachingStep calls served from cache", ("env", "step")))
+step_duration = REGISTRY.register(Histogram(
+	"brencher_step_duration_seconds", "Duration of step executions", ("env", "step")))
+tick_duration = REGISTRY.register(Histogram(
+	"brencher_tick_duration_seconds", "Duration of process_all_jobs ticks"))
+ticks = REGISTRY.register(Counter(
+	"brencher_ticks_total", "process_all_jobs ticks by outcome", ("outcome",)))
+broadcast_bytes = REGISTRY.register(Counter(
+	"brencher_broadcast_bytes_total", "Bytes sent to WebSocket clients by event", ("event",)))
+broadcast_messages = REGISTRY.register(Counter(
+	"brencher_broadcast_messages_total", "Messages sent to WebSocket clients by event", ("event",)))
+websocket_clients = REGISTRY.register(Gauge(
+	"brencher_websocket_clients", "Connected WebSocket clients by endpoint", ("endpoint",)))
+git_fetches = REGISTRY.register(Counter(
+	"brencher_git_fetches_total", "GitClone fetches by outcome (skipped when the remote refs did not change)",
+	("env", "outcome")))
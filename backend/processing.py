@@ -1,23 +1,96 @@
 import logging
 import time
-from typing import List, Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Callable, Tuple
 
-from enironment import Environment
-from steps.step import CachingStep
+import metrics
+import tracing
+from enironment import AbstractStep, Environment
+from steps.checks import UrlCheck
+from steps.step import CachingStep, JobInProgressException
 
 logger = logging.getLogger(__name__)
 
 _last_reset_time: float = 0
 RESET_INTERVAL = 3 * 60  # 3 minutes in seconds
+URL_CHECK_WORKERS = 8
 
 
 def reset_caches(environemnts: List[Environment]) -> None:
+	"""Force steps to run again; deterministic ones rerun only when their inputs change."""
 	for env in environemnts:
 		for step in env.pipeline:
-			if isinstance(step, CachingStep):
+			if isinstance(step, CachingStep) and not step._step.deterministic:
 				step.reset()
 
 
+def _is_url_check(step: AbstractStep[Any]) -> bool:
+	return isinstance(step, UrlCheck) or (isinstance(step, CachingStep) and isinstance(step._step, UrlCheck))
+
+
+def run_url_checks(checks: List[AbstractStep[Any]]) -> Dict[AbstractStep[Any], BaseException | None]:
+	"""
+	Run UrlCheck steps concurrently. Returns the outcome per step (None on success).
+	Versions are resolved here on the calling thread, so the pool threads only do HTTP.
+	"""
+	if not checks:
+		return {}
+	for step in checks:
+		check = step._step if isinstance(step, CachingStep) else step
+		if isinstance(check, UrlCheck):
+			check.pin_version()
+
+	def run(step: AbstractStep[Any]) -> BaseException | None:
+		try:
+			step.progress()
+			return None
+		except BaseException as e:
+			return e
+
+	with ThreadPoolExecutor(max_workers=min(URL_CHECK_WORKERS, len(checks)), thread_name_prefix="url-check") as pool:
+		return dict(zip(checks, pool.map(tracing.in_current_context(run), checks)))
+
+
+def mark_caches_fresh() -> None:
+	"""Postpone the periodic cache reset, e.g. right after the caches were populated by warmup."""
+	global _last_reset_time
+	_last_reset_time = time.time()
+
+
+def process_environment(
+		env: Environment,
+		onupdate: Callable[[], None],
+		start: int = 0,
+		defer_checks: bool = False
+) -> Tuple[bool, int | None]:
+	"""
+	Progress the steps of one environment from start on. Returns whether some step failed or is still running.
+	With defer_checks the environment pauses at its next UrlCheck and returns that step's index (None once
+	the pipeline is done): process_all_jobs runs the paused checks together and resumes after them.
+	"""
+	has_error = False
+	with tracing.span("environment", env=env.id):
+		for index in range(start, len(env.pipeline)):
+			step = env.pipeline[index]
+			if defer_checks and _is_url_check(step):
+				return has_error, index
+			try:
+				with tracing.span("onupdate"):
+					onupdate()
+				step.progress()
+			except JobInProgressException as e:
+				logger.info(f"Release {env.id}, job {step.name} is running in background: {e.job.snapshot()}")
+				has_error = True
+			except BaseException as e:
+				error_msg = f"Error processing release {env.id}, job {step.name}: {str(e)}"
+				logger.error(error_msg)
+				has_error = True
+			finally:
+				with tracing.span("onupdate"):
+					onupdate()
+	return has_error, None
+
+
 def process_all_jobs(
 		environemnts: List[Environment],
 		onupdate: Callable[[], None]
@@ -28,16 +101,29 @@ def process_all_jobs(
 		reset_caches(environemnts)
 		_last_reset_time = current_time
 
+	started = time.perf_counter()
 	has_error = False
-	for env in environemnts:
-		for step in env.pipeline:
-			try:
-				onupdate()
-				step.progress()
-			except BaseException as e:
-				error_msg = f"Error processing release {env.id}, job {step.name}: {str(e)}"
-				logger.error(error_msg)
-				has_error = True
-			finally:
-				onupdate()
+	with tracing.trace_tick("tick"):
+		# Every pipeline runs up to its next UrlCheck, the checks of all environments run concurrently and the
+		# pipelines resume after them: checks see this tick's deploys and the pipeline order is kept
+		resume = {env.id: 0 for env in environemnts}
+		while resume:
+			paused: Dict[AbstractStep[Any], Tuple[Environment, int]] = {}
+			for env in environemnts:
+				if env.id not in resume:
+					continue
+				env_error, index = process_environment(env, onupdate, resume[env.id], defer_checks=True)
+				has_error = has_error or env_error
+				if index is not None:
+					paused[env.pipeline[index]] = (env, index)
+			with tracing.span("url_checks"):
+				checked = run_url_checks(list(paused))
+			for step, error in checked.items():
+				if error is not None:
+					logger.error(f"Error processing release {step.env.id}, job {step.name}: {str(error)}")
+					has_error = True
+			onupdate()
+			resume = {env.id: index + 1 for env, index in paused.values() if index + 1 < len(env.pipeline)}
+	metrics.tick_duration.observe(time.perf_counter() - started)
+	metrics.ticks.inc("error" if has_error else "ok")
 	return has_error
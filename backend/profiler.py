@@ -0,0 +1,62 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+from typing import Dict, List, Optional, Set
+
+MAX_PROFILE_SECONDS = 120
+MIN_INTERVAL_SECONDS = 0.001
+
+
+def _frame_label(frame: FrameType) -> str:
+	code = frame.f_code
+	return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _stack(frame: FrameType | None) -> List[str]:
+	stack: List[str] = []
+	while frame is not None:
+		stack.append(_frame_label(frame))
+		frame = frame.f_back
+	stack.reverse()
+	return stack
+
+
+class SamplingProfiler:
+	"""
+	Wall-clock sampler: reads sys._current_frames() of the selected threads every interval seconds
+	and aggregates the stacks. Costs nothing while not running.
+	"""
+
+	def __init__(self, interval: float = 0.005, thread_ids: Optional[Set[int]] = None) -> None:
+		self.interval = max(interval, MIN_INTERVAL_SECONDS)
+		self.thread_ids = thread_ids
+		self.samples: Counter[str] = Counter()
+		self.sample_count = 0
+
+	def _thread_names(self) -> Dict[int, str]:
+		return {t.ident: t.name for t in threading.enumerate() if t.ident is not None}
+
+	def sample_once(self) -> None:
+		me = threading.get_ident()
+		names = self._thread_names()
+		for thread_id, frame in sys._current_frames().items():
+			if thread_id == me or (self.thread_ids is not None and thread_id not in self.thread_ids):
+				continue
+			stack = [names.get(thread_id, str(thread_id))] + _stack(frame)
+			self.samples[";".join(stack)] += 1
+		self.sample_count += 1
+
+	def run(self, duration: float) -> 'SamplingProfiler':
+		"""Sample on the calling thread for duration seconds (capped by MAX_PROFILE_SECONDS)."""
+		deadline = time.monotonic() + min(duration, MAX_PROFILE_SECONDS)
+		while time.monotonic() < deadline:
+			self.sample_once()
+			time.sleep(self.interval)
+		return self
+
+	def collapsed(self) -> str:
+		"""Stacks in the collapsed format understood by flamegraph.pl, speedscope and inferno."""
+		return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
@@ -1,24 +1,127 @@
 import logging
-from typing import Any
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, List, Literal, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 from enironment import AbstractStep
 
 logger = logging.getLogger(__name__)
 
+HTTP_POOL_SIZE = 16
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 10.0
 
-class UrlCheck(AbstractStep[str]):
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
 
-	def __init__(self, url: str, expected: Any, **kwargs):  # type: ignore[no-untyped-def]
+
+def http_session() -> requests.Session:
+	"""Process-wide keep-alive session shared by all HTTP checks, so every tick reuses pooled connections."""
+	global _session
+	with _session_lock:
+		if _session is None:
+			session = requests.Session()
+			adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+			session.mount("http://", adapter)
+			session.mount("https://", adapter)
+			_session = session
+		return _session
+
+
+def percentile(values: List[float], q: float) -> float:
+	"""Nearest-rank percentile of the values (q in 0..100)."""
+	if not values:
+		raise ValueError("No values")
+	ordered = sorted(values)
+	rank = max(1, math.ceil(q / 100 * len(ordered)))
+	return ordered[rank - 1]
+
+
+def _resolve_version(version: Callable[[], str] | None, url: str) -> str | None:
+	if version is None:
+		return None
+	try:
+		return version()
+	except BaseException as e:
+		logger.warning(f"Unable to resolve version for {url}: {str(e)}")
+		return None
+
+
+@dataclass
+class UrlCheckResult:
+	status: str
+	status_code: int
+	latency_ms: float
+	samples: int = 1
+	p50_ms: float | None = None
+	p95_ms: float | None = None
+	p99_ms: float | None = None
+	response_bytes: int | None = None
+	version: str | None = None
+	checked_at: float | None = None
+	budget_ms: float | None = None
+	budget_exceeded: bool = False
+	baseline: 'UrlCheckResult | None' = None  # last result of a different version (or the previous run)
+
+
+class UrlCheck(AbstractStep[UrlCheckResult]):
+
+	def __init__(self, url: str, expected: Any,  # type: ignore[no-untyped-def]
+	             connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+	             read_timeout: float = DEFAULT_READ_TIMEOUT,
+	             samples: int = 1,
+	             latency_budget_ms: float | None = None,
+	             budget_percentile: Literal[50, 95, 99] = 95,
+	             on_budget_exceeded: Literal["fail", "warn"] = "fail",
+	             version: Callable[[], str] | None = None,
+	             history_size: int = 20,
+	             **kwargs):
 		super().__init__(**kwargs)
+		if samples < 1:
+			raise BaseException(f"samples must be positive, got {samples}")
 		self.url = url
 		self.expected = expected
+		self.connect_timeout = connect_timeout
+		self.read_timeout = read_timeout
+		self.samples = samples
+		self.latency_budget_ms = latency_budget_ms
+		self.budget_percentile = budget_percentile
+		self.on_budget_exceeded = on_budget_exceeded
+		self.version = version
+		self.history: deque[UrlCheckResult] = deque(maxlen=history_size)
+		self._pinned_version: Tuple[str | None] | None = None
 
-	def progress(self) -> str:
-		logger.info(f"Checking {self.url}")
-		result = requests.get(self.url)
+	def _sample(self) -> tuple[requests.Response, float]:
+		started = time.perf_counter()
+		result = http_session().get(self.url, timeout=(self.connect_timeout, self.read_timeout))
+		latency_ms = round((time.perf_counter() - started) * 1000, 1)
 		if result.status_code != 200:
-			raise Exception(f"URL check failed: status code {result.status_code}")
+			raise Exception(f"URL check failed: status code {result.status_code} ({latency_ms} ms)")
+		return result, latency_ms
+
+	def _baseline(self, version: str | None) -> UrlCheckResult | None:
+		for previous in reversed(self.history):
+			if version is None or previous.version != version:
+				return previous
+		return None
+
+	def pin_version(self) -> None:
+		"""Resolve the version label now, on the calling thread; the next progress() reports it."""
+		self._pinned_version = (_resolve_version(self.version, self.url),)
+
+	def progress(self) -> UrlCheckResult:
+		logger.info(f"Checking {self.url}")
+		pinned, self._pinned_version = self._pinned_version, None
+		latencies: List[float] = []
+		for _ in range(self.samples):
+			result, latency_ms = self._sample()
+			latencies.append(latency_ms)
 		json_result = result.json()
 
 		def compare_nested(expected: Any, actual: Any, path: str = "") -> None:
@@ -46,7 +149,176 @@ class UrlCheck(AbstractStep[str]):
 			compare_nested(self.expected, json_result)
 		elif callable(self.expected):
 			self.expected(json_result)
-		return "Ok"
+
+		version = pinned[0] if pinned is not None else _resolve_version(self.version, self.url)
+		p50, p95, p99 = (percentile(latencies, q) for q in (50, 95, 99))
+		measured = {50: p50, 95: p95, 99: p99}[self.budget_percentile]
+		exceeded = self.latency_budget_ms is not None and measured > self.latency_budget_ms
+		check = UrlCheckResult(
+			status="Slow" if exceeded else "Ok",
+			status_code=result.status_code,
+			latency_ms=p50,
+			samples=len(latencies),
+			p50_ms=p50,
+			p95_ms=p95,
+			p99_ms=p99,
+			response_bytes=len(result.content),
+			version=version,
+			checked_at=time.time(),
+			budget_ms=self.latency_budget_ms,
+			budget_exceeded=exceeded,
+			baseline=self._baseline(version),
+		)
+		self.history.append(replace(check, baseline=None))
+		if exceeded:
+			message = (f"URL check latency budget exceeded for {self.url}: "
+			           f"p{self.budget_percentile} {measured} ms > {self.latency_budget_ms} ms")
+			if self.on_budget_exceeded == "fail":
+				raise Exception(message)
+			logger.warning(message)
+		return check
+
+
+MAX_PROBE_REQUESTS = 1000
+
+
+@dataclass
+class LoadProbeResult:
+	version: str | None
+	requests: int
+	errors: int
+	concurrency: int
+	duration_s: float
+	throughput_rps: float
+	p50_ms: float | None
+	p95_ms: float | None
+	p99_ms: float | None
+	probed_at: float
+	baseline: 'LoadProbeResult | None' = None  # last run of a different version
+	p95_change_pct: float | None = None
+	throughput_change_pct: float | None = None
+	problems: List[str] = field(default_factory=list)
+
+	@property
+	def regressed(self) -> bool:
+		return len(self.problems) > 0
+
+
+class LoadProbe(AbstractStep[LoadProbeResult]):
+	"""
+	Fires a bounded burst of concurrent GET requests at url once deploy has finished and
+	compares throughput and latency percentiles with the last run of a different version.
+	A version that already has a recorded run is not probed again. Nothing is probed while the deploy still has
+	pending changes (dry mode) or while a configured version cannot be resolved (services running mixed versions).
+	"""
+
+	def __init__(self, url: str,  # type: ignore[no-untyped-def]
+	             deploy: AbstractStep[Any] | None = None,
+	             request_count: int = 50,
+	             concurrency: int = 5,
+	             version: Callable[[], str] | None = None,
+	             max_p95_regression_pct: float | None = None,
+	             max_error_rate: float = 0.0,
+	             on_regression: Literal["fail", "warn"] = "warn",
+	             connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+	             read_timeout: float = DEFAULT_READ_TIMEOUT,
+	             history_size: int = 20,
+	             **kwargs):
+		super().__init__(**kwargs)
+		if not 0 < request_count <= MAX_PROBE_REQUESTS:
+			raise BaseException(f"request_count must be in 1..{MAX_PROBE_REQUESTS}, got {request_count}")
+		if not 0 < concurrency <= HTTP_POOL_SIZE:
+			raise BaseException(f"concurrency must be in 1..{HTTP_POOL_SIZE}, got {concurrency}")
+		self.url = url
+		self.deploy = deploy
+		self.request_count = request_count
+		self.concurrency = concurrency
+		self.version = version
+		self.max_p95_regression_pct = max_p95_regression_pct
+		self.max_error_rate = max_error_rate
+		self.on_regression = on_regression
+		self.connect_timeout = connect_timeout
+		self.read_timeout = read_timeout
+		self.history: deque[LoadProbeResult] = deque(maxlen=history_size)
+
+	def _request(self, attempt: int) -> float | None:
+		"""Latency of one request in ms, None when it failed."""
+		started = time.perf_counter()
+		try:
+			response = http_session().get(self.url, timeout=(self.connect_timeout, self.read_timeout))
+			_ = response.content
+		except requests.RequestException as e:
+			logger.debug(f"Load probe request to {self.url} failed: {str(e)}")
+			return None
+		if response.status_code >= 400:
+			return None
+		return round((time.perf_counter() - started) * 1000, 1)
+
+	def _burst(self) -> tuple[List[float], int, float]:
+		started = time.perf_counter()
+		with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="load-probe") as pool:
+			outcomes = list(pool.map(self._request, range(self.request_count)))
+		duration = time.perf_counter() - started
+		latencies = [it for it in outcomes if it is not None]
+		return latencies, len(outcomes) - len(latencies), duration
+
+	def _baseline(self, version: str | None) -> LoadProbeResult | None:
+		for previous in reversed(self.history):
+			if version is None or previous.version != version:
+				return previous
+		return None
+
+	def progress(self) -> LoadProbeResult:
+		if self.deploy is not None:
+			deployed = self.deploy.progress()
+			if isinstance(deployed, dict) and deployed.get("diffs"):
+				raise BaseException(f"Deploy has pending changes, not probing {self.url}")
+		version = _resolve_version(self.version, self.url)
+		if version is None and self.version is not None:
+			raise BaseException(f"Deployed version unknown, not probing {self.url}")
+		if self.history and self.history[-1].version == version:
+			return self._verdict(self.history[-1])
+
+		logger.info(f"Load probing {self.url}: {self.request_count} requests, concurrency {self.concurrency}")
+		latencies, errors, duration = self._burst()
+		p50, p95, p99 = (percentile(latencies, q) if latencies else None for q in (50, 95, 99))
+		probe = LoadProbeResult(
+			version=version,
+			requests=self.request_count,
+			errors=errors,
+			concurrency=self.concurrency,
+			duration_s=round(duration, 3),
+			throughput_rps=round(len(latencies) / duration, 1) if duration > 0 else 0.0,
+			p50_ms=p50,
+			p95_ms=p95,
+			p99_ms=p99,
+			probed_at=time.time(),
+			baseline=self._baseline(version),
+		)
+		baseline = probe.baseline
+		if baseline is not None:
+			if baseline.p95_ms and probe.p95_ms is not None:
+				probe.p95_change_pct = round((probe.p95_ms / baseline.p95_ms - 1) * 100, 1)
+			if baseline.throughput_rps:
+				probe.throughput_change_pct = round((probe.throughput_rps / baseline.throughput_rps - 1) * 100, 1)
+
+		problems: List[str] = []
+		if errors / self.request_count > self.max_error_rate:
+			problems.append(f"{errors} of {self.request_count} requests failed")
+		if (self.max_p95_regression_pct is not None and probe.p95_change_pct is not None
+				and probe.p95_change_pct > self.max_p95_regression_pct):
+			problems.append(f"p95 {probe.p95_ms} ms is {probe.p95_change_pct}% slower than "
+			                f"{baseline.version if baseline else None}")
+		probe.problems = problems
+		self.history.append(replace(probe, baseline=None))
+		if problems:
+			logger.warning(f"Load probe of {self.url} regressed: {'; '.join(problems)}")
+		return self._verdict(probe)
+
+	def _verdict(self, probe: LoadProbeResult) -> LoadProbeResult:
+		if probe.regressed and self.on_regression == "fail":
+			raise Exception(f"Load probe of {self.url} regressed: {'; '.join(probe.problems)}")
+		return probe
 
 
 class SimpleLog(AbstractStep[Any]):
@@ -1,20 +1,113 @@
+import copy
 import logging
 import os
 import re
 import subprocess
-from dataclasses import dataclass
-from typing import List, Dict, Callable, Any, Mapping, Protocol, Union, runtime_checkable
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import List, Dict, Callable, Any, Iterator, Mapping, Protocol, Tuple, Union, runtime_checkable
 
 import docker
+import git
 import yaml
 from docker import errors as docker_errors
 from dotenv import dotenv_values
 from enironment import AbstractStep
 from steps.git import GitClone, HasVersion
+from steps.step import BackgroundJob, _stable_hash
 
 logger = logging.getLogger(__name__)
 
 
+_BUILD_STEP_RE = re.compile(r'^Step (\d+)/(\d+)')
+
+VERSION_LABEL = "org.brencher.version"
+SPEC_HASH_LABEL = "org.brencher.spec-hash"
+STACK_HASH_LABEL = "org.brencher.stack-hash"
+
+
+@dataclass
+class RenderedCompose:
+	document: Dict[str, Any]
+	text: str
+
+
+class ComposeCache:
+	"""
+	Rendered compose documents keyed by (commit sha, compose path, env overrides hash, kind).
+	The file stat is part of the key too, so uncommitted edits are picked up. Cached documents are shared: do not mutate.
+	"""
+
+	def __init__(self, max_entries: int = 32) -> None:
+		self.max_entries = max_entries
+		self._entries: OrderedDict[str, RenderedCompose] = OrderedDict()
+		self._lock = threading.Lock()
+
+	@staticmethod
+	def _commit(repo_path: str) -> str:
+		try:
+			return git.Repo(repo_path).head.commit.hexsha
+		except Exception:
+			return ""
+
+	def get(self, repo_path: str, compose_path: str, env: Dict[str, Any], kind: str,
+	        render: Callable[[str], RenderedCompose]) -> RenderedCompose:
+		absolute_path = os.path.join(repo_path, compose_path)
+		stat = os.stat(absolute_path)
+		key = _stable_hash([self._commit(repo_path), absolute_path, stat.st_mtime_ns, stat.st_size, _stable_hash(env), kind])
+		with self._lock:
+			if key in self._entries:
+				self._entries.move_to_end(key)
+				return self._entries[key]
+		with open(absolute_path, 'r') as f:
+			rendered = render(f.read())
+		with self._lock:
+			self._entries[key] = rendered
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+		return rendered
+
+
+compose_cache = ComposeCache()
+
+
+def _merge_dicts(a: Dict[str, Any], b: Dict[str, Any]) -> None:
+	for k, v in b.items():
+		if (
+				k in a
+				and isinstance(a[k], dict)
+				and isinstance(v, dict)
+		):
+			_merge_dicts(a[k], v)
+		else:
+			a[k] = v
+
+
+def _render_stack(raw: str, env: Dict[str, Any]) -> RenderedCompose:
+	"""Compose document as deployed to swarm: no build sections, brencher labels, env overrides merged in."""
+	env = dict(env)
+	content = re.sub(r'\$\{([^}]+)\}', lambda m: env.get(m.group(1), ""), raw)
+	compose = yaml.safe_load(content)
+	if "services" in compose:
+		for svc in compose["services"].values():
+			if "build" in svc:
+				del svc["build"]
+			svc["labels"] = {VERSION_LABEL: env["version"]}
+	del env["version"]
+	_merge_dicts(compose, copy.deepcopy(env))
+	# Hashes let a later deploy tell whether only image/labels changed (see targeted mode)
+	stack_hash = _stable_hash({k: v for k, v in compose.items() if k != "services"})
+	for svc in compose.get("services", {}).values():
+		svc["labels"][SPEC_HASH_LABEL] = _stable_hash({k: v for k, v in svc.items() if k not in ("image", "labels")})
+		svc["labels"][STACK_HASH_LABEL] = stack_hash
+	# logger.info(f"Final compose: {compose}")
+	return RenderedCompose(document=compose, text=yaml.safe_dump(compose))
+
+
 class DockerComposeBuild(AbstractStep[Dict[str, str]]):
 	def __init__(self,
 	             wd: GitClone,  # TODO should be CheckoutMerged
@@ -25,6 +118,7 @@ class DockerComposeBuild(AbstractStep[Dict[str, str]]):
 	             publish: bool,
 	             envs: Callable[[], Dict[str, Any]], 
 				 build_cache: bool = False,
+				 background: bool = False,
 				 **kwargs: Any) -> None:
 		super().__init__(**kwargs)
 		self.wd = wd
@@ -35,81 +129,137 @@ class DockerComposeBuild(AbstractStep[Dict[str, str]]):
 		self.docker_repo_url = docker_repo_url
 		self.publish = publish
 		self.build_cache = build_cache
+		self.background = background
 
 	def progress(self) -> Dict[str, str]:
 		"""
 		Build and push Docker images defined in a docker-compose file.
 		Returns a dict mapping image name to its SHA digest.
 		"""
+		env = self.envs()
+		# Parse docker-compose file
+		wd = self.wd.progress()
+		docker_compose_absolute_path = os.path.join(wd, self.docker_compose_path)
+
+		def render(raw: str) -> RenderedCompose:
+			content = re.sub(r'\$\{([^}]+)\}', lambda m: env[m.group(1)], raw)
+			return RenderedCompose(document=yaml.safe_load(content), text=content)
+
+		compose = compose_cache.get(wd, self.docker_compose_path, env, "build", render).document
+		services = compose.get('services', {})
+
+		targets: List[Tuple[str, str, str]] = []
+		for name, svc in services.items():
+			build_section = svc.get('build')
+			if build_section is None:
+				continue
+			if isinstance(build_section, dict):
+				build_ctx = build_section.get('context', '.')
+				build_dockerfile = build_section.get('dockerfile', 'Dockerfile')
+			else:
+				build_ctx = build_section
+				build_dockerfile = 'Dockerfile'
+
+			build_ctx = os.path.join(os.path.dirname(docker_compose_absolute_path), build_ctx) 
+			build_dockerfile = os.path.join(os.path.dirname(docker_compose_absolute_path), build_dockerfile) 
+
+			image = svc.get('image')
+			if not build_ctx or not image:
+				continue
+			targets.append((image, build_ctx, build_dockerfile))
+
+		# The job builds from its own worktree of this commit: a checkout of the next merge must not change its files
+		commit = git.Repo(wd).head.commit.hexsha
+		targets = [(image, os.path.relpath(ctx, wd), os.path.relpath(dockerfile, wd)) for image, ctx, dockerfile in targets]
+		key = _stable_hash([commit, targets, self.publish, self.build_cache])
+		return self.run_job(key, lambda job: self._build_commit(job, wd, commit, targets), background=self.background)
+
+	def _build_commit(self, job: BackgroundJob[Dict[str, str]], wd: str, commit: str,
+	                  targets: List[Tuple[str, str, str]]) -> Dict[str, str]:
+		"""Build targets (paths relative to the repository root) from a detached worktree of commit."""
+		repo = git.Repo(wd)
+		with tempfile.TemporaryDirectory(prefix="brencher_build_") as build_dir:
+			tree = os.path.join(build_dir, "tree")
+			repo.git.worktree('prune')
+			repo.git.worktree('add', '--detach', tree, commit)
+			try:
+				return self._build_all(job, [(image, os.path.join(tree, ctx), os.path.join(tree, dockerfile))
+				                             for image, ctx, dockerfile in targets])
+			finally:
+				repo.git.worktree('remove', '--force', tree)
+
+	def _build_all(self, job: BackgroundJob[Dict[str, str]], targets: List[Tuple[str, str, str]]) -> Dict[str, str]:
 		image_shas: Dict[str, str] = {}
-		try:
-			# Authenticate to docker repo
-			client = docker.DockerClient(base_url='unix://var/run/docker.sock')
+		# Authenticate to docker repo
+		client = docker.DockerClient(base_url='unix://var/run/docker.sock')
+		if self.publish:
+			client.login(
+				username=self.docker_repo_username,
+				password=self.docker_repo_password,
+				registry=self.docker_repo_url
+			)
+
+		for index, (image, build_ctx, build_dockerfile) in enumerate(targets):
+			job.report("checking", index + 1, len(targets), image=image)
 			if self.publish:
-				client.login(
-					username=self.docker_repo_username,
-					password=self.docker_repo_password,
-					registry=self.docker_repo_url
-				)
-			env = self.envs()
-			# Parse docker-compose file
-			docker_compose_absolute_path = os.path.join(self.wd.progress(), self.docker_compose_path)
-			with open(docker_compose_absolute_path, 'r') as f:
-				content = f.read()
-				content = re.sub(r'\$\{([^}]+)\}', lambda m: env[m.group(1)], content)
-				compose = yaml.safe_load(content)
-			services = compose.get('services', {})
-
-			for name, svc in services.items():
-				build_section = svc.get('build')
-				if build_section is None:
+				# Check if image exists in remote repo
+				try:
+					img = client.images.pull(image)
+					logger.info(f"Image {image} already exists in repo, skipping build.")
+					if img.id is not None:
+						image_shas[image] = img.id
 					continue
-				if isinstance(build_section, dict):
-					build_ctx = build_section.get('context', '.')
-					build_dockerfile = build_section.get('dockerfile', 'Dockerfile')
-				else:
-					build_ctx = build_section
-					build_dockerfile = 'Dockerfile'
+				except Exception:
+					pass
+			else:
+				# Check if image exists locally
+				try:
+					img = client.images.get(image)
+					logger.info(f"Image {image} already exists locally, skipping build.")
+					if img.id is not None:
+						image_shas[image] = img.id
+					continue
+				except docker_errors.ImageNotFound:
+					pass
 
-				build_ctx = os.path.join(os.path.dirname(docker_compose_absolute_path), build_ctx) 
-				build_dockerfile = os.path.join(os.path.dirname(docker_compose_absolute_path), build_dockerfile) 
+			logger.info(f"Building image {image} from {build_ctx}, {build_dockerfile}")
+			self.log.append(f"Building image {image}")
+			image_id = self._build_image(job, client, image, build_ctx, build_dockerfile)
 
-				image = svc.get('image')
-				if not build_ctx or not image:
-					continue
-				if self.publish:
-					# Check if image exists in remote repo
-					try:
-						img = client.images.pull(image)
-						logger.info(f"Image {image} already exists in repo, skipping build.")
-						if img.id is not None:
-							image_shas[image] = img.id
-						continue
-					except Exception:
-						pass
-				else:
-					# Check if image exists locally
-					try:
-						img = client.images.get(image)
-						logger.info(f"Image {image} already exists locally, skipping build.")
-						if img.id is not None:
-							image_shas[image] = img.id
-						continue
-					except docker_errors.ImageNotFound:
-						pass
+			if self.publish:
+				logger.info(f"Pushing image {image}")
+				self.log.append(f"Pushing image {image}")
+				self._push_image(job, client, image)
+			if image_id is not None:
+				image_shas[image] = image_id
+		return image_shas
 
-				logger.info(f"Building image {image} from {build_ctx}, {build_dockerfile}")
-				img, _ = client.images.build(path=build_ctx, dockerfile=build_dockerfile, tag=image, nocache=not self.build_cache, rm=True)
+	def _build_image(self, job: BackgroundJob[Any], client: docker.DockerClient,
+	                 image: str, build_ctx: str, build_dockerfile: str) -> str | None:
+		for chunk in client.api.build(path=build_ctx, dockerfile=build_dockerfile, tag=image,
+		                              nocache=not self.build_cache, rm=True, decode=True):
+			if 'error' in chunk:
+				raise docker_errors.BuildError(chunk['error'], iter([chunk]))
+			line = chunk.get('stream', '').strip()
+			self.log.append(line)
+			if m := _BUILD_STEP_RE.match(line):
+				job.report("building", int(m.group(1)), int(m.group(2)), image=image, line=line)
+		return client.images.get(image).id
 
-				if self.publish:
-					logger.info(f"Pushing image {image}")
-					for line in client.images.push(image, stream=True, decode=True):
-						logger.debug(line)
-				if img.id is not None:
-					image_shas[image] = img.id
-			return image_shas
-		except Exception as e:
-			raise e
+	def _push_image(self, job: BackgroundJob[Any], client: docker.DockerClient, image: str) -> None:
+		layers: Dict[str, Tuple[int, int]] = {}
+		for line in client.images.push(image, stream=True, decode=True):
+			logger.debug(line)
+			if 'error' in line:
+				self.log.append(f"{image}: {line['error']}")
+				raise RuntimeError(f"Push of {image} failed: {line['error']}")
+			detail = line.get('progressDetail') or {}
+			if not detail and 'status' in line:
+				self.log.append(f"{line['id']}: {line['status']}" if 'id' in line else line['status'])
+			if 'id' in line and detail.get('total'):
+				layers[line['id']] = (detail.get('current', 0), detail['total'])
+				job.report("pushing", sum(c for c, _ in layers.values()), sum(t for _, t in layers.values()),
+				           image=image, layers=len(layers))
 
 
 @dataclass
@@ -118,6 +268,32 @@ class DockerSwarmCheckResult:
 	image: str
 	stack: str
 	version: str
+	labels: Dict[str, str] = field(default_factory=dict)
+
+
+_swarm_snapshot: List[Dict[str, Any]] | None = None
+_swarm_snapshot_lock = threading.Lock()
+
+
+def _list_swarm_services() -> List[Dict[str, Any]]:
+	snapshot = _swarm_snapshot
+	if snapshot is not None:
+		return snapshot
+	client = docker.DockerClient(base_url='unix://var/run/docker.sock')
+	return [svc.attrs for svc in client.services.list()]
+
+
+@contextmanager
+def shared_swarm_snapshot() -> Iterator[List[Dict[str, Any]]]:
+	"""List swarm services once and serve every DockerSwarmCheck from that listing until the block exits."""
+	global _swarm_snapshot
+	with _swarm_snapshot_lock:
+		client = docker.DockerClient(base_url='unix://var/run/docker.sock')
+		_swarm_snapshot = [svc.attrs for svc in client.services.list()]
+		try:
+			yield _swarm_snapshot
+		finally:
+			_swarm_snapshot = None
 
 
 class DockerSwarmCheck(AbstractStep[Dict[str, DockerSwarmCheckResult]]):
@@ -130,10 +306,8 @@ class DockerSwarmCheck(AbstractStep[Dict[str, DockerSwarmCheckResult]]):
 
 	def progress(self) -> Dict[str, DockerSwarmCheckResult]:
 
-		client = docker.DockerClient(base_url='unix://var/run/docker.sock')
 		current_services: Dict[str, DockerSwarmCheckResult] = {}
-		for svc in client.services.list():
-			attrs = client.services.get(svc.id).attrs
+		for attrs in _list_swarm_services():
 			name = attrs["Spec"]["Name"].replace(self.stack_name + "_", "")
 			if attrs["Spec"]["Labels"].get("com.docker.stack.namespace", "") == self.stack_name:
 				# logger.info(f"Service {svc.name} is running with image {attrs}")
@@ -141,13 +315,122 @@ class DockerSwarmCheck(AbstractStep[Dict[str, DockerSwarmCheckResult]]):
 					name=name,
 					image=attrs["Spec"]["Labels"].get("com.docker.stack.image", ""),
 					stack=attrs["Spec"]["Labels"].get("com.docker.stack.namespace", ""),
-					version=attrs["Spec"]["TaskTemplate"]["ContainerSpec"]["Labels"].get("org.brencher.version", ""),
+					version=attrs["Spec"]["TaskTemplate"]["ContainerSpec"]["Labels"].get(VERSION_LABEL, ""),
+					labels=attrs["Spec"]["TaskTemplate"]["ContainerSpec"]["Labels"],
 				)
 
 		logger.info(f"Current services in stack '{self.stack_name}': {current_services}")
 		return current_services
 
 
+def _exclude_from_git(repo_path: str | None, path: str) -> None:
+	"""Keep a generated file out of `git status` so a concurrent CheckoutMerged still sees a clean tree."""
+	if repo_path is None:
+		return
+	exclude_path = os.path.join(repo_path, ".git", "info", "exclude")
+	if not os.path.isdir(os.path.dirname(exclude_path)):
+		return
+	pattern = "/" + os.path.relpath(path, repo_path)
+	existing = ""
+	if os.path.exists(exclude_path):
+		with open(exclude_path) as f:
+			existing = f.read()
+	if pattern not in existing.splitlines():
+		with open(exclude_path, "a") as f:
+			f.write(("" if existing.endswith("\n") or not existing else "\n") + pattern + "\n")
+
+
+class ConvergenceWatcher:
+	"""
+	Waits until every named object is ready, re-checking whenever Docker emits a matching event
+	(and at least every poll_interval seconds, since task state changes on other nodes emit no local events).
+	Returns time-to-ready in seconds per name.
+	"""
+
+	def __init__(self,
+	             client: docker.DockerClient,
+	             names: List[str],
+	             is_ready: Callable[[str], Tuple[bool, str]],
+	             event_filters: Dict[str, Any],
+	             timeout: float,
+	             poll_interval: float = 2.0,
+	             started_at: float | None = None) -> None:
+		self.client = client
+		self.names = names
+		self.is_ready = is_ready
+		self.event_filters = event_filters
+		self.timeout = timeout
+		self.poll_interval = poll_interval
+		self.started_at = started_at if started_at is not None else time.time()
+
+	def _listen(self, events: Any, wake: threading.Event) -> None:
+		try:
+			for _ in events:
+				wake.set()
+		except Exception:
+			# Stream closed by wait() or daemon went away; polling still covers us
+			pass
+
+	def wait(self, report: Callable[[int, int, Dict[str, Any]], None] | None = None) -> Dict[str, float]:
+		ready: Dict[str, float] = {}
+		states: Dict[str, str] = {}
+		wake = threading.Event()
+		deadline = self.started_at + self.timeout
+		events = self.client.events(decode=True, filters=self.event_filters)
+		threading.Thread(target=self._listen, args=(events, wake), daemon=True).start()
+		try:
+			while True:
+				for name in self.names:
+					if name in ready:
+						continue
+					ok, states[name] = self.is_ready(name)
+					if ok:
+						ready[name] = round(time.time() - self.started_at, 1)
+						logger.info(f"{name} is ready after {ready[name]}s")
+				if report is not None:
+					report(len(ready), len(self.names), {"ready": dict(ready), "pending": {n: states[n] for n in self.names if n not in ready}})
+				if len(ready) == len(self.names):
+					return ready
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					pending = [f"{n} ({states[n]})" for n in self.names if n not in ready]
+					raise BaseException(f"Services not started yet: {', '.join(pending)}")
+				wake.wait(min(self.poll_interval, remaining))
+				wake.clear()
+		finally:
+			events.close()
+
+
+def _task_version(container_spec: Dict[str, Any]) -> Tuple[str | None, str | None]:
+	return container_spec.get("Image"), container_spec.get("Labels", {}).get(VERSION_LABEL)
+
+
+def swarm_service_ready(client: docker.DockerClient) -> Callable[[str], Tuple[bool, str]]:
+	"""
+	A service is ready once its desired replicas run the current spec (image and version label) and its update,
+	if any, is no longer in progress: tasks of the previous version still running during a rollout do not count.
+	"""
+	def is_ready(full_svc_name: str) -> Tuple[bool, str]:
+		services_list = client.services.list(filters={"name": full_svc_name})
+		if not services_list:
+			return False, "not found"
+		svc = services_list[0]
+		spec = svc.attrs.get("Spec", {})
+		desired_replicas = spec.get("Mode", {}).get("Replicated", {}).get("Replicas", 1)
+		current = _task_version(spec.get("TaskTemplate", {}).get("ContainerSpec", {}))
+		running_tasks = [
+			t for t in svc.tasks()
+			if t.get("Status", {}).get("State") == "running" and t.get("DesiredState") == "running"
+			and _task_version(t.get("Spec", {}).get("ContainerSpec", {})) == current
+		]
+		update_state = (svc.attrs.get("UpdateStatus") or {}).get("State")
+		if update_state in ("updating", "paused", "rollback_started", "rollback_paused"):
+			return False, f"update {update_state}, {len(running_tasks)}/{desired_replicas} replicas updated"
+		return len(running_tasks) >= desired_replicas, f"{len(running_tasks)}/{desired_replicas} replicas running"
+
+	return is_ready
+
+
 @runtime_checkable
 class HasImage(Protocol):
 	image: str
@@ -161,6 +444,9 @@ class DockerSwarmDeploy(AbstractStep[str]):
 	             docker_compose_path: str,
 	             envs: Callable[[], Dict[str, Any]],
 	             stack_name: str,
+	             background: bool = True,
+	             targeted: bool = False,
+	             converge_timeout: float = 120,
 	             **kwargs: Any) -> None:
 		super().__init__(**kwargs)
 		self.wd = wd
@@ -169,6 +455,9 @@ class DockerSwarmDeploy(AbstractStep[str]):
 		self.docker_compose_path = docker_compose_path
 		self.stack_name = stack_name
 		self.stackChecker = stackChecker
+		self.background = background
+		self.targeted = targeted
+		self.converge_timeout = converge_timeout
 
 	def progress(self) -> Any:
 		"""
@@ -179,33 +468,13 @@ class DockerSwarmDeploy(AbstractStep[str]):
 			self.buildDocker.progress()
 		current_services: Mapping[str, HasImage | HasVersion] = self.stackChecker.progress()
 
-		def merge_dicts(a: Dict[str, Any], b: Dict[str, Any]) -> None:
-			for k, v in b.items():
-				if (
-						k in a
-						and isinstance(a[k], dict)
-						and isinstance(v, dict)
-				):
-					merge_dicts(a[k], v)
-				else:
-					a[k] = v
-
 		env = self.envs()
 		# Prepare docker-compose file with env substitution
-		docker_compose_absolute_path = os.path.join(self.wd.progress(), self.docker_compose_path)
-		with open(docker_compose_absolute_path, 'r') as f:
-			content = f.read()
-			content = re.sub(r'\$\{([^}]+)\}', lambda m: env.get(m.group(1), ""), content)
-			compose = yaml.safe_load(content)
-			if "services" in compose:
-				for svc in compose["services"].values():
-					if "build" in svc:
-						del svc["build"]
-					svc["labels"] = {"org.brencher.version": env["version"]}
-			del env["version"]
-			merge_dicts(compose, env)
-			# logger.info(f"Final compose: {compose}")
-			content = yaml.safe_dump(compose)
+		wd = self.wd.progress()
+		docker_compose_absolute_path = os.path.join(wd, self.docker_compose_path)
+		rendered = compose_cache.get(wd, self.docker_compose_path, env, "stack", lambda raw: _render_stack(raw, env))
+		compose = rendered.document
+		content = rendered.text
 
 		expected_services = compose.get("services", {})
 		diffs = []
@@ -213,7 +482,7 @@ class DockerSwarmDeploy(AbstractStep[str]):
 		for svc_name, svc in expected_services.items():
 			running_service = current_services.get(svc_name)
 			if isinstance(running_service, HasVersion):
-				expected_version = svc.get("labels", {}).get("org.brencher.version")
+				expected_version = svc.get("labels", {}).get(VERSION_LABEL)
 				running_version = running_service.version if running_service is not None else None
 				l = {
 					"service": svc_name,
@@ -259,11 +528,75 @@ class DockerSwarmDeploy(AbstractStep[str]):
 				"diffs": diffs,
 			}
 
-		# tmp_compose_path = os.path.join(tempfile.gettempdir(), f"{hashlib.sha1(content.encode()).hexdigest()[:5]}")
-		tmp_compose_path = docker_compose_absolute_path + ".tmp"
+		if self.targeted:
+			plan = self._targeted_plan(diffs, expected_services, current_services)
+			if plan is not None:
+				return self.run_job(
+					_stable_hash([self.stack_name, plan]),
+					lambda job: self._update_services(job, plan, list(expected_services)),
+					background=self.background,
+				)
+
+		return self.run_job(
+			_stable_hash([self.stack_name, content]),
+			lambda job: self._deploy(job, content, docker_compose_absolute_path, list(expected_services)),
+			background=self.background,
+		)
+
+	def _targeted_plan(self, diffs: List[Dict[str, Any]], expected_services: Dict[str, Any],
+	                   current_services: Mapping[str, HasImage | HasVersion]) -> List[Tuple[str, str, Dict[str, str]]] | None:
+		"""
+		(service, image, container labels) for every changed service, or None when the change cannot be applied
+		as a plain service update: a new/unknown service, a changed service spec or changed networks/volumes/secrets.
+		"""
+		plan: List[Tuple[str, str, Dict[str, str]]] = []
+		for diff in diffs:
+			svc_name = diff["service"]
+			svc = expected_services[svc_name]
+			running_labels = getattr(current_services.get(svc_name), "labels", None)
+			if not running_labels:
+				logger.info(f"Service {svc_name} is not running with known labels, full stack deploy required")
+				return None
+			for label in (SPEC_HASH_LABEL, STACK_HASH_LABEL):
+				if running_labels.get(label) != svc["labels"][label]:
+					logger.info(f"Service {svc_name} has changed {label}, full stack deploy required")
+					return None
+			plan.append((svc_name, svc["image"], {k: str(v) for k, v in svc["labels"].items()}))
+		return plan
+
+	def _update_services(self, job: BackgroundJob[Dict[str, Any]], plan: List[Tuple[str, str, Dict[str, str]]],
+	                     expected_services: List[str]) -> Dict[str, Any]:
+		started_at = time.time()
+		client = docker.DockerClient(base_url='unix://var/run/docker.sock')
+		updated = []
+		for index, (svc_name, image, labels) in enumerate(plan):
+			full_svc_name = f"{self.stack_name}_{svc_name}"
+			job.report("updating", index + 1, len(plan), service=full_svc_name)
+			self.log.append(f"Updating service {full_svc_name} to {image}")
+			service = client.services.get(full_svc_name)
+			service_labels = dict(service.attrs["Spec"].get("Labels", {}))
+			service_labels["com.docker.stack.image"] = image
+			# container_labels replaces ContainerSpec.Labels: keep the ones set by the stack (namespace) and others
+			container_labels = dict(service.attrs["Spec"]["TaskTemplate"]["ContainerSpec"].get("Labels", {}))
+			container_labels.update(labels)
+			service.update(image=image, container_labels=container_labels, labels=service_labels)
+			updated.append(full_svc_name)
+
+		return {
+			"message": f"Services updated: {', '.join(updated)}",
+			"time_to_ready": self._wait_converged(job, client, expected_services, started_at),
+		}
+
+	def _deploy(self, job: BackgroundJob[Dict[str, Any]], content: str, docker_compose_absolute_path: str,
+	            expected_services: List[str]) -> Dict[str, Any]:
+		started_at = time.time()
+		# One file per job: a finished job removing its file must not delete the file of the next one
+		tmp_compose_path = f"{docker_compose_absolute_path}.{job.job_id[:12]}.tmp"
+		_exclude_from_git(self.wd.repo_path, docker_compose_absolute_path + ".*.tmp")
 		with open(tmp_compose_path, 'w') as f:
 			f.write(content)
 		logger.info(f"Deploying stack '{self.stack_name}' using {tmp_compose_path}")
+		self.log.append(f"Deploying stack '{self.stack_name}'")
 
 		# Deploy stack to Docker Swarm
 		cmd = [
@@ -279,33 +612,42 @@ class DockerSwarmDeploy(AbstractStep[str]):
 			swarmEnv = {k: v for k, v in dotenv_values(os.path.join(os.path.dirname(tmp_compose_path), ".env")).items()
 			            if v is not None}
 		# merge_dicts(swarmEnv, env)
-		result = subprocess.run(cmd, capture_output=True, text=True)
-		# , cwd=os.path.dirname(tmp_compose_path), env=swarmEnv)
+		job.report("deploying", 0, len(expected_services))
+		output: List[str] = []
+		updated = 0
+		with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True) as proc:
+			# , cwd=os.path.dirname(tmp_compose_path), env=swarmEnv)
+			assert proc.stdout is not None
+			for line in proc.stdout:
+				output.append(line)
+				self.log.append(line)
+				if line.startswith(("Updating service", "Creating service")):
+					updated += 1
+					job.report("deploying", updated, len(expected_services), line=line.strip())
 		os.remove(tmp_compose_path)
-		if result.returncode != 0:
-			logger.error(f"Stack deploy failed: {result.stderr}")
-			raise RuntimeError(f"Stack deploy failed: {result.stderr}")
-		logger.info(f"Stack deployed successfully: {result.stdout}")
+		if proc.returncode != 0:
+			logger.error(f"Stack deploy failed: {''.join(output)}")
+			raise RuntimeError(f"Stack deploy failed: {''.join(output)}")
+		logger.info(f"Stack deployed successfully: {''.join(output)}")
 
-		# Check health of all deployed services
 		client = docker.DockerClient(base_url='unix://var/run/docker.sock')
-		not_running = []
-		for svc_name in expected_services:
-			full_svc_name = f"{self.stack_name}_{svc_name}"
-			services_list = client.services.list(filters={"name": full_svc_name})
-			if not services_list:
-				not_running.append(f"{full_svc_name} (not found)")
-				continue
-			svc = services_list[0]
-			spec_mode = svc.attrs.get("Spec", {}).get("Mode", {})
-			desired_replicas = spec_mode.get("Replicated", {}).get("Replicas", 1)
-			running_tasks = [
-				t for t in svc.tasks()
-				if t.get("Status", {}).get("State") == "running" and t.get("DesiredState") == "running"
-			]
-			if len(running_tasks) < desired_replicas:
-				not_running.append(f"{full_svc_name} ({len(running_tasks)}/{desired_replicas} replicas running)")
-		if not_running:
-			raise BaseException(f"Services not started yet: {', '.join(not_running)}")
-
-		return f"Stack deployed successfully: {result.stdout}"
+		return {
+			"message": f"Stack deployed successfully: {''.join(output)}",
+			"time_to_ready": self._wait_converged(job, client, expected_services, started_at),
+		}
+
+	def _wait_converged(self, job: BackgroundJob[Dict[str, Any]], client: docker.DockerClient,
+	                    expected_services: List[str], started_at: float) -> Dict[str, float]:
+		"""Block until every service runs its desired replicas; time-to-ready per service is measured from deploy start."""
+		full_names = [f"{self.stack_name}_{svc_name}" for svc_name in expected_services]
+		watcher = ConvergenceWatcher(
+			client,
+			full_names,
+			swarm_service_ready(client),
+			event_filters={"type": ["service", "container"]},
+			timeout=self.converge_timeout,
+			started_at=started_at,
+		)
+		ready = watcher.wait(lambda current, total, detail: job.report("converging", current, total, **detail))
+		self.log.append(f"Services converged: {ready}")
+		return ready
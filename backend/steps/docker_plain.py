@@ -1,14 +1,18 @@
 import hashlib
 import logging
 import os
+import time
 from dataclasses import dataclass
-from typing import List, Dict, Callable, Any, Optional, cast
+from typing import Dict, Callable, Any, Optional, Tuple, cast
 
 import docker
+from docker import errors as docker_errors
 from docker.models.containers import Container
 from docker.models.images import Image
 from enironment import AbstractStep
+from steps.docker import ConvergenceWatcher
 from steps.git import CheckoutMerged
+from steps.step import BackgroundJob
 
 logger = logging.getLogger(__name__)
 
@@ -21,9 +25,6 @@ class DockerImageBuildResult:
 	full_image: str
 
 
-# build_logs: List[str]
-
-
 class DockerImageBuild(AbstractStep[DockerImageBuildResult]):
 	"""Build a single Docker image from a Dockerfile"""
 
@@ -70,29 +71,28 @@ class DockerImageBuild(AbstractStep[DockerImageBuildResult]):
 		existing_image = client.images.list(full_image)
 		if len(existing_image) > 0 and not self.nocache:
 			logger.info(f"Image {full_image} already exists locally with ID: {existing_image}")
-			build_logs: List[str] = []
 		elif self.env.dry:
 			logger.info(f"DRY RUN: Would build image {full_image}")
 			raise BaseException(f"Dry run - skipping actual build for {full_image}")
 
 		else:
 			# Build the image
-			build_logs = []
-			image, logs = client.images.build(
+			self.log.append(f"Building image {full_image}")
+			for chunk in client.api.build(
 				path=build_context_path,
 				dockerfile=os.path.relpath(dockerfile_absolute, build_context_path),
 				tag=full_image,
 				buildargs=self.build_args,
 				nocache=self.nocache,
-				rm=True
-			)
-
-			# for log in logs:
-			# 	if 'stream' in log:
-			# 		log_msg = log['stream'].strip()
-			# 		if log_msg:
-			# 			logger.debug(log_msg)
-			# 			build_logs.append(log_msg)
+				rm=True,
+				decode=True,
+			):
+				if 'error' in chunk:
+					self.log.append(chunk['error'])
+					raise docker_errors.BuildError(chunk['error'], iter([chunk]))
+				if 'stream' in chunk:
+					self.log.append(chunk['stream'])
+			image = client.images.get(full_image)
 
 			logger.info(f"Successfully built image: {full_image} (ID: {image.id})")
 
@@ -100,7 +100,6 @@ class DockerImageBuild(AbstractStep[DockerImageBuildResult]):
 			image_name=self.image_name,
 			image_tag=tag,
 			full_image=full_image,
-			# build_logs=build_logs
 		)
 
 
@@ -168,6 +167,7 @@ class DockerContainerDeployResult:
 	image: str
 	status: str
 	ports: Dict[str, Any]
+	ready_seconds: Optional[float] = None
 
 
 class DockerContainerDeploy(AbstractStep[DockerContainerDeployResult]):
@@ -181,9 +181,13 @@ class DockerContainerDeploy(AbstractStep[DockerContainerDeployResult]):
 	             volumes: Optional[Dict[str, Dict[str, str]]] = None,
 	             network: Optional[str] = None,
 	             restart_policy: Optional[Dict[str, Any]] = None,
+	             converge_timeout: float = 60,
+	             background: bool = True,
 	             **kwargs: Any) -> None:
 		super().__init__(**kwargs)
 		self.image_build = image_build
+		self.converge_timeout = converge_timeout
+		self.background = background
 		self.container_name = container_name
 		self.ports = ports or {}
 		self.environment = environment or {}
@@ -203,6 +207,35 @@ class DockerContainerDeploy(AbstractStep[DockerContainerDeployResult]):
 			return "Config hash mismatch"
 		return None
 
+	@staticmethod
+	def _container_ready(client: docker.DockerClient) -> Callable[[str], Tuple[bool, str]]:
+		def is_ready(container_id: str) -> Tuple[bool, str]:
+			container = client.containers.get(container_id)
+			health = container.attrs.get('State', {}).get('Health', {}).get('Status')
+			if container.status != "running":
+				return False, container.status
+			if health is not None and health != "healthy":
+				return False, f"health {health}"
+			return True, container.status
+
+		return is_ready
+
+	def _start(self, job: BackgroundJob[float], client: docker.DockerClient, container: Container) -> float:
+		"""Start the container and wait until it runs (and is healthy), returns seconds until ready."""
+		logger.info(f"Starting existing container...")
+		started_at = time.time()
+		container.start()
+		ready = ConvergenceWatcher(
+			client,
+			[container.id or self.container_name],
+			self._container_ready(client),
+			event_filters={"container": container.id or self.container_name},
+			timeout=self.converge_timeout,
+			poll_interval=1.0,
+			started_at=started_at,
+		).wait(lambda current, total, detail: job.report("starting", current, total, **detail))
+		return next(iter(ready.values()))
+
 	def progress(self) -> DockerContainerDeployResult:
 		"""Deploy the Docker container"""
 		# First, ensure the image is built
@@ -256,10 +289,17 @@ class DockerContainerDeploy(AbstractStep[DockerContainerDeployResult]):
 			container_id = existing_container.id or "unknown"
 			logger.info(f"Successfully deployed container: {container_id[:12]}")
 
-		if existing_container.status != "running":
-			logger.info(f"Starting existing container...")
-			existing_container.start()
-			raise BaseException("Container not started yet")
+		ready_seconds = None
+		existing_container.reload()
+		container = existing_container
+		key = f"{container.id}:{full_image}"
+		if container.status != "running" and self._job is not None and self._job.done:
+			# Stopped again after the last start: the finished job must not stand in for a new start
+			self._job = None
+		# A started job is polled until done even though the container already reports running meanwhile
+		if container.status != "running" or (self._job is not None and self._job.job_id == key):
+			ready_seconds = self.run_job(key, lambda job: self._start(job, client, container),
+			                             background=self.background)
 
 		# Reload to get fresh status
 		existing_container.reload()
@@ -269,5 +309,6 @@ class DockerContainerDeploy(AbstractStep[DockerContainerDeployResult]):
 			container_name=self.container_name,
 			image=full_image,
 			status=existing_container.status,
-			ports=existing_container.ports
+			ports=existing_container.ports,
+			ready_seconds=ready_seconds,
 		)
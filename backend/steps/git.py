@@ -1,29 +1,206 @@
+import fnmatch
 import hashlib
 import logging
 import os
 import shutil
+import subprocess
 import tempfile
+import threading
+import time
 from dataclasses import dataclass
 import traceback
-from typing import List, Tuple, Set, Dict, Any, Mapping, runtime_checkable
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from typing import List, Tuple, Set, Dict, Any, Callable, Mapping, runtime_checkable
 
 import git
-from enironment import AbstractStep, SharedState
+import metrics
+from enironment import AbstractStep, Environment, SharedState
 from git.objects import Commit
 
 
 logger = logging.getLogger(__name__)
 
 
+MAX_DEEPEN_ROUNDS = 8
+# Branches pushed by CheckoutMerged; excluded from fetches by default
+AUTO_BRANCH_PATTERNS = ["auto-*"]
+
+
+def _shallow_commits(repo: git.Repo) -> Set[str]:
+	"""Boundary commits of a shallow clone: their parents are not in the repository."""
+	try:
+		with open(os.path.join(repo.git_dir, 'shallow')) as f:
+			return set(f.read().split())
+	except FileNotFoundError:
+		return set()
+
+
+COMMIT_CACHE_SIZE = 20000
+
+
+@dataclass(frozen=True, slots=True)
+class CommitInfo:
+	"""Compact header of a commit as read by CatFile."""
+	sha: str
+	parents: Tuple[str, ...]
+	author: str
+	committed_at: int
+	tz_offset: int  # seconds east of UTC
+	message: str
+
+	@property
+	def subject(self) -> str:
+		return self.message.split('\n', 1)[0]
+
+	@property
+	def committed_datetime(self) -> datetime:
+		return datetime.fromtimestamp(self.committed_at, timezone(timedelta(seconds=self.tz_offset)))
+
+	@staticmethod
+	def parse(sha: str, data: bytes) -> 'CommitInfo':
+		header, _, message = data.decode('utf-8', errors='replace').partition('\n\n')
+		parents: List[str] = []
+		author = ""
+		committed_at = 0
+		tz_offset = 0
+		for line in header.split('\n'):
+			key, _, value = line.partition(' ')
+			if key == 'parent':
+				parents.append(value)
+			elif key == 'author':
+				author = value.rsplit(' <', 1)[0]
+			elif key == 'committer':
+				timestamp, tz = value.rsplit('> ', 1)[1].split(' ')
+				committed_at = int(timestamp)
+				sign = -1 if tz.startswith('-') else 1
+				tz_offset = sign * (int(tz[1:3]) * 3600 + int(tz[3:5]) * 60)
+		return CommitInfo(sha, tuple(parents), author, committed_at, tz_offset, message.strip())
+
+
+class CatFile:
+	"""
+	Long-lived `git cat-file --batch` process of one repository with an LRU cache of parsed commit headers.
+	Commits are immutable, so cached headers never go stale; objects fetched later are found by the same process.
+	"""
+
+	def __init__(self, repo_path: str, cache_size: int = COMMIT_CACHE_SIZE) -> None:
+		self.repo_path = repo_path
+		self.cache_size = cache_size
+		self._cache: OrderedDict[str, CommitInfo] = OrderedDict()
+		self._process: subprocess.Popen[bytes] | None = None
+		self._lock = threading.Lock()
+
+	def _read(self, rev: str) -> Tuple[str, bytes] | None:
+		if self._process is None or self._process.poll() is not None:
+			self._process = subprocess.Popen(['git', 'cat-file', '--batch'], cwd=self.repo_path,
+			                                 stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+		assert self._process.stdin is not None and self._process.stdout is not None
+		self._process.stdin.write(f"{rev}^{{commit}}\n".encode())
+		self._process.stdin.flush()
+		line = self._process.stdout.readline()
+		if not line:
+			raise BrokenPipeError(f"git cat-file exited in {self.repo_path}")
+		header = line.decode().split()
+		if len(header) != 3:  # "<rev> missing" or "<rev> ambiguous"
+			return None
+		sha, _, size = header
+		data = self._process.stdout.read(int(size) + 1)[:-1]
+		return sha, data
+
+	def commit(self, rev: str) -> CommitInfo | None:
+		"""Header of the commit rev (sha, abbreviated sha or ref) points to; None when there is no such commit."""
+		with self._lock:
+			info = self._cache.get(rev)
+			if info is not None:
+				self._cache.move_to_end(rev)
+				return info
+			try:
+				result = self._read(rev)
+			except (BrokenPipeError, ValueError):
+				self.close()
+				result = self._read(rev)
+			if result is None:
+				return None
+			info = CommitInfo.parse(*result)
+			self._cache[info.sha] = info
+			if len(self._cache) > self.cache_size:
+				self._cache.popitem(last=False)
+			return info
+
+	def close(self) -> None:
+		if self._process is not None:
+			self._process.kill()
+			self._process.wait()
+			self._process = None
+
+
+_cat_files: Dict[str, CatFile] = {}
+_cat_files_lock = threading.Lock()
+
+
+def cat_file(repo: git.Repo | str) -> CatFile:
+	"""The shared CatFile of a repository."""
+	path = os.path.realpath(repo if isinstance(repo, str) else repo.working_dir)
+	with _cat_files_lock:
+		if path not in _cat_files:
+			_cat_files[path] = CatFile(path)
+		return _cat_files[path]
+
+
+def close_cat_file(repo_path: str) -> None:
+	with _cat_files_lock:
+		reader = _cat_files.pop(os.path.realpath(repo_path), None)
+	if reader is not None:
+		reader.close()
+
+
+@dataclass
+class RefIndex:
+	"""Fetched branches of origin by name and by commit, built from one for-each-ref call."""
+	branches: Dict[str, str]  # branch name -> commit sha
+	by_sha: Dict[str, List[str]]  # commit sha -> branch names, sorted
+
+	@staticmethod
+	def build(branches: List[Tuple[str, str]]) -> 'RefIndex':
+		by_sha: Dict[str, List[str]] = {}
+		for name, sha in sorted(branches):
+			by_sha.setdefault(sha, []).append(name)
+		return RefIndex(branches=dict(branches), by_sha=by_sha)
+
+	def names(self, sha: str) -> List[str]:
+		return self.by_sha.get(sha, [])
+
+
 class GitClone(AbstractStep[str]):
+	"""
+	Clone/fetch of url into repo_path. Optional narrowing for big repositories:
+	clone_filter - partial clone filter ("blob:none", "tree:0"), missing objects are fetched on demand;
+	sparse_paths - only these files/directories are checked out (non-cone patterns anchored at the root);
+	depth - history depth of the first fetch, deepened on demand for merges and unmerge.
+	exclude_branches - branch globs left out of fetches with negative refspecs (auto-* branches by default).
+	"""
+
 	def __init__(self, url: str, repo_path: str | None = None,
 	             branchNamePrefix: str = "", credEnvPrefix: str = "GIT",
+	             clone_filter: str | None = None,
+	             sparse_paths: List[str] | None = None,
+	             depth: int | None = None,
+	             exclude_branches: List[str] | None = None,
 	             **kwargs: Any):
 		super().__init__(**kwargs)
 		self.url = url
 		self.repo_path = repo_path
 		self.branchNamePrefix = branchNamePrefix
 		self.credEnvPrefix = credEnvPrefix
+		self.clone_filter = clone_filter
+		self.sparse_paths = sparse_paths
+		self.depth = depth
+		self.exclude_branches = AUTO_BRANCH_PATTERNS if exclude_branches is None else exclude_branches
+		self._fingerprint: str | None = None
+		self._ref_index: RefIndex | None = None
+		# Bumped whenever the clone is created from scratch: same refs, but a new working tree and object store
+		self._generation = 0
 
 	def _get_auth_git_url(self, url: str) -> str:
 		username = os.getenv(f'{self.credEnvPrefix}_USERNAME')
@@ -35,11 +212,117 @@ class GitClone(AbstractStep[str]):
 
 		return url
 
+	def resolve_repo_path(self) -> str:
+		return self.repo_path or os.path.join(tempfile.gettempdir(),
+		                                      f"{self.env.id}_{hashlib.sha1(self.url.encode()).hexdigest()[:5]}")
+
+	def _fetched_branches(self) -> str:
+		prefix = f"{self.branchNamePrefix}/" if self.branchNamePrefix != "" else ""
+		return f"refs/heads/{prefix}*"
+
+	def is_excluded(self, branch_name: str) -> bool:
+		return any(fnmatch.fnmatchcase(branch_name, pattern) for pattern in self.exclude_branches)
+
+	def _refspecs(self) -> List[str]:
+		fetched = self._fetched_branches()
+		tracking = f"refs/remotes/origin/{fetched[len('refs/heads/'):]}"
+		return [f"+{fetched}:{tracking}"] + [f"^refs/heads/{pattern}" for pattern in self.exclude_branches]
+
+	def _configure_refspecs(self, repo: git.Repo) -> None:
+		try:
+			current = str(repo.git.config('--get-all', 'remote.origin.fetch')).splitlines()
+		except git.GitCommandError:
+			current = []
+		refspecs = self._refspecs()
+		if current != refspecs:
+			logger.info(f"Fetch refspecs of {self.repo_path}: {refspecs}")
+			repo.git.config('--replace-all', 'remote.origin.fetch', refspecs[0])
+			for refspec in refspecs[1:]:
+				repo.git.config('--add', 'remote.origin.fetch', refspec)
+
+	def _drop_excluded_tracking_refs(self, repo: git.Repo) -> None:
+		"""Prune keeps tracking refs of excluded branches and push creates them: delete them locally."""
+		names = str(repo.git.for_each_ref('--format=%(refname:strip=3)', 'refs/remotes/origin/')).splitlines()
+		excluded = [f"origin/{name}" for name in names if name != 'HEAD' and self.is_excluded(name)]
+		for i in range(0, len(excluded), 500):
+			repo.git.branch('-r', '-D', *excluded[i:i + 500])
+
+	def _remote_refs(self, repo: git.Repo) -> str:
+		"""Branches on the remote as sorted "sha ref" lines; one ls-remote round trip, no pack negotiation."""
+		lines = str(repo.git.ls_remote('origin', self._fetched_branches())).splitlines()
+		refs = [line.replace('\t', ' ') for line in lines if line]
+		return "\n".join(sorted(ref for ref in refs if not self.is_excluded(ref.split(' refs/heads/', 1)[-1])))
+
+	def _tracking_branches(self, repo: git.Repo) -> List[Tuple[str, str]]:
+		"""(branch name, sha) of the remote-tracking branches as of the last fetch."""
+		prefix = self._fetched_branches()[len("refs/heads/"):-1]
+		lines = str(repo.git.for_each_ref('--format=%(objectname) %(refname:strip=3)',
+		                                  f"refs/remotes/origin/{prefix}")).splitlines()
+		branches = [(name, sha) for sha, name in (line.split(' ', 1) for line in lines if line)]
+		return [(name, sha) for name, sha in branches if name != 'HEAD' and not self.is_excluded(name)]
+
+	def _fetched_refs(self, repo: git.Repo, branches: List[Tuple[str, str]] | None = None) -> str:
+		"""Remote-tracking branches as of the last fetch, in the _remote_refs format."""
+		if branches is None:
+			branches = self._tracking_branches(repo)
+		return "\n".join(sorted(f"{sha} refs/heads/{name}" for name, sha in branches))
+
+	def ref_index(self) -> RefIndex:
+		"""Fetched branches by commit; rebuilt by progress() whenever the fetch was checked."""
+		if self._ref_index is None:
+			self._ref_index = RefIndex.build(self._tracking_branches(git.Repo(self.resolve_repo_path())))
+		return self._ref_index
+
+	def fingerprint(self) -> str | None:
+		"""Hash of the fetched branches and the clone generation: changes with new fetches and recreated clones."""
+		return self._fingerprint
+
+	def _init_repo(self) -> git.Repo:
+		repo = git.Repo.init(self.repo_path)
+		repo.remotes.append(repo.create_remote('origin', self._get_auth_git_url(self.url)))
+		self._configure_refspecs(repo)
+		return repo
+
+	def seed_from(self, source: str) -> None:
+		"""
+		Fetch the branches of this clone from source, a full local clone of the same url fetching the same branches,
+		so that the next progress() finds them up to date instead of fetching them from the remote again.
+		Clone filter and depth are applied as for a fetch from the remote. On failure progress() fetches as usual.
+		"""
+		env_id = self._env.id if self._env is not None else ""
+		self.repo_path = self.resolve_repo_path()
+		created = not os.path.exists(os.path.join(self.repo_path, ".git"))
+		tracking = self._refspecs()[0].split(':')[1]
+		options = ['--no-tags', '--no-write-fetch-head', '--prune']
+		try:
+			if created:
+				os.makedirs(self.repo_path, exist_ok=True)
+				repo = self._init_repo()
+				if self.clone_filter is not None:
+					# Lazy fetches of filtered objects go to the remote, as after a filtered fetch from it
+					repo.git.config('remote.origin.promisor', 'true')
+					repo.git.config('remote.origin.partialclonefilter', self.clone_filter)
+				if self.depth is not None:
+					options.append(f"--depth={self.depth}")
+			else:
+				repo = git.Repo(self.repo_path)
+			if self.clone_filter is not None:
+				options += [f"--filter={self.clone_filter}", '--upload-pack=git -c uploadpack.allowFilter=true upload-pack']
+			logger.info(f"Seeding {self.repo_path} from {source}")
+			repo.git.fetch(*options, source, f"+{tracking}:{tracking}")
+			metrics.git_fetches.inc(env_id, "seeded")
+			if created:
+				self._generation += 1
+		except BaseException as e:
+			logger.warning(f"Unable to seed {self.repo_path} from {source}, fetching from {self.url}: {str(e)}")
+			if created:
+				shutil.rmtree(self.repo_path, ignore_errors=True)
+
 	def progress(self) -> str:
 		repo_url = self.url
+		env_id = self._env.id if self._env is not None else ""
 
-		self.repo_path = self.repo_path or os.path.join(tempfile.gettempdir(),
-		                                                f"{self.env.id}_{hashlib.sha1(repo_url.encode()).hexdigest()[:5]}")
+		self.repo_path = self.resolve_repo_path()
 		logger.info(f"Cloning repository {repo_url} to {self.repo_path}")
 		os.makedirs(self.repo_path, exist_ok=True)
 		try:
@@ -48,46 +331,112 @@ class GitClone(AbstractStep[str]):
 				repo = git.Repo(self.repo_path)
 				if 'origin' not in repo.remotes or repo.remotes.origin.url != self._get_auth_git_url(repo_url):
 					repo.create_remote('origin', self._get_auth_git_url(repo_url))
-				result = repo.remotes.origin.fetch(prune=True)
-				if not result or any(fetch_info.flags & fetch_info.ERROR for fetch_info in result):
-					raise BaseException(f"Failed to fetch updates for {repo_url}")
+				self._configure_refspecs(repo)
+				self._drop_excluded_tracking_refs(repo)
+				remote_refs = self._remote_refs(repo)
+				if remote_refs == self._fetched_refs(repo):
+					logger.info(f"Remote branches of {self.repo_path} unchanged, skipping fetch")
+					metrics.git_fetches.inc(env_id, "skipped")
+				else:
+					result = repo.remotes.origin.fetch(prune=True)
+					if not result or any(fetch_info.flags & fetch_info.ERROR for fetch_info in result):
+						raise BaseException(f"Failed to fetch updates for {repo_url}")
+					metrics.git_fetches.inc(env_id, "fetched")
 			else:
-				repo = git.Repo.init(self.repo_path)
-				repo.remotes.append(repo.create_remote(
-					'origin',
-					self._get_auth_git_url(repo_url)
-				))
-				if self.branchNamePrefix != "":
-					repo.config_writer().set_value('remote "origin"', "fetch",
-					                               f"+refs/heads/{self.branchNamePrefix}/*:refs/remotes/origin/{self.branchNamePrefix}/*").release()
-				repo.remotes.origin.fetch(prune=True)
+				repo = self._init_repo()
+				initial_options: Dict[str, Any] = {}
+				if self.clone_filter is not None:
+					initial_options['filter'] = self.clone_filter  # also registers origin as promisor remote
+				if self.depth is not None:
+					initial_options['depth'] = self.depth
+				repo.remotes.origin.fetch(prune=True, **initial_options)
 				if not os.path.exists(os.path.join(self.repo_path, ".git")):
 					raise BaseException(f"Failed to clone repository {repo_url} to {self.repo_path}")
+				metrics.git_fetches.inc(env_id, "cloned")
+				self._generation += 1
+			self._configure_sparse_checkout(repo)
 		except BaseException as e:
 			logger.error(f"Error during git clone/fetch, removing directory {self.repo_path}: {str(e)}")
+			close_cat_file(self.repo_path)
 			shutil.rmtree(self.repo_path)
+			self._fingerprint = None
+			self._ref_index = None
 			raise e
+		branches = self._tracking_branches(repo)
+		self._ref_index = RefIndex.build(branches)
+		self._fingerprint = hashlib.sha1(f"{self._generation}\n{self._fetched_refs(repo, branches)}".encode()).hexdigest()
 		return self.repo_path
 
+	def _sparse_patterns(self) -> List[str]:
+		return [path if path.startswith('/') else f"/{path}" for path in self.sparse_paths or []]
+
+	def _configure_sparse_checkout(self, repo: git.Repo) -> None:
+		try:
+			# sparse-checkout keeps the flag in config.worktree, which GitPython does not read
+			enabled = repo.git.config('--bool', 'core.sparseCheckout') == 'true'
+		except git.GitCommandError:
+			enabled = False
+		if self.sparse_paths is None:
+			if enabled:
+				repo.git.sparse_checkout('disable')
+			return
+		current = str(repo.git.sparse_checkout('list')).splitlines() if enabled else []
+		if current != self._sparse_patterns():
+			logger.info(f"Sparse checkout of {self.repo_path}: {self.sparse_paths}")
+			repo.git.sparse_checkout('set', '--no-cone', *self._sparse_patterns())
+
+	def _deepen_until(self, repo: git.Repo, done: Callable[[], bool], what: str) -> None:
+		"""Shallow clones: fetch more history until done() holds, the whole history after MAX_DEEPEN_ROUNDS."""
+		rounds = 0
+		while _shallow_commits(repo) and not done():
+			if rounds < MAX_DEEPEN_ROUNDS:
+				logger.info(f"Deepening {self.repo_path} by {self.depth or 1} commits to find {what}")
+				repo.git.fetch('--deepen', str(self.depth or 1), 'origin')
+			else:
+				logger.info(f"Unshallowing {self.repo_path} to find {what}")
+				repo.git.fetch('--unshallow', 'origin')
+			rounds += 1
+
+	def ensure_commits(self, repo: git.Repo, revisions: List[str]) -> None:
+		"""Make sure the (abbreviated) commits exist locally, e.g. the deployed version of a shallow clone."""
+		def present() -> bool:
+			return all(_read_ref(repo, rev) is not None for rev in revisions)
+
+		self._deepen_until(repo, present, f"commits {revisions}")
+
+	def ensure_merge_base(self, repo: git.Repo, commits: List[Commit]) -> None:
+		"""Make sure the commits share history, so that they can be merged and unmerged."""
+		def has_merge_base() -> bool:
+			try:
+				repo.git.merge_base('--octopus', *[c.hexsha for c in commits])
+				return True
+			except git.GitCommandError:
+				return False
+
+		if len(commits) > 1:
+			self._deepen_until(repo, has_merge_base, f"merge base of {[c.hexsha for c in commits]}")
+
 	def get_branches(self) -> Dict[str, List[Any]]:
 		repo = git.Repo(self.repo_path)
+		shallow = _shallow_commits(repo)
+		commits = cat_file(repo)
 		result: Dict[str, List[Any]] = {}
-		for ref in repo.refs:
-			if ref.name.startswith('origin/') and not ref.name.startswith('origin/HEAD'):
-				branch_name = ref.name[len('origin/'):]
-				if not branch_name.startswith('auto/'):  # Skip auto branches
-					result[branch_name] = []
-					cmt = [ref.commit]
-					for _ in range(10):
-						for commit in cmt:
-							result[branch_name].append({
-								'hexsha': commit.hexsha,
-								'author': commit.author.name,
-								'date': commit.committed_datetime.isoformat(),
-								'message': commit.message.strip()
-							})
-
-						cmt = [p for c in cmt for p in c.parents]
+		for branch_name, sha in sorted(self.ref_index().branches.items()):
+			if branch_name.startswith('auto/'):  # Skip auto branches
+				continue
+			result[branch_name] = []
+			cmt = [sha]
+			for _ in range(10):
+				infos = [info for info in (commits.commit(c) for c in cmt) if info is not None]
+				for info in infos:
+					result[branch_name].append({
+						'hexsha': info.sha,
+						'author': info.author,
+						'date': info.committed_datetime.isoformat(),
+						'message': info.message
+					})
+
+				cmt = [p for info in infos if info.sha not in shallow for p in info.parents]
 		return result
 
 
@@ -99,27 +448,149 @@ class CheckoutAndMergeResult:
 	version: str
 
 
-def _commits_childs(repo: git.Repo) -> Dict[Commit, List[Commit]]:
-	childs: Dict[Commit, List[Commit]] = {}
-	for c in list(repo.iter_commits('--all')):
-		for p in c.parents:
-			childs.setdefault(p, []).append(c)
+def _commits_childs(repo: git.Repo) -> Dict[str, List[str]]:
+	"""Children of every commit, by sha, from one rev-list walk."""
+	childs: Dict[str, List[str]] = {}
+	for line in str(repo.git.rev_list('--all', '--parents')).splitlines():
+		sha, *parents = line.split()
+		for p in parents:
+			childs.setdefault(p, []).append(sha)
 	return childs
 
 
+def find_common_merge_commit(repo: git.Repo, commits: List[Commit]) -> Commit | None:
+	"""
+	Existing commit that is exactly the merge of commits: it contains all of them and no other non-merge commit.
+
+	Selected commits contained in another selected commit are dropped first (merge-base --independent); when one
+	remains it is the answer. Otherwise one `rev-list --parents` walk over the commits not yet contained in the
+	selection gives the child graph; candidates are reached from every tip through merge commits only (a non-merge
+	child brings foreign changes, and so does everything above it). The candidates are verified closest first
+	(generation number, then sha) with `rev-list --no-merges`, so the choice is deterministic.
+	"""
+	tips = sorted(set(repo.git.merge_base('--independent', *[c.hexsha for c in commits]).split()))
+	if len(tips) == 1:
+		return repo.commit(tips[0])
+
+	parents: Dict[str, List[str]] = {}
+	childs: Dict[str, List[str]] = {}
+	for line in repo.git.rev_list('--parents', '--topo-order', '--all', '--not', *tips).splitlines():
+		sha, *commit_parents = line.split()
+		parents[sha] = commit_parents
+		for p in commit_parents:
+			childs.setdefault(p, []).append(sha)
+
+	def merge_descendants(tip: str) -> Set[str]:
+		reached: Set[str] = set()
+		queue = deque([tip])
+		while queue:
+			for child in childs.get(queue.popleft(), []):
+				if child not in reached and len(parents[child]) > 1:
+					reached.add(child)
+					queue.append(child)
+		return reached
+
+	candidates = merge_descendants(tips[0])
+	for tip in tips[1:]:
+		if not candidates:
+			return None
+		candidates &= merge_descendants(tip)
+
+	# --topo-order prints children before parents, so walking it backwards sees parents first
+	generation: Dict[str, int] = {}
+	for sha in reversed(list(parents.keys())):
+		generation[sha] = 1 + max((generation.get(p, 0) for p in parents[sha]), default=0)
+
+	for sha in sorted(candidates, key=lambda c: (generation[c], c)):
+		if repo.git.rev_list('--no-merges', '--count', sha, '--not', *tips) == "0":
+			return repo.commit(sha)
+	return None
+
+
+MERGE_CACHE_REF_PREFIX = "refs/brencher/merges/"
+
+
+def merge_cache_ref(commits: List[Commit]) -> str:
+	"""Local ref remembering the merge result of this set of commits; it also keeps the merge objects alive."""
+	key = hashlib.sha1(''.join(sorted(c.hexsha for c in commits)).encode()).hexdigest()
+	return MERGE_CACHE_REF_PREFIX + key
+
+
+def _read_ref(repo: git.Repo, ref: str) -> Commit | None:
+	try:
+		return repo.commit(repo.git.rev_parse('--verify', '--quiet', f"{ref}^{{commit}}"))
+	except git.GitCommandError:
+		return None
+
+
 def ensure_clean(repo: git.Repo) -> None:
 	if repo.is_dirty() or len(repo.untracked_files) > 0:
 		raise BaseException(f"Changes in repo: U{repo.untracked_files}")
 
 
+MERGE_TREE_MIN_GIT = (2, 38)
+
+
+def supports_merge_tree(repo: git.Repo) -> bool:
+	"""git merge-tree --write-tree is available since git 2.38."""
+	return tuple(repo.git.version_info[:2]) >= MERGE_TREE_MIN_GIT
+
+
+def merge_in_odb(repo: git.Repo, commits: List[Commit]) -> Commit:
+	"""
+	Merge commits one by one like `git merge` does (fast-forward when possible, no-op when already merged),
+	but entirely in the object database with merge-tree/commit-tree: the working tree and index are untouched.
+	"""
+	head = commits[0]
+	for commit in commits[1:]:
+		if repo.is_ancestor(commit, head):
+			continue
+		if repo.is_ancestor(head, commit):
+			head = commit
+			continue
+		logger.info(f"Merging commit: {commit}")
+		try:
+			tree = repo.git.merge_tree('--write-tree', '--no-messages', head.hexsha, commit.hexsha).splitlines()[0]
+		except git.GitCommandError as e:
+			error_message = f"Merge conflict when merging {commit}: {str(e)}"
+			logger.error(error_message)
+			raise BaseException(error_message)
+		merged = repo.git.commit_tree(tree, '-p', head.hexsha, '-p', commit.hexsha, '-m', f"Merge commit '{commit.hexsha}'")
+		head = repo.commit(merged)
+	return head
+
+
+def merge_in_worktree(repo: git.Repo, commits: List[Commit]) -> Commit:
+	"""Merge commits by checking out the first one and running `git merge` for the rest (git < 2.38)."""
+	repo.git.checkout(commits[0].hexsha, detach=True)
+	ensure_clean(repo)
+	for commit in commits[1:]:
+		try:
+			logger.info(f"Merging commit: {commit}")
+			result = repo.git.merge(commit.hexsha)
+			logger.info(result)
+			ensure_clean(repo)
+		except BaseException as e:
+			# Handle merge conflicts according to predefined rules
+			# For now, we'll abort the merge and report failure
+			repo.git.merge('--abort')
+			error_message = f"Merge conflict when merging {commit}: {str(e)}"
+			logger.error(error_message)
+
+			raise BaseException(error_message)
+	return repo.head.commit
+
+
 class CheckoutMerged(AbstractStep[CheckoutAndMergeResult]):
 	wd: GitClone
+	deterministic = True
 
 	def __init__(self, wd: GitClone,
 	             desired_branches: AbstractStep[SharedState],
 	             git_user_email: str,
 	             git_user_name: str,
 	             push: bool = True,
+	             checkout: bool = True,
 	             **kwargs: Any):
 		super().__init__(**kwargs)
 		self.wd = wd
@@ -127,33 +598,33 @@ class CheckoutMerged(AbstractStep[CheckoutAndMergeResult]):
 		self.git_user_email = git_user_email
 		self.git_user_name = git_user_name
 		self.push = push
-
-	def _find_merge_childs(self, tree: Dict[Commit, List[Commit]], commit: Commit) -> List[Commit]:
-
-		visited = [commit]
-		queue = [commit]
-		queue = [child for c in queue for child in tree.get(c, [])]
-
-		while queue:
-			current = queue.pop(0)
-			visited.append(current)
-			for child in tree.get(current, []):
-				if len(child.parents) != 1:
-					queue.append(child)
-
-		return visited
+		# Without checkout the merge result only exists as a commit: the working directory is left as is
+		self.checkout = checkout
+		# auto branch -> sha on the remote, as pushed by us or seen once by ls-remote (auto branches are not fetched)
+		self._pushed: Dict[str, str] = {}
+
+	def _remote_sha(self, repo: git.Repo, branch_name: str) -> str | None:
+		if branch_name not in self._pushed:
+			line = str(repo.git.ls_remote('origin', f"refs/heads/{branch_name}")).split()
+			if line:
+				self._pushed[branch_name] = line[0]
+		return self._pushed.get(branch_name)
 
 	def find_desired_commits(self, repo: git.Repo, branches: List[Tuple[str, str]]) -> Dict[Commit, str]:
 		# Extract commit ids for the selected branches
 		commit_ids: Dict[Commit, str] = {}
+		index = self.wd.ref_index()
 		for branch_pair in branches:
 			try:
 				branch_name, desired_commit = branch_pair
 				if desired_commit == 'HEAD':
-					commit = repo.commit(f'origin/{branch_name}')
+					sha = index.branches.get(branch_name)
 				else:
-					commit = repo.commit(desired_commit)
-				commit_ids[commit] = branch_name
+					info = cat_file(repo).commit(desired_commit)
+					sha = info.sha if info is not None else None
+				if sha is None:
+					raise BaseException(f"Commit {desired_commit} of branch {branch_name} not found")
+				commit_ids[Commit(repo, bytes.fromhex(sha))] = branch_name
 			except BaseException as e:
 				stack = traceback.format_exception(type(e), e, e.__traceback__)
 				logger.error(f"Error finding desired commits for branch {branch_pair}: {str(e)}\n{''.join(stack)}")
@@ -176,75 +647,60 @@ class CheckoutMerged(AbstractStep[CheckoutAndMergeResult]):
 
 		logger.info(f"Selected branches: {desired}")
 
+		self.wd.ensure_commits(repo, [commit for _, commit in desired if commit != 'HEAD'])
 		commit_ids = self.find_desired_commits(repo, desired)
 		logger.info(f"Commit ids for branches: {commit_ids}")
+		self.wd.ensure_merge_base(repo, list(commit_ids.keys()))
 
-		childs = _commits_childs(repo)
-
-		def find_common_merge_commits() -> Set[Commit]:
-			merge_commit: list[tuple[Commit, list[Commit]]] = [(c, self._find_merge_childs(childs, c)) for c in
-			                                                   commit_ids.keys()]
-			legal_merge_commits = [set(l) for c, l in merge_commit]
-			result = legal_merge_commits[0]
-			for l in legal_merge_commits[1:]:
-				result = result.intersection(l)
-			return result
+		cache_ref = merge_cache_ref(list(commit_ids.keys()))
 
+		commit_resulting: Commit | None
 		if len(commit_ids) == 1:
 			commit_resulting = list(commit_ids.keys())[0]
 			logger.info(f"Only one branch selected, using commit {commit_resulting.hexsha}")
 		else:
-			merge_commits = find_common_merge_commits()  # TODO There bugs here
-			commit_resulting = None
-			if len(merge_commits) > 0:
-				commit_resulting = merge_commits.pop()
-				logger.info(f"Common commit found {merge_commits}")
+			commit_resulting = _read_ref(repo, cache_ref)
+			if commit_resulting is not None:
+				logger.info(f"Merge of {len(commit_ids)} commits found in cache {cache_ref}: {commit_resulting.hexsha}")
+			else:
+				commit_resulting = find_common_merge_commit(repo, list(commit_ids.keys()))
+				if commit_resulting is not None:
+					logger.info(f"Common commit found {commit_resulting.hexsha}")
 
 		if commit_resulting is None:
 			logger.info(f"Merging commits")
-			# Merge the rest of the branches
 			commits = list(commit_ids.keys())
-			repo.git.checkout(commits[0].hexsha, detach=True)
-			ensure_clean(repo)
-			for commit in commits[1:]:
-				try:
-					logger.info(f"Merging commit: {commit}")
-					result = repo.git.merge(commit.hexsha)
-					logger.info(result)
-					ensure_clean(repo)
-				except BaseException as e:
-					# Handle merge conflicts according to predefined rules
-					# For now, we'll abort the merge and report failure
-					repo.git.merge('--abort')
-					error_message = f"Merge conflict when merging {commit}: {str(e)}"
-					logger.error(error_message)
+			if supports_merge_tree(repo):
+				commit_resulting = merge_in_odb(repo, commits)
+			else:
+				commit_resulting = merge_in_worktree(repo, commits)
 
-					raise BaseException(error_message)
-			commit_resulting = repo.head.commit
+		if len(commit_ids) > 1:
+			repo.git.update_ref(cache_ref, commit_resulting.hexsha)
 
-		repo.git.checkout(commit_resulting.hexsha, detach=True)
-		ensure_clean(repo)
+		if self.checkout:
+			repo.git.checkout(commit_resulting.hexsha, detach=True)
+			ensure_clean(repo)
 		remote_branch_name = None
 		sorted_commits = sorted(commit_ids.keys(), key=lambda x: x.hexsha)
 		version = '-'.join([x.hexsha[0:8] for x in sorted_commits])
 
-		for ref in repo.refs:
-			if ref.is_remote() and ref.commit == repo.head.commit and ref.name != 'origin/HEAD':
-				logger.info(f"Merge commit {ref.commit} corresponds to branch {ref}")
-				remote_branch_name = ref.name[len('origin/'):]
-				break
+		existing = self.wd.ref_index().names(commit_resulting.hexsha)
+		if existing:
+			logger.info(f"Merge commit {commit_resulting} corresponds to branch origin/{existing[0]}")
+			remote_branch_name = existing[0]
 		if self.push and remote_branch_name is None:
-			auto_branch_hash = hashlib.sha1(''.join([x.hexsha for x in sorted_commits]).encode()).hexdigest()
 			auto_branch_name = f"auto-{version}"
-
-			logger.info(f"Pushing {repo.head.commit.hexsha} -> {auto_branch_name}")
-			repo.git.push('-f', 'origin', f"HEAD:refs/heads/{auto_branch_name}")
+			if self._remote_sha(repo, auto_branch_name) != commit_resulting.hexsha:
+				logger.info(f"Pushing {commit_resulting.hexsha} -> {auto_branch_name}")
+				repo.git.push('-f', 'origin', f"{commit_resulting.hexsha}:refs/heads/{auto_branch_name}")
+				self._pushed[auto_branch_name] = commit_resulting.hexsha
 			remote_branch_name = auto_branch_name
 
 		return CheckoutAndMergeResult(
 			wd=repo_path,
 			remote_branch_name=remote_branch_name,
-			commit_hash=repo.head.commit.hexsha,
+			commit_hash=commit_resulting.hexsha,
 			version=version
 		)
 
@@ -257,6 +713,17 @@ class HasVersion(Protocol):
 	version: str
 
 
+def deployed_version(services: Mapping[str, HasVersion]) -> str:
+	"""The one version all running services carry; raises while none runs or services run different versions."""
+	versions = set([it.version for it in services.values()])
+	if len(versions) != 1:
+		raise BaseException(f"Expected exactly one version, got: {versions}")
+	version = list(versions)[0]
+	if not version:
+		raise BaseException(f"Expected exactly one version, got: {versions}")
+	return version
+
+
 @dataclass
 class GitUnmergeResult:
 	branches: List[Tuple[str, str]]  # (branch_name, commit_hash) pairs
@@ -265,6 +732,7 @@ class GitUnmergeResult:
 
 class GitUnmerge(AbstractStep[GitUnmergeResult]):
 	wd: GitClone
+	deterministic = True
 
 	def __init__(self, wd: GitClone,
 	             check: AbstractStep[Mapping[str, HasVersion]],
@@ -275,46 +743,36 @@ class GitUnmerge(AbstractStep[GitUnmergeResult]):
 
 	def progress(self) -> GitUnmergeResult:
 		wd = self.wd.progress()
-		deployState: Mapping[str, HasVersion] = self.check.progress()
-
-		versions = set([it.version for it in deployState.values()])
-		if len(versions) != 1:
-			raise BaseException(f"Expected exactly one version, got: {versions}")
-
-		version = list(versions)[0]
-		if version is None:
-			raise BaseException(f"Expected exactly one version, got: {versions}")
+		version = deployed_version(self.check.progress())
 		repo = git.Repo(wd)
-		childs: Dict[Commit, List[Commit]] | None = None
+		childs: Dict[str, List[str]] | None = None
 		if 'auto-' in version:
 			version_parts = version[len('auto-'):].split('-')
+			self.wd.ensure_commits(repo, version_parts)
+			index = self.wd.ref_index()
 
 			commits: List[Tuple[str, str]] = []
 			for v in version_parts:
-				commit = repo.commit(v)
-				# branches = [head.name for head in repo.heads if head.commit.hexsha == commit.hexsha]
-				branches = [ref.name for ref in repo.remotes.origin.refs if ref.commit.hexsha == commit.hexsha]
-				branches = [b[len('origin/'):] for b in branches if
-				            b.startswith('origin/') and not b.startswith('origin/HEAD')]
+				info = cat_file(repo).commit(v)
+				if info is None:
+					raise BaseException(f"Commit {v} of version {version} not found")
+				branches = index.names(info.sha)
 
 				if len(branches) == 0 or branches[0].startswith('auto/'):
 					if childs is None:
 						childs = _commits_childs(repo)
-					commitsSet = {commit}
+					commitsSet = {info.sha}
 					while len(commitsSet) > 0:
 						current = commitsSet.pop()
 						for child in childs.get(current, []):
-							branches = [ref.name for ref in repo.remotes.origin.refs if
-							            ref.commit.hexsha == child.hexsha]
-							branches = [b[len('origin/'):] for b in branches if
-							            b.startswith('origin/') and not b.startswith('origin/HEAD')]
+							branches = index.names(child)
 
 							if len(branches) > 0:
 								commitsSet = set()
 							else:
 								commitsSet.add(child)
 				for b in branches:
-					commits.append((b, commit.hexsha))
+					commits.append((b, info.sha))
 
 			if len(commits) == 0:
 				raise BaseException(f"Unable to unmerge version: {version}")
@@ -326,3 +784,112 @@ class GitUnmerge(AbstractStep[GitUnmergeResult]):
 			)
 		else:
 			raise BaseException(f"Version format not recognized: {version}")
+
+
+@dataclass
+class AutoBranchGCResult:
+	kept: List[str]
+	deleted: List[str]  # would be deleted in dry mode
+	dry: bool
+	checked_at: float
+
+
+class AutoBranchGC(AbstractStep[AutoBranchGCResult]):
+	"""
+	Deletes branches pushed by CheckoutMerged (auto-<version>) from the remote once they are older than
+	retention_days and neither deployed (per check) nor the current merge (per checkout).
+	The pattern matches the auto branches of every environment on the same remote, so the versions deployed and merged
+	by the other environments (set by App, all environments of this instance) on wd's url are kept as well;
+	if one of them cannot be read nothing is deleted.
+	The age of a branch is the commit date of its tip. auto-* branches are not fetched, so tips that are not local
+	(pushed by other instances) are fetched first; a branch whose age still cannot be read is kept.
+	The remote is listed at most every min_interval_s seconds, at most max_deletions branches are deleted per run.
+	"""
+
+	def __init__(self, wd: GitClone,
+	             check: AbstractStep[Mapping[str, HasVersion]],
+	             checkout: AbstractStep[CheckoutAndMergeResult] | None = None,
+	             retention_days: float = 14,
+	             pattern: str = "auto-*",
+	             min_interval_s: float = 3600,
+	             max_deletions: int = 100,
+	             **kwargs: Any):
+		super().__init__(**kwargs)
+		self.wd = wd
+		self.check = check
+		self.checkout = checkout
+		self.retention_days = retention_days
+		self.pattern = pattern
+		self.min_interval_s = min_interval_s
+		self.max_deletions = max_deletions
+		self.environments: List[Environment] = []
+		self._last: AutoBranchGCResult | None = None
+
+	def _in_use(self) -> Set[str]:
+		"""Versions deployed or merged by this environment and by the other environments on the same remote."""
+		from steps.step import CachingStep
+		in_use = {it.version for it in self.check.progress().values() if it.version is not None}
+		if self.checkout is not None:
+			in_use.add(f"auto-{self.checkout.progress().version}")
+		wd: AbstractStep[Any] = self.wd
+		if isinstance(wd, CachingStep):
+			wd = wd._step
+		url = wd.url if isinstance(wd, GitClone) else None
+		for env in self.environments:
+			if env is self._env:
+				continue
+			steps = [(step, step._step if isinstance(step, CachingStep) else step) for step in env.pipeline]
+			if not any(isinstance(inner, GitClone) and inner.url == url for _, inner in steps):
+				continue
+			for step, inner in steps:
+				try:
+					if isinstance(inner, GitUnmerge):
+						in_use |= {it.version for it in inner.check.progress().values() if it.version is not None}
+					elif isinstance(inner, CheckoutMerged):
+						in_use.add(f"auto-{step.progress().version}")
+				except BaseException as e:
+					raise BaseException(f"Versions used by {env.id} are unknown, not deleting auto branches: {e}")
+		return in_use
+
+	def _fetch_tips(self, repo: git.Repo, names: List[str]) -> None:
+		"""Fetch the objects of the given branches without creating tracking refs."""
+		try:
+			repo.git.fetch('--no-tags', '--no-write-fetch-head', '--refmap=', 'origin',
+			               *[f"refs/heads/{name}" for name in names])
+		except git.GitCommandError as e:
+			logger.warning(f"Unable to fetch auto branches {names}, keeping them: {str(e)}")
+
+	def progress(self) -> AutoBranchGCResult:
+		now = time.time()
+		if self._last is not None and now - self._last.checked_at < self.min_interval_s:
+			return self._last
+
+		repo = git.Repo(self.wd.progress())
+		in_use = self._in_use()
+
+		remote: Dict[str, str] = {}
+		for line in str(repo.git.ls_remote('origin', f"refs/heads/{self.pattern}")).splitlines():
+			sha, ref = line.split('\t', 1)
+			remote[ref[len('refs/heads/'):]] = sha
+
+		commits = cat_file(repo)
+		unknown = [name for name, sha in sorted(remote.items()) if commits.commit(sha) is None]
+		if unknown:
+			self._fetch_tips(repo, unknown)
+
+		expired: List[Tuple[int, str]] = []
+		kept: List[str] = []
+		for name, sha in sorted(remote.items()):
+			tip = commits.commit(sha)
+			if name in in_use or tip is None or now - tip.committed_at < self.retention_days * 86400:
+				kept.append(name)
+			else:
+				expired.append((tip.committed_at, name))
+		to_delete = [name for _, name in sorted(expired)[:self.max_deletions]]
+
+		dry = self._env is not None and self._env.dry
+		if to_delete and not dry:
+			logger.info(f"Deleting {len(to_delete)} expired auto branches: {to_delete}")
+			repo.git.push('origin', '--delete', *to_delete)
+		self._last = AutoBranchGCResult(kept=kept, deleted=to_delete, dry=dry, checked_at=now)
+		return self._last
@@ -1,17 +1,119 @@
 import hashlib
 import json
-from typing import TypeVar, Generic, Any
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import TypeVar, Generic, Any, Callable, Dict, List
 
+import metrics
+import tracing
 from enironment import AbstractStep
 
 T = TypeVar('T')
 
+logger = logging.getLogger(__name__)
+
 
 class NotReadyException(BaseException):
 	def __init__(self, message: str):
 		super().__init__(message)
 
 
+@dataclass
+class JobProgress:
+	phase: str = "starting"
+	current: int | None = None
+	total: int | None = None
+	detail: Dict[str, Any] = field(default_factory=dict)
+
+
+_job_listeners: List[Callable[[], None]] = []
+
+
+def add_job_listener(listener: Callable[[], None]) -> None:
+	"""Register a callback invoked (from the job thread) whenever a background job finishes."""
+	_job_listeners.append(listener)
+
+
+class BackgroundJob(Generic[T]):
+	"""Long-running unit of step work, identified by job_id and polled until done."""
+
+	def __init__(self, job_id: str, name: str, work: Callable[['BackgroundJob[T]'], T]) -> None:
+		self.job_id = job_id
+		self.name = name
+		self._work = work
+		self._lock = threading.Lock()
+		self._progress = JobProgress()
+		self._result: T | BaseException = NotReadyException(f"Job {job_id} not finished")
+		self._done = threading.Event()
+		self.started_at = time.time()
+		self.finished_at: float | None = None
+
+	def start(self) -> 'BackgroundJob[T]':
+		thread = threading.Thread(target=self._execute, name=f"job-{self.name}-{self.job_id[:8]}", daemon=True)
+		thread.start()
+		return self
+
+	def run(self) -> T:
+		"""Execute the job on the calling thread and return its result."""
+		self._execute()
+		return self.result()
+
+	def _execute(self) -> None:
+		try:
+			self._result = self._work(self)
+		except BaseException as e:
+			self._result = e
+		finally:
+			self.finished_at = time.time()
+			self._done.set()
+			for listener in list(_job_listeners):
+				try:
+					listener()
+				except Exception as e:
+					logger.error(f"Job listener failed: {e}")
+
+	def report(self, phase: str, current: int | None = None, total: int | None = None, **detail: Any) -> None:
+		with self._lock:
+			self._progress = JobProgress(phase=phase, current=current, total=total, detail=detail)
+
+	@property
+	def done(self) -> bool:
+		return self._done.is_set()
+
+	@property
+	def failed(self) -> bool:
+		return self.done and isinstance(self._result, BaseException)
+
+	def result(self) -> T:
+		if not self.done:
+			raise JobInProgressException(self)
+		if isinstance(self._result, BaseException):
+			raise self._result
+		return self._result
+
+	def snapshot(self) -> Dict[str, Any]:
+		with self._lock:
+			progress = self._progress
+		return {
+			"job_id": self.job_id,
+			"step": self.name,
+			"phase": progress.phase,
+			"current": progress.current,
+			"total": progress.total,
+			"detail": progress.detail,
+			"elapsed": round((self.finished_at or time.time()) - self.started_at, 1),
+		}
+
+
+class JobInProgressException(NotReadyException):
+	def __init__(self, job: BackgroundJob[Any]) -> None:
+		super().__init__(f"Job {job.job_id} for {job.name} is running")
+		self.job = job
+
+
 def _stable_hash(obj: Any) -> str:
 	"""Compute a stable SHA-256 hash of an object via JSON serialization."""
 	try:
@@ -21,6 +123,30 @@ def _stable_hash(obj: Any) -> str:
 	return hashlib.sha256(serialized.encode()).hexdigest()
 
 
+class StepLog:
+	"""Bounded ring buffer of output lines produced by a step; every line gets a monotonically growing seq."""
+
+	def __init__(self, capacity: int = 500) -> None:
+		self._lines: deque[Dict[str, Any]] = deque(maxlen=capacity)
+		self._lock = threading.Lock()
+		self.last_seq = 0
+
+	def append(self, line: str) -> None:
+		line = line.rstrip()
+		if not line:
+			return
+		with self._lock:
+			self.last_seq += 1
+			self._lines.append({"seq": self.last_seq, "ts": time.time(), "line": line})
+
+	def since(self, seq: int) -> List[Dict[str, Any]]:
+		"""Lines with seq greater than the given one that are still in the buffer."""
+		with self._lock:
+			if seq >= self.last_seq:
+				return []
+			return [it for it in self._lines if it["seq"] > seq]
+
+
 class CachingStep(AbstractStep[T], Generic[T]):
 	_result: T | BaseException
 	_input_hash: str | None
@@ -32,7 +158,7 @@ class CachingStep(AbstractStep[T], Generic[T]):
 		self._input_hash = None
 
 	def _compute_input_hash(self) -> str:
-		"""Compute a stable hash of all AbstractStep dependency outputs."""
+		"""Compute a stable hash of all AbstractStep dependency outputs (and fingerprints)."""
 		inputs: dict[str, Any] = {}
 		for attr_name, attr_value in vars(self._step).items():
 			if isinstance(attr_value, AbstractStep):
@@ -40,16 +166,33 @@ class CachingStep(AbstractStep[T], Generic[T]):
 					inputs[attr_name] = attr_value.progress()
 				except BaseException as e:
 					inputs[attr_name] = repr(e)
+				fingerprint = attr_value.fingerprint()
+				if fingerprint is not None:
+					inputs[attr_name] = [inputs[attr_name], fingerprint]
 		return _stable_hash(inputs)
 
 	def progress(self) -> T:
-		current_hash = self._compute_input_hash()
-		if self._input_hash != current_hash or isinstance(self._result, BaseException):
-			try:
-				self._result = self._step.progress()
-			except BaseException as e:
-				self._result = e
-			self._input_hash = current_hash
+		env_id = self._env.id if self._env is not None else ""
+		with tracing.span("step", env=env_id, step=self.name):
+			with tracing.span("step.input_hash", step=self.name):
+				current_hash = self._compute_input_hash()
+			if self._input_hash != current_hash or isinstance(self._result, BaseException):
+				started = time.perf_counter()
+				try:
+					with tracing.span("step.progress", step=self.name):
+						self._result = self._step.progress()
+					outcome = "ok"
+				except JobInProgressException as e:
+					self._result = e
+					outcome = "in_progress"
+				except BaseException as e:
+					self._result = e
+					outcome = "error"
+				metrics.step_duration.observe(time.perf_counter() - started, env_id, self.name)
+				metrics.step_executions.inc(env_id, self.name, outcome)
+				self._input_hash = current_hash
+			else:
+				metrics.step_cache_hits.inc(env_id, self.name)
 		if isinstance(self._result, BaseException):
 			raise self._result from None
 		return self._result
@@ -57,6 +200,13 @@ class CachingStep(AbstractStep[T], Generic[T]):
 	def reset(self) -> None:
 		self._input_hash = None
 
+	def fingerprint(self) -> str | None:
+		return self._step.fingerprint()
+
+	@property
+	def log(self) -> StepLog:
+		return self._step.log
+
 	def __getattr__(self, name: str) -> Any:
 		"""Delegate unknown attributes to the wrapped step."""
 		return getattr(self._step, name)
@@ -0,0 +1,149 @@
+import functools
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Any, Callable, Dict, Iterator, List
+
+logger = logging.getLogger(__name__)
+
+# Spans are recorded only while a tick is traced and TRACE_DIR is set; each tick becomes one Chrome trace file
+# (open in chrome://tracing or https://ui.perfetto.dev).
+TRACE_DIR = os.getenv("TRACE_DIR", "")
+TRACE_KEEP = int(os.getenv("TRACE_KEEP", "50"))
+
+_CREDENTIALS_RE = re.compile(r'://[^/@\s]+@')
+
+
+class TraceCollector:
+	def __init__(self, name: str) -> None:
+		self.name = name
+		self.started_at = time.time()
+		self._events: List[Dict[str, Any]] = []
+		self._lock = threading.Lock()
+
+	def add(self, event: Dict[str, Any]) -> None:
+		with self._lock:
+			self._events.append(event)
+
+	@property
+	def events(self) -> List[Dict[str, Any]]:
+		with self._lock:
+			return list(self._events)
+
+	def write(self, directory: str, keep: int) -> str:
+		os.makedirs(directory, exist_ok=True)
+		path = os.path.join(directory, f"{self.name}-{int(self.started_at * 1000)}-{os.getpid()}.json")
+		with open(path, "w") as f:
+			json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f, default=str)
+		traces = sorted((os.path.join(directory, it) for it in os.listdir(directory) if it.endswith(".json")),
+		                key=os.path.getmtime)
+		for old in traces[:max(0, len(traces) - keep)]:
+			os.remove(old)
+		return path
+
+
+_collector: TraceCollector | None = None
+_current_span: ContextVar[int | None] = ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[None]:
+	"""Record a span (child of the current one) into the tick being traced. No-op when no tick is traced."""
+	collector = _collector
+	if collector is None:
+		yield
+		return
+	span_id = next(_span_ids)
+	parent_id = _current_span.get()
+	token = _current_span.set(span_id)
+	ts = time.time_ns() // 1000
+	started = time.perf_counter_ns()
+	try:
+		yield
+	except BaseException as e:
+		attrs["error"] = repr(e)[:200]
+		raise
+	finally:
+		_current_span.reset(token)
+		collector.add({
+			"name": name,
+			"ph": "X",
+			"ts": ts,
+			"dur": (time.perf_counter_ns() - started) // 1000,
+			"pid": os.getpid(),
+			"tid": threading.get_ident(),
+			"args": {"span_id": span_id, "parent_id": parent_id, **attrs},
+		})
+
+
+@contextmanager
+def trace_tick(name: str = "tick") -> Iterator[None]:
+	"""Trace everything under this block into one file in TRACE_DIR. Nested ticks become plain spans."""
+	global _collector
+	if not TRACE_DIR or _collector is not None:
+		with span(name):
+			yield
+		return
+	collector = TraceCollector(name)
+	_collector = collector
+	try:
+		with span(name):
+			yield
+	finally:
+		_collector = None
+		try:
+			collector.write(TRACE_DIR, TRACE_KEEP)
+		except OSError as e:
+			logger.warning(f"Unable to write trace to {TRACE_DIR}: {str(e)}")
+
+
+def in_current_context[**P, R](fn: Callable[P, R]) -> Callable[P, R]:
+	"""Bind fn to the caller's span so spans opened by pool workers get the right parent."""
+	context = copy_context()
+
+	def run(*args: P.args, **kwargs: P.kwargs) -> R:
+		return context.copy().run(fn, *args, **kwargs)
+
+	return run
+
+
+def _traced[**P, R](name: str, describe: Callable[..., Dict[str, Any]]) -> Callable[[Callable[P, R]], Callable[P, R]]:
+	def decorator(fn: Callable[P, R]) -> Callable[P, R]:
+		@functools.wraps(fn)
+		def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+			if _collector is None:
+				return fn(*args, **kwargs)
+			with span(name, **describe(*args, **kwargs)):
+				return fn(*args, **kwargs)
+
+		setattr(wrapper, "__traced__", True)
+		return wrapper
+
+	return decorator
+
+
+def _describe_git(_self: Any, command: Any, *args: Any, **kwargs: Any) -> Dict[str, Any]:
+	text = " ".join(command) if isinstance(command, (list, tuple)) else str(command)
+	return {"command": _CREDENTIALS_RE.sub("://***@", text)[:300]}
+
+
+def _describe_docker(_self: Any, request: Any, *args: Any, **kwargs: Any) -> Dict[str, Any]:
+	return {"method": getattr(request, "method", ""), "path": getattr(request, "path_url", "")}
+
+
+def instrument_libraries() -> None:
+	"""Wrap GitPython command execution and Docker API requests in spans. Safe to call more than once."""
+	import git.cmd
+	from docker.api.client import APIClient
+
+	if not getattr(git.cmd.Git.execute, "__traced__", False):
+		git.cmd.Git.execute = _traced("git", _describe_git)(git.cmd.Git.execute)  # type: ignore[method-assign,assignment]
+	if not getattr(APIClient.send, "__traced__", False):
+		APIClient.send = _traced("docker", _describe_docker)(APIClient.send)  # type: ignore[method-assign]
@@ -0,0 +1,149 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List
+
+import processing
+import tracing
+from enironment import AbstractStep, Environment
+from steps.docker import DockerSwarmCheck, shared_swarm_snapshot
+from steps.git import GitClone
+from steps.step import CachingStep
+
+logger = logging.getLogger(__name__)
+
+WARMUP_WORKERS = 8
+
+
+@dataclass
+class WarmupPhase:
+	phase: str
+	started_at: float
+	duration_s: float
+	errors: int = 0
+
+
+@dataclass
+class WarmupTimeline:
+	started_at: float
+	total_s: float = 0.0
+	phases: List[WarmupPhase] = field(default_factory=list)
+	environments: Dict[str, List[WarmupPhase]] = field(default_factory=dict)  # per environment phase durations
+
+	def for_environment(self, env_id: str) -> Dict[str, Any]:
+		return {
+			"started_at": self.started_at,
+			"total_s": self.total_s,
+			"phases": self.phases,
+			"environment": self.environments.get(env_id, []),
+		}
+
+
+def _inner(step: AbstractStep[Any]) -> AbstractStep[Any]:
+	return step._step if isinstance(step, CachingStep) else step
+
+
+def _timed(action: Callable[[], bool]) -> tuple[float, float, bool]:
+	started = time.time()
+	ok = action()
+	return started, round(time.time() - started, 3), ok
+
+
+def _progress_quietly(step: AbstractStep[Any]) -> bool:
+	try:
+		step.progress()
+		return True
+	except BaseException as e:
+		logger.warning(f"Warmup of {step.name} failed: {str(e)}")
+		return False
+
+
+def _fetch_all(environments: List[Environment], timeline: WarmupTimeline, pool: ThreadPoolExecutor) -> int:
+	"""
+	Clone/fetch every remote once: clones of the same url fetching the same branches run one after another,
+	a full clone first, and the others seed their branches from it locally before checking the remote.
+	"""
+	groups: Dict[tuple[str, str], List[tuple[str, AbstractStep[Any], GitClone]]] = {}
+	for env in environments:
+		for step in env.pipeline:
+			inner = _inner(step)
+			if isinstance(inner, GitClone):
+				groups.setdefault((inner.url, inner._fetched_branches()), []).append((env.id, step, inner))
+
+	def is_full(clone: GitClone) -> bool:
+		return clone.clone_filter is None and clone.depth is None
+
+	def fetch_group(steps: List[tuple[str, AbstractStep[Any], GitClone]]) -> List[tuple[str, float, float, bool]]:
+		results: List[tuple[str, float, float, bool]] = []
+		source: GitClone | None = None
+		for env_id, step, clone in sorted(steps, key=lambda it: not is_full(it[2])):
+			def fetch() -> bool:
+				if source is not None and source.resolve_repo_path() != clone.resolve_repo_path():
+					clone.seed_from(source.resolve_repo_path())
+				return _progress_quietly(step)
+
+			started, duration, ok = _timed(fetch)
+			if ok and source is None and is_full(clone):
+				source = clone
+			results.append((env_id, started, duration, ok))
+		return results
+
+	errors = 0
+	for results in pool.map(tracing.in_current_context(fetch_group), groups.values()):
+		for env_id, started, duration, ok in results:
+			errors += 0 if ok else 1
+			timeline.environments.setdefault(env_id, []).append(
+				WarmupPhase("fetch", started, duration, errors=0 if ok else 1))
+	return errors
+
+
+def run_warmup(environments: List[Environment], onupdate: Callable[[], None]) -> WarmupTimeline:
+	"""
+	Cold-start phase: fetch all repositories concurrently, list Docker swarm services once,
+	then run the pipelines of all environments concurrently to populate the step caches.
+	"""
+	timeline = WarmupTimeline(started_at=time.time())
+
+	def phase(name: str, action: Callable[[], int]) -> None:
+		started = time.time()
+		with tracing.span(f"warmup.{name}"):
+			errors = action()
+		timeline.phases.append(WarmupPhase(name, started, round(time.time() - started, 3), errors))
+		onupdate()
+
+	with tracing.trace_tick("warmup"), ExitStack() as stack, \
+			ThreadPoolExecutor(max_workers=WARMUP_WORKERS, thread_name_prefix="warmup") as pool:
+		phase("fetch", lambda: _fetch_all(environments, timeline, pool))
+
+		if any(isinstance(_inner(step), DockerSwarmCheck) for env in environments for step in env.pipeline):
+			def take_snapshot() -> int:
+				try:
+					services = stack.enter_context(shared_swarm_snapshot())
+					logger.info(f"Docker swarm snapshot: {len(services)} services")
+					return 0
+				except BaseException as e:
+					logger.warning(f"Unable to snapshot Docker swarm services: {str(e)}")
+					return 1
+
+			phase("docker", take_snapshot)
+
+		def run_pipelines() -> int:
+			def run(env: Environment) -> tuple[str, float, float, bool]:
+				return (env.id, *_timed(lambda: not processing.process_environment(env, onupdate)[0]))
+
+			errors = 0
+			for env_id, started, duration, ok in pool.map(tracing.in_current_context(run), environments):
+				errors += 0 if ok else 1
+				timeline.environments.setdefault(env_id, []).append(
+					WarmupPhase("pipeline", started, duration, errors=0 if ok else 1))
+			return errors
+
+		phase("pipelines", run_pipelines)
+
+	processing.mark_caches_fresh()
+	timeline.total_s = round(time.time() - timeline.started_at, 3)
+	phases = ", ".join(f"{p.phase} {p.duration_s}s ({p.errors} errors)" for p in timeline.phases)
+	logger.info(f"Warmup finished in {timeline.total_s}s: {phases}")
+	return timeline
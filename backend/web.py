@@ -2,24 +2,31 @@ import asyncio
 import json
 import logging
 import os
+import threading
+import time
 import traceback
 from contextlib import asynccontextmanager
-from typing import Any, AsyncIterator, Dict, List, Optional, TypeVar
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, TypeVar
 
 from fastapi import FastAPI, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
 
-from app import App
-from enironment import get_step
+import metrics
+import tracing
+from app import App, PROCESSING_THREAD_NAME
+from enironment import AbstractStep, get_step
 from utils import custom_json_dumps
 from processing import reset_caches
+from profiler import SamplingProfiler
 from secondary import SecondaryManager
 from steps.step import CachingStep
 
 logger = logging.getLogger(__name__)
 
 FRONTEND_DIR = os.path.join(os.path.dirname(__file__), '../frontend')
+LOG_POLL_INTERVAL = 0.5
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 
 T = TypeVar('T')
 
@@ -48,6 +55,7 @@ class WebApp:
 
 		self.ws_connections: Dict[WebSocket, Dict[str, Any]] = {}
 		self._event_loop: Optional[asyncio.AbstractEventLoop] = None
+		self._profile_lock = asyncio.Lock()
 		self.secondaryManager: Optional[SecondaryManager] = None
 		
 		@asynccontextmanager
@@ -71,8 +79,11 @@ class WebApp:
 		self.app.get("/")(self.serve_index)
 		self.app.get("/state")(self.serve_state)
 		self.app.get("/branches")(self.serve_branches_route)
+		self.app.get("/metrics")(self.serve_metrics)
+		self.app.get("/admin/profile")(self.serve_profile)
 		self.app.get("/{path:path}")(self.serve_static)
 		self.app.websocket("/ws")(self.websocket_endpoint)
+		self.app.websocket("/ws/logs")(self.logs_endpoint)
 
 	# --- State assembly (local + secondary) ---
 
@@ -105,7 +116,8 @@ class WebApp:
 	async def broadcast(self, event: str, data: Any) -> None:
 		"""Broadcast a message to all connected WebSocket clients that have not seen this data yet."""
 		disconnected = set()
-		message = custom_json_dumps({event: data})
+		with tracing.span("broadcast.serialize", event=event):
+			message = custom_json_dumps({event: data})
 
 		for websocket in self.ws_connections.keys():
 			if self.ws_connections[websocket].get(event) == message:
@@ -113,12 +125,15 @@ class WebApp:
 			try:
 				await websocket.send_text(message)
 				self.ws_connections[websocket][event] = message
+				metrics.broadcast_messages.inc(event)
+				metrics.broadcast_bytes.inc(event, amount=len(message))
 			except Exception as e:
 				logger.error(f"Error sending to websocket: {e}")
 				disconnected.add(websocket)
 
 		for ws in disconnected:
 			self.ws_connections.pop(ws, None)
+		metrics.websocket_clients.set(len(self.ws_connections), "ws")
 
 	async def broadcast_all(self) -> None:
 		await self.broadcast("branches", self.get_global_branches_to_emit())
@@ -149,6 +164,36 @@ class WebApp:
 	async def serve_branches_route(self) -> Response:
 		return Response(content=custom_json_dumps(self.get_global_branches_to_emit()), media_type="application/json")
 
+	async def serve_metrics(self) -> Response:
+		return Response(content=metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+	async def serve_profile(self, seconds: float = 10, interval_ms: float = 5, threads: str = "processing,loop",
+	                        token: str = "") -> Response:
+		"""
+		Sample the selected threads (processing, loop or all) for the given time and
+		return the collapsed stacks, ready for flamegraph.pl or speedscope. Disabled unless ADMIN_TOKEN is set.
+		"""
+		if not ADMIN_TOKEN or token != ADMIN_TOKEN:
+			return Response(content="Forbidden", status_code=403)
+		if self._profile_lock.locked():
+			return Response(content="Profile already running", status_code=409)
+		async with self._profile_lock:
+			selected = set(threads.split(","))
+			thread_ids: Optional[set[int]] = None
+			if "all" not in selected:
+				thread_ids = {t.ident for t in threading.enumerate()
+				              if t.ident is not None and t.name == PROCESSING_THREAD_NAME and "processing" in selected}
+				if "loop" in selected:
+					thread_ids.add(threading.get_ident())
+			profiler = SamplingProfiler(interval=interval_ms / 1000, thread_ids=thread_ids)
+			await asyncio.to_thread(profiler.run, seconds)
+		logger.info(f"Profile finished: {profiler.sample_count} samples of {threads}")
+		return Response(
+			content=profiler.collapsed(),
+			media_type="text/plain",
+			headers={"Content-Disposition": f'attachment; filename="profile-{int(time.time())}.collapsed"'},
+		)
+
 	async def serve_static(self, path: str) -> FileResponse:
 		file_path = os.path.join(FRONTEND_DIR, path)
 		if os.path.exists(file_path) and os.path.isfile(file_path):
@@ -158,6 +203,7 @@ class WebApp:
 	async def websocket_endpoint(self, websocket: WebSocket) -> None:
 		await websocket.accept()
 		self.ws_connections[websocket] = {}
+		metrics.websocket_clients.set(len(self.ws_connections), "ws")
 
 		try:
 			# Send initial state on connect and record it so duplicate broadcasts are suppressed
@@ -167,6 +213,8 @@ class WebApp:
 			self.ws_connections[websocket]["branches"] = branches_payload
 			await websocket.send_text(envs_payload)
 			self.ws_connections[websocket]["environments"] = envs_payload
+			metrics.broadcast_bytes.inc("branches", amount=len(branches_payload))
+			metrics.broadcast_bytes.inc("environments", amount=len(envs_payload))
 
 			while True:
 				data = await websocket.receive_text()
@@ -209,6 +257,57 @@ class WebApp:
 		except Exception as e:
 			logger.error(f"WebSocket error: {e}:{traceback.format_exc()}")
 			await self.broadcast_error({'message': f'{e}:{traceback.format_exc()}'})
+		finally:
+			metrics.websocket_clients.set(len(self.ws_connections), "ws")
+
+	def _find_step(self, env_id: str, step_name: str) -> Optional[AbstractStep[Any]]:
+		env = self.core.environments.get(env_id)
+		if env is None:
+			return None
+		return next((step for step in env.pipeline if step.name == step_name), None)
+
+	async def _receive_log_subscriptions(self, websocket: WebSocket, subscriptions: Dict[Tuple[str, str], int]) -> None:
+		while True:
+			message = json.loads(await websocket.receive_text())
+			if "subscribe" in message:
+				sub = message["subscribe"] or {}
+				subscriptions[(sub.get("env", ""), sub.get("step", ""))] = int(sub.get("since", 0))
+			elif "unsubscribe" in message:
+				sub = message["unsubscribe"] or {}
+				subscriptions.pop((sub.get("env", ""), sub.get("step", "")), None)
+
+	async def logs_endpoint(self, websocket: WebSocket) -> None:
+		"""Stream step log lines incrementally, only for the (env, step) pairs the client subscribed to."""
+		await websocket.accept()
+		metrics.websocket_clients.inc("ws/logs")
+		subscriptions: Dict[Tuple[str, str], int] = {}
+		receiver = asyncio.create_task(self._receive_log_subscriptions(websocket, subscriptions))
+		try:
+			while not receiver.done():
+				for (env_id, step_name), seq in list(subscriptions.items()):
+					step = self._find_step(env_id, step_name)
+					if step is None:
+						continue
+					lines = step.log.since(seq)
+					if not lines:
+						continue
+					await websocket.send_text(custom_json_dumps({"logs": {
+						"env": env_id,
+						"step": step_name,
+						"lines": lines,
+						"truncated": lines[0]["seq"] > seq + 1,
+					}}))
+					subscriptions[(env_id, step_name)] = lines[-1]["seq"]
+				await asyncio.wait({receiver}, timeout=LOG_POLL_INTERVAL)
+		except WebSocketDisconnect:
+			pass
+		except Exception as e:
+			logger.error(f"Logs WebSocket error: {e}:{traceback.format_exc()}")
+		finally:
+			metrics.websocket_clients.dec("ws/logs")
+			receiver.cancel()
+			if receiver.done() and not receiver.cancelled() and not isinstance(receiver.exception(), WebSocketDisconnect):
+				logger.error(f"Logs WebSocket receiver failed: {receiver.exception()}")
 
 	# --- Run ---
 
@@ -0,0 +1,162 @@
+"""
+Step engine benchmark: synthetic environments with configurable pipeline depth, fan-out and result size.
+
+Measures wrap_in_cached, get_step, cold/warm/invalidated process_all_jobs ticks, the number of
+progress() invocations and the cost of input hash computation.
+
+	python -m benchmarks.bench_engine --envs 5 --depth 10 --fanout 2 --result-size 2000 --json engine.json
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List
+
+import metrics
+import processing
+from enironment import AbstractStep, Environment, get_step, wrap_in_cached
+from steps.shared_state import SharedStateHolderInMemory
+from steps.step import CachingStep, _stable_hash
+
+
+class SyntheticStep(AbstractStep[Dict[str, Any]]):
+	"""Returns a payload of about result_size bytes derived from its upstream steps (attributes dep_N)."""
+
+	calls = 0
+
+	def __init__(self, index: int, deps: List[AbstractStep[Dict[str, Any]]], result_size: int) -> None:
+		super().__init__(n=f"step{index}")
+		self.index = index
+		self.result_size = result_size
+		self.salt = 0
+		for i, dep in enumerate(deps):
+			setattr(self, f"dep_{i}", dep)
+
+	def progress(self) -> Dict[str, Any]:
+		SyntheticStep.calls += 1
+		upstream = [dep.progress()["id"] for dep in vars(self).values() if isinstance(dep, AbstractStep)]
+		# The id depends on upstream ids, so invalidating a step invalidates everything downstream of it
+		return {"id": f"{self.index}-{self.salt}-{_stable_hash(upstream)[:8]}", "payload": "x" * self.result_size}
+
+
+class StepMarker(AbstractStep[str]):
+	def progress(self) -> str:
+		return "marker"
+
+
+def build_environment(env_id: str, depth: int, fanout: int, result_size: int) -> Environment:
+	steps: List[AbstractStep[Any]] = []
+	for i in range(depth):
+		deps = steps[max(0, i - fanout):i]
+		steps.append(SyntheticStep(i, deps, result_size))
+	steps.append(StepMarker())
+	return Environment(id=env_id, state=SharedStateHolderInMemory(unmerge=None), pipeline=steps)
+
+
+@dataclass
+class Measurement:
+	name: str
+	runs: List[float] = field(default_factory=list)
+	progress_calls: int = 0
+	cache_hits: int = 0
+
+	@property
+	def median_ms(self) -> float:
+		return round(statistics.median(self.runs) * 1000, 3)
+
+	@property
+	def min_ms(self) -> float:
+		return round(min(self.runs) * 1000, 3)
+
+
+def measure(name: str, repeat: int, action: Callable[[], Any], setup: Callable[[], None] = lambda: None) -> Measurement:
+	measurement = Measurement(name)
+	for _ in range(repeat):
+		setup()
+		SyntheticStep.calls = 0
+		started = time.perf_counter()
+		action()
+		measurement.runs.append(time.perf_counter() - started)
+		measurement.progress_calls = SyntheticStep.calls
+	return measurement
+
+
+def _cache_hits(envs: List[Environment]) -> float:
+	return sum(metrics.step_cache_hits.value(env.id, step.name) for env in envs for step in env.pipeline)
+
+
+def run(envs_count: int, depth: int, fanout: int, result_size: int, repeat: int) -> Dict[str, Any]:
+	def build() -> List[Environment]:
+		return [build_environment(f"bench{i}", depth, fanout, result_size) for i in range(envs_count)]
+
+	results: List[Measurement] = []
+	# wrap_in_cached rewires the wrapped steps, so every run wraps freshly built environments
+	raw: List[Environment] = []
+
+	def rebuild() -> None:
+		raw[:] = build()
+
+	results.append(measure("wrap_in_cached", repeat, lambda: [wrap_in_cached(e) for e in raw], setup=rebuild))
+	envs = [wrap_in_cached(e) for e in build()]
+
+	def noop() -> None:
+		pass
+
+	def tick() -> None:
+		processing.mark_caches_fresh()
+		processing.process_all_jobs(envs, noop)
+
+	results.append(measure("tick_cold", repeat, tick, setup=lambda: processing.reset_caches(envs)))
+
+	tick()
+	hits_before = _cache_hits(envs)
+	warm = measure("tick_warm", repeat, tick)
+	warm.cache_hits = int((_cache_hits(envs) - hits_before) / repeat)
+	results.append(warm)
+
+	def invalidate_root() -> None:
+		for env in envs:
+			root = env.pipeline[0]
+			assert isinstance(root, CachingStep) and isinstance(root._step, SyntheticStep)
+			root._step.salt += 1
+			root.reset()
+
+	results.append(measure("tick_invalidated_root", repeat, tick, setup=invalidate_root))
+
+	results.append(measure("get_step_last", repeat, lambda: [get_step(e.pipeline, StepMarker) for e in envs]))
+
+	cached = [s for e in envs for s in e.pipeline if isinstance(s, CachingStep)]
+	results.append(measure("input_hash_all_steps", repeat, lambda: [s._compute_input_hash() for s in cached]))
+	payloads = [s._result for s in cached]
+	results.append(measure("stable_hash_results", repeat, lambda: [_stable_hash(p) for p in payloads]))
+
+	return {
+		"params": {"envs": envs_count, "depth": depth, "fanout": fanout, "result_size": result_size, "repeat": repeat},
+		"python": sys.version.split()[0],
+		"results": [{**asdict(m), "median_ms": m.median_ms, "min_ms": m.min_ms} for m in results],
+	}
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--envs", type=int, default=5)
+	parser.add_argument("--depth", type=int, default=10)
+	parser.add_argument("--fanout", type=int, default=2)
+	parser.add_argument("--result-size", type=int, default=1000)
+	parser.add_argument("--repeat", type=int, default=10)
+	parser.add_argument("--json", help="Write results to this file")
+	args = parser.parse_args()
+
+	report = run(args.envs, args.depth, args.fanout, args.result_size, args.repeat)
+	print(f"{'benchmark':<24}{'median ms':>12}{'min ms':>12}{'progress()':>12}{'cache hits':>12}")
+	for r in report["results"]:
+		print(f"{r['name']:<24}{r['median_ms']:>12}{r['min_ms']:>12}{r['progress_calls']:>12}{r['cache_hits']:>12}")
+	if args.json:
+		with open(args.json, "w") as f:
+			json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+	main()
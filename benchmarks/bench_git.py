@@ -0,0 +1,158 @@
+"""
+Git operations benchmark on synthetic repositories built with RemoteRepoHelper.
+
+Generates a repository with many commits and branches (via git fast-import) and times GitClone.progress
+(clone and no-op fetch), GitClone.get_branches, CheckoutMerged.progress (single branch, N-way merge,
+pre-existing merge commit, merge found in the merge cache) and GitUnmerge.progress.
+
+	python -m benchmarks.bench_git --commits 2000 --branches 200 --json git.json --compare git-baseline.json
+"""
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+import time
+from dataclasses import asdict
+from typing import Any, Dict, List
+
+import git
+
+from benchmarks.bench_engine import Measurement, measure
+from steps.git import MERGE_CACHE_REF_PREFIX
+from tests.test_remote_repo import RemoteRepoHelper
+
+COMMITTER = "Bench <bench@example.com>"
+
+
+def _data(text: str) -> str:
+	return f"data {len(text.encode())}\n{text}\n"
+
+
+def generate_history(repo: git.Repo, commits: int, branches: int, branch_commits: int) -> None:
+	"""
+	master gets `commits` linear commits; branch-N forks from an evenly spread master commit and adds
+	`branch_commits` commits touching its own files; merged-0 is a merge of branch-0 and branch-1.
+	"""
+	lines: List[str] = []
+	timestamp = 1_700_000_000
+	mark = 0
+
+	def commit(ref: str, message: str, files: Dict[str, str], parents: List[int]) -> int:
+		nonlocal mark, timestamp
+		mark += 1
+		timestamp += 1
+		lines.append(f"commit {ref}\nmark :{mark}\ncommitter {COMMITTER} {timestamp} +0000\n{_data(message)}")
+		if parents:
+			lines.append(f"from :{parents[0]}\n")
+			lines.extend(f"merge :{p}\n" for p in parents[1:])
+		for path, content in files.items():
+			lines.append(f"M 644 inline {path}\n{_data(content)}")
+		return mark
+
+	master: List[int] = []
+	for i in range(commits):
+		master.append(commit("refs/heads/master", f"master {i}", {f"master/{i % 100}.txt": f"{i}"},
+		                     master[-1:]))
+
+	tips: List[int] = []
+	branch_files: List[Dict[str, str]] = []
+	for b in range(branches):
+		base = master[(b * (commits - 1)) // max(1, branches - 1)] if branches > 1 else master[-1]
+		tip = base
+		files: Dict[str, str] = {}
+		for c in range(branch_commits):
+			files[f"branch-{b}/{c}.txt"] = f"{b}-{c}"
+			tip = commit(f"refs/heads/branch-{b}", f"branch-{b} {c}", {f"branch-{b}/{c}.txt": f"{b}-{c}"}, [tip])
+		tips.append(tip)
+		branch_files.append(files)
+
+	if branches >= 2:
+		commit("refs/heads/merged-0", "Merge branch-1 into branch-0", branch_files[1], [tips[0], tips[1]])
+
+	subprocess.run(["git", "fast-import", "--quiet"], cwd=repo.working_dir, input="".join(lines).encode(),
+	               check=True)
+	repo.git.checkout("master", force=True)
+
+
+def run(commits: int, branches: int, branch_commits: int, merge_ways: int, repeat: int) -> Dict[str, Any]:
+	helper = RemoteRepoHelper()
+	try:
+		started = time.perf_counter()
+		generate_history(helper.repo, commits, branches, branch_commits)
+		generate_s = time.perf_counter() - started
+		results: List[Measurement] = []
+
+		def clean_clone() -> None:
+			shutil.rmtree(helper.local_dir, ignore_errors=True)
+
+		results.append(measure("git_clone_cold", repeat, lambda: helper.git_clone.progress(), setup=clean_clone))
+		results.append(measure("git_clone_fetch_noop", repeat, lambda: helper.git_clone.progress()))
+		results.append(measure("get_branches", repeat, lambda: helper.git_clone.get_branches()))  # type: ignore[attr-defined]
+
+		def checkout(branches_selected: List[str]) -> None:
+			helper.set_desired_branches([(b, "HEAD") for b in branches_selected])
+			helper.checkout_merged.progress()
+
+		def forget_merges() -> None:
+			"""Drop the merge cache refs and leave the detached merge, so earlier runs are not found again."""
+			local = git.Repo(helper.local_dir)
+			for ref in str(local.git.for_each_ref("--format=%(refname)", MERGE_CACHE_REF_PREFIX)).split():
+				local.git.update_ref("-d", ref)
+			local.git.checkout("--detach", "origin/master")
+
+		results.append(measure("checkout_single", repeat, lambda: checkout(["branch-0"])))
+		ways = [f"branch-{i}" for i in range(0, branches, max(1, branches // merge_ways))][:merge_ways]
+		results.append(measure(f"checkout_{len(ways)}_way_merge", repeat, lambda: checkout(ways), setup=forget_merges))
+		if branches >= 2:
+			results.append(measure("checkout_existing_merge", repeat, lambda: checkout(["branch-0", "branch-1"]),
+			                       setup=forget_merges))
+
+		checkout(ways)
+		results.append(measure("checkout_merge_cached", repeat, lambda: checkout(ways)))
+		version = f"auto-{helper.checkout_merged.progress().version}"
+		helper.mock_check.version = lambda: version  # type: ignore[attr-defined]
+		results.append(measure("git_unmerge", repeat, lambda: helper.git_unmerge.progress()))
+
+		return {
+			"params": {"commits": commits, "branches": branches, "branch_commits": branch_commits,
+			           "merge_ways": len(ways), "repeat": repeat},
+			"git": helper.repo.git.version(),
+			"python": sys.version.split()[0],
+			"generate_s": round(generate_s, 3),
+			"results": [{**asdict(m), "median_ms": m.median_ms, "min_ms": m.min_ms} for m in results],
+		}
+	finally:
+		helper.teardown()
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--commits", type=int, default=2000)
+	parser.add_argument("--branches", type=int, default=200)
+	parser.add_argument("--branch-commits", type=int, default=3)
+	parser.add_argument("--merge-ways", type=int, default=4)
+	parser.add_argument("--repeat", type=int, default=3)
+	parser.add_argument("--json", help="Write results to this file")
+	parser.add_argument("--compare", help="Previous results file to compare medians with")
+	args = parser.parse_args()
+
+	report = run(args.commits, args.branches, args.branch_commits, args.merge_ways, args.repeat)
+	baseline: Dict[str, float] = {}
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = {r["name"]: r["median_ms"] for r in json.load(f)["results"]}
+
+	print(f"history generated in {report['generate_s']}s ({report['git']})")
+	print(f"{'benchmark':<28}{'median ms':>12}{'min ms':>12}{'baseline ms':>14}{'change':>10}")
+	for r in report["results"]:
+		base = baseline.get(r["name"])
+		change = f"{(r['median_ms'] / base - 1) * 100:+.1f}%" if base else ""
+		print(f"{r['name']:<28}{r['median_ms']:>12}{r['min_ms']:>12}{base or '':>14}{change:>10}")
+	if args.json:
+		with open(args.json, "w") as f:
+			json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+	main()
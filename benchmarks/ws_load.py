@@ -0,0 +1,208 @@
+"""
+WebSocket fan-out load test: runs WebApp with synthetic environments (fake steps, no Docker/git) on a local port,
+connects many /ws clients, changes state at a fixed rate and reports end-to-end broadcast latency percentiles,
+bytes sent and server event-loop lag.
+
+	python -m benchmarks.ws_load --clients 200 --rate 5 --duration 20 --envs 5 --json ws.json
+
+Clients run in this process on their own event loop, so at high client counts the numbers include client-side
+receive cost as well.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import re
+import socket
+import sys
+import threading
+import time
+from typing import Any, Dict, List
+
+import uvicorn
+import websockets
+
+import metrics
+from app import App
+from enironment import AbstractStep, Environment
+from steps.checks import percentile
+from steps.git import GitClone
+from steps.shared_state import SharedStateHolderInMemory
+from steps.step import CachingStep
+from web import WebApp
+
+SENT_AT_RE = re.compile(r'"sent_at": ([0-9.]+)')
+LAG_PROBE_INTERVAL = 0.05
+
+
+class FakeClone(GitClone):
+	def __init__(self, branches: int) -> None:
+		super().__init__(url="file:///dev/null")
+		self.branches = branches
+
+	def progress(self) -> str:
+		return "/dev/null"
+
+	def get_branches(self) -> Dict[str, List[Any]]:
+		return {f"branch-{i}": [{"hexsha": f"{i:040x}", "author": "bench", "date": "", "message": "m"}]
+		        for i in range(self.branches)}
+
+
+class TickStep(AbstractStep[Dict[str, Any]]):
+	"""Result carries the time of the state change, so clients can measure end-to-end latency."""
+
+	def __init__(self, payload_size: int) -> None:
+		super().__init__()
+		self.payload = "x" * payload_size
+		self.sent_at = 0.0
+
+	def progress(self) -> Dict[str, Any]:
+		return {"sent_at": self.sent_at, "payload": self.payload}
+
+
+def _free_port() -> int:
+	with socket.socket() as s:
+		s.bind(("127.0.0.1", 0))
+		return int(s.getsockname()[1])
+
+
+def _summary(values: List[float]) -> Dict[str, float | None]:
+	if not values:
+		return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+	ms = [v * 1000 for v in values]
+	return {"p50_ms": round(percentile(ms, 50), 2), "p95_ms": round(percentile(ms, 95), 2),
+	        "p99_ms": round(percentile(ms, 99), 2), "max_ms": round(max(ms), 2)}
+
+
+def _sent_bytes() -> float:
+	return metrics.broadcast_bytes.value("environments") + metrics.broadcast_bytes.value("branches")
+
+
+async def _client(url: str, latencies: List[float], received: List[int], stop: asyncio.Event,
+                  connect_limit: asyncio.Semaphore) -> None:
+	async with connect_limit:
+		ws = await websockets.connect(url, max_size=None)
+	async with ws:
+		while not stop.is_set():
+			try:
+				message = await asyncio.wait_for(ws.recv(), timeout=0.5)
+			except asyncio.TimeoutError:
+				continue
+			now = time.time()
+			if isinstance(message, bytes):
+				message = message.decode()
+			if not message.startswith('{"environments"'):
+				continue
+			match = SENT_AT_RE.search(message)
+			if match and float(match.group(1)) > 0:
+				latencies.append(now - float(match.group(1)))
+				received[0] += 1
+
+
+async def _lag_monitor(lags: List[float], stop: threading.Event) -> None:
+	while not stop.is_set():
+		started = time.perf_counter()
+		await asyncio.sleep(LAG_PROBE_INTERVAL)
+		lags.append(max(0.0, time.perf_counter() - started - LAG_PROBE_INTERVAL))
+
+
+def run(clients: int, rate: float, duration: float, envs_count: int, payload_size: int, branches: int) -> Dict[str, Any]:
+	ticks: List[TickStep] = []
+	environments: Dict[str, Environment] = {}
+	for i in range(envs_count):
+		tick = TickStep(payload_size)
+		ticks.append(tick)
+		env = Environment(id=f"load{i}", state=SharedStateHolderInMemory(unmerge=None),
+		                  pipeline=[FakeClone(branches), tick])
+		environments[env.id] = env
+
+	core = App(environments)
+	for env in core.environments.values():
+		for step in env.pipeline:
+			step.progress()
+	port = _free_port()
+	web_app = WebApp(core=core, port=port)
+	core.emit_callback = web_app.emit_envs
+	server = uvicorn.Server(uvicorn.Config(web_app.app, host="127.0.0.1", port=port, log_level="warning"))
+	server_thread = threading.Thread(target=server.run, name="uvicorn", daemon=True)
+	server_thread.start()
+	while not server.started:
+		time.sleep(0.05)
+
+	lags: List[float] = []
+	stop_lag = threading.Event()
+	assert web_app._event_loop is not None
+	asyncio.run_coroutine_threadsafe(_lag_monitor(lags, stop_lag), web_app._event_loop)
+
+	latencies: List[float] = []
+	received = [0]
+	changes = 0
+
+	async def drive() -> None:
+		nonlocal changes
+		stop = asyncio.Event()
+		connect_limit = asyncio.Semaphore(50)
+		tasks = [asyncio.create_task(_client(f"ws://127.0.0.1:{port}/ws", latencies, received, stop, connect_limit))
+		         for _ in range(clients)]
+		while len(web_app.ws_connections) < clients:
+			await asyncio.sleep(0.1)
+		print(f"{clients} clients connected", file=sys.stderr)
+
+		bytes_before = _sent_bytes()
+		lags.clear()
+		deadline = time.monotonic() + duration
+		while time.monotonic() < deadline:
+			tick = ticks[changes % len(ticks)]
+			tick.sent_at = time.time()
+			cached = core.environments[f"load{changes % len(ticks)}"].pipeline[1]
+			assert isinstance(cached, CachingStep)
+			cached.reset()
+			cached.progress()
+			web_app.emit_envs()
+			changes += 1
+			await asyncio.sleep(1 / rate)
+		await asyncio.sleep(1)
+		stop.set()
+		await asyncio.gather(*tasks, return_exceptions=True)
+		report["bytes_sent"] = int(_sent_bytes() - bytes_before)
+
+	report: Dict[str, Any] = {
+		"params": {"clients": clients, "rate": rate, "duration": duration, "envs": envs_count,
+		           "payload_size": payload_size, "branches": branches},
+	}
+	asyncio.run(drive())
+	stop_lag.set()
+	server.should_exit = True
+	server_thread.join(timeout=5)
+
+	report.update({
+		"state_changes": changes,
+		"messages_expected": changes * clients,
+		"messages_received": received[0],
+		"latency": _summary(latencies),
+		"event_loop_lag": _summary(lags),
+	})
+	return report
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--clients", type=int, default=100)
+	parser.add_argument("--rate", type=float, default=5, help="State changes per second")
+	parser.add_argument("--duration", type=float, default=10, help="Seconds of load")
+	parser.add_argument("--envs", type=int, default=5)
+	parser.add_argument("--payload-size", type=int, default=2000, help="Bytes of synthetic step result per environment")
+	parser.add_argument("--branches", type=int, default=50, help="Synthetic branches per environment")
+	parser.add_argument("--json", help="Write the report to this file")
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.WARNING)
+	report = run(args.clients, args.rate, args.duration, args.envs, args.payload_size, args.branches)
+	print(json.dumps(report, indent=2))
+	if args.json:
+		with open(args.json, "w") as f:
+			json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+	main()
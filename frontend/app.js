@@ -42,6 +42,15 @@ const dryRunByEnv = {};
 // Single WebSocket connection
 let ws = null;
 
+// Step log streaming: separate socket, only subscribed steps are streamed
+const LOGS_WS_URL = '/ws/logs';
+const MAX_LOG_LINES = 500;
+let logsWs = null;
+// logSubscriptions: key `${envId}::${stepName}` -> { env, step, seq }
+const logSubscriptions = {};
+// logLinesByKey: key -> Array<string>
+const logLinesByKey = {};
+
 function showStatus(message, isError = false) {
     statusMessage.textContent = message;
     statusBar.classList.remove('hidden');
@@ -312,6 +321,7 @@ function renderJobs() {
                 const key = `${envObj.id}::${job.name}`;
                 const storageKey = 'jobSpoiler:' + key;
                 const safeId = 'spoiler-' + encodeURIComponent(key).replace(/[^a-zA-Z0-9_-]/g, '_');
+                const logsOpen = key in logSubscriptions;
                 const isError = job.error;
                 const isRunning = !!job.is_running;
                 const openByDefault = isError || (window._jobSpoilerState && window._jobSpoilerState[storageKey] === 'open');
@@ -326,7 +336,12 @@ function renderJobs() {
                         ? `<span style="color:#dc3545;font-weight:bold;margin-right:6px;" title="Error">!</span>`
                         : `<span style="color:#28a745;font-weight:bold;margin-right:6px;" title="OK">✔</span>`}
                             ${envObj.id} - ${job.name}
+                            <a href="#" class="job-logs-toggle" style="float:right;font-weight:normal;"
+                               onclick="event.stopPropagation(); toggleJobLogs('${envObj.id}', '${job.name}'); return false;">
+                                ${logsOpen ? 'hide logs' : 'logs'}
+                            </a>
                         </div>
+                        <pre id="logs-${safeId}" class="job-logs" style="display: ${logsOpen ? 'block' : 'none'};">${escapeHtml((logLinesByKey[key] || []).join('\n'))}</pre>
                         <div id="${safeId}" class="job-spoiler" style="display: ${openByDefault ? 'block' : 'none'}; margin-top:8px;">
                             ${statusDisplay}
                         </div>
@@ -355,6 +370,62 @@ toggleJobSpoiler = function (key, safeId) {
         console.error('toggleJobSpoiler error', err);
     }
 };
+function sendLogsMessage(message) {
+    if (logsWs && logsWs.readyState === WebSocket.OPEN) {
+        logsWs.send(JSON.stringify(message));
+    }
+}
+
+toggleJobLogs = function (envId, stepName) {
+    const key = `${envId}::${stepName}`;
+    if (key in logSubscriptions) {
+        delete logSubscriptions[key];
+        sendLogsMessage({ unsubscribe: { env: envId, step: stepName } });
+    } else {
+        logSubscriptions[key] = { env: envId, step: stepName, seq: 0 };
+        logLinesByKey[key] = [];
+        sendLogsMessage({ subscribe: { env: envId, step: stepName, since: 0 } });
+    }
+    renderJobs();
+};
+
+function appendJobLogs(data) {
+    const key = `${data.env}::${data.step}`;
+    const sub = logSubscriptions[key];
+    if (!sub || !Array.isArray(data.lines) || data.lines.length === 0) return;
+    const lines = logLinesByKey[key] || [];
+    if (data.truncated && sub.seq > 0) lines.push('...');
+    data.lines.forEach(l => lines.push(l.line));
+    logLinesByKey[key] = lines.slice(-MAX_LOG_LINES);
+    sub.seq = data.lines[data.lines.length - 1].seq;
+    const safeId = 'spoiler-' + encodeURIComponent(key).replace(/[^a-zA-Z0-9_-]/g, '_');
+    const el = document.getElementById('logs-' + safeId);
+    if (el) {
+        const atBottom = el.scrollTop + el.clientHeight >= el.scrollHeight - 4;
+        el.textContent = logLinesByKey[key].join('\n');
+        if (atBottom) el.scrollTop = el.scrollHeight;
+    }
+}
+
+function setupLogsWebSocket() {
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    logsWs = new WebSocket(`${protocol}//${window.location.host}${LOGS_WS_URL}`);
+    logsWs.onopen = () => {
+        // Resume existing subscriptions from the last seen line
+        Object.values(logSubscriptions).forEach(sub =>
+            sendLogsMessage({ subscribe: { env: sub.env, step: sub.step, since: sub.seq } }));
+    };
+    logsWs.onmessage = (event) => {
+        try {
+            const message = JSON.parse(event.data);
+            if ('logs' in message) appendJobLogs(message.logs);
+        } catch (e) {
+            console.error('Error processing logs message:', e);
+        }
+    };
+    logsWs.onclose = () => setTimeout(() => setupLogsWebSocket(), 5000);
+}
+
 refreshBranchesBtn.onclick = () => {
     if (ws && ws.readyState === WebSocket.OPEN) {
         ws.send(JSON.stringify({ update: { id: "" } }));
@@ -512,6 +583,7 @@ function updateEnvironment() {
 }
 // Initial load
 setupWebSockets();
+setupLogsWebSocket();
 showStatus('Loading branches...');
 renderBranches();
 renderJobs();
@@ -0,0 +1,212 @@
+"""
+Tests for keeping auto-* branches out of fetches and for AutoBranchGC.
+"""
+import time
+from typing import Any, Callable, List
+
+import git
+import pytest
+
+from enironment import Environment
+from steps.git import AutoBranchGC, CheckoutMerged, GitClone, GitUnmerge
+from steps.shared_state import SharedStateHolderInMemory
+from tests.test_remote_repo import MockDockerSwarmCheck, RemoteRepoHelper
+
+
+def _populate(repo_helper: RemoteRepoHelper) -> List[git.Commit]:
+	commits = [
+		repo_helper.create_commit(repo_helper.repo, "master", "master", "file1.txt", "content1", "Initial commit"),
+		repo_helper.create_commit(repo_helper.repo, "master", "branch1", "file2.txt", "content2", "Branch1 commit"),
+		repo_helper.create_commit(repo_helper.repo, "master", "branch2", "file3.txt", "content3", "Branch2 commit"),
+	]
+	repo_helper.repo.git.checkout("master")
+	return commits
+
+
+def _remote_branches(repo_helper: RemoteRepoHelper) -> List[str]:
+	return sorted(head.name for head in repo_helper.repo.heads)
+
+
+def _tracking_refs(repo_helper: RemoteRepoHelper) -> List[str]:
+	return sorted(ref.name for ref in git.Repo(repo_helper.local_dir).remotes.origin.refs)
+
+
+def _clone(repo_helper: RemoteRepoHelper) -> GitClone:
+	clone = repo_helper.git_clone
+	assert isinstance(clone, GitClone)
+	return clone
+
+
+class TestAutoBranchExclusion:
+	def test_auto_branches_are_not_fetched(self, repo_helper: RemoteRepoHelper) -> None:
+		commits = _populate(repo_helper)
+		repo_helper.repo.create_head("auto-12345678", commits[1])
+		clone = _clone(repo_helper)
+
+		clone.progress()
+
+		assert _tracking_refs(repo_helper) == ["origin/branch1", "origin/branch2", "origin/master"]
+		assert sorted(clone.get_branches()) == ["branch1", "branch2", "master"]
+		local = git.Repo(repo_helper.local_dir)
+		assert local.git.config("--get-all", "remote.origin.fetch").splitlines() == [
+			"+refs/heads/*:refs/remotes/origin/*", "^refs/heads/auto-*"]
+
+	def test_pushed_auto_branch_does_not_trigger_fetch(self, repo_helper: RemoteRepoHelper,
+	                                                   monkeypatch: pytest.MonkeyPatch) -> None:
+		_populate(repo_helper)
+		checkout = repo_helper.checkout_merged
+		assert isinstance(checkout, CheckoutMerged)
+		checkout.push = True
+		repo_helper.set_desired_branches([("branch1", "HEAD"), ("branch2", "HEAD")])
+		result = checkout.progress()
+		assert f"auto-{result.version}" in _remote_branches(repo_helper)
+
+		def no_fetch(*args: object, **kwargs: object) -> None:
+			raise AssertionError("Fetched although only excluded branches changed")
+
+		monkeypatch.setattr(git.Remote, "fetch", no_fetch)
+		repo_helper.git_clone.progress()
+
+		assert _tracking_refs(repo_helper) == ["origin/branch1", "origin/branch2", "origin/master"]
+
+	def test_auto_branch_is_pushed_once(self, repo_helper: RemoteRepoHelper, monkeypatch: pytest.MonkeyPatch) -> None:
+		_populate(repo_helper)
+		checkout = repo_helper.checkout_merged
+		assert isinstance(checkout, CheckoutMerged)
+		checkout.push = True
+		repo_helper.set_desired_branches([("branch1", "HEAD"), ("branch2", "HEAD")])
+		pushes: List[object] = []
+		original = git.cmd.Git._call_process
+
+		def call_process(self: git.cmd.Git, method: str, *args: Any, **kwargs: Any) -> Any:
+			if method == "push":
+				pushes.append(args)
+			return original(self, method, *args, **kwargs)
+
+		monkeypatch.setattr(git.cmd.Git, "_call_process", call_process)
+
+		result = checkout.progress()
+		checkout.progress()
+		assert len(pushes) == 1
+		assert result.remote_branch_name == f"auto-{result.version}"
+
+		# After a restart the remote branch is looked up once instead of pushed again
+		checkout._pushed.clear()
+		assert checkout.progress().remote_branch_name == f"auto-{result.version}"
+		assert len(pushes) == 1
+
+	def test_existing_clone_is_migrated(self, repo_helper: RemoteRepoHelper) -> None:
+		commits = _populate(repo_helper)
+		repo_helper.repo.create_head("auto-12345678", commits[1])
+		clone = _clone(repo_helper)
+		clone.exclude_branches = []
+		clone.progress()
+		assert "origin/auto-12345678" in _tracking_refs(repo_helper)
+
+		clone.exclude_branches = ["auto-*"]
+		clone.progress()
+
+		assert _tracking_refs(repo_helper) == ["origin/branch1", "origin/branch2", "origin/master"]
+
+
+class TestAutoBranchGC:
+	def _gc(self, repo_helper: RemoteRepoHelper, deployed: str, **options: object) -> AutoBranchGC:
+		gc = AutoBranchGC(wd=_clone(repo_helper), check=MockDockerSwarmCheck(lambda: deployed), min_interval_s=0,
+		                  **options)  # type: ignore[arg-type]
+		gc.env = repo_helper.env
+		return gc
+
+	def _auto_branches(self, repo_helper: RemoteRepoHelper) -> List[str]:
+		commits = _populate(repo_helper)
+		names = [f"auto-{commits[1].hexsha[:8]}", f"auto-{commits[2].hexsha[:8]}"]
+		for name, commit in zip(names, commits[1:]):
+			repo_helper.repo.create_head(name, commit)
+		_clone(repo_helper).progress()
+		return sorted(names)
+
+	def test_young_branches_are_kept(self, repo_helper: RemoteRepoHelper) -> None:
+		names = self._auto_branches(repo_helper)
+
+		result = self._gc(repo_helper, deployed="auto-none", retention_days=1).progress()
+
+		assert result.kept == names and result.deleted == []
+		assert set(names) <= set(_remote_branches(repo_helper))
+
+	def test_expired_branches_are_deleted_unless_deployed(self, repo_helper: RemoteRepoHelper) -> None:
+		names = self._auto_branches(repo_helper)
+
+		result = self._gc(repo_helper, deployed=names[0], retention_days=0).progress()
+
+		assert result.kept == [names[0]] and result.deleted == [names[1]]
+		assert names[0] in _remote_branches(repo_helper)
+		assert names[1] not in _remote_branches(repo_helper)
+
+	def _push_from_elsewhere(self, repo_helper: RemoteRepoHelper, name: str, age_days: float) -> None:
+		"""An auto branch pushed by another instance: its merge commit never reaches this clone by fetches."""
+		date = f"{int(time.time() - age_days * 86400)} +0000"
+		repo_helper.repo.git.checkout("--orphan", name)
+		repo_helper.repo.index.commit(f"Merge pushed {age_days} days ago", author_date=date, commit_date=date)
+		repo_helper.repo.git.checkout("-f", "master")
+
+	def test_tips_pushed_elsewhere_are_fetched_for_their_age(self, repo_helper: RemoteRepoHelper) -> None:
+		self._auto_branches(repo_helper)
+		self._push_from_elsewhere(repo_helper, "auto-deadbeef", age_days=0)
+		self._push_from_elsewhere(repo_helper, "auto-0ddba11", age_days=30)
+
+		result = self._gc(repo_helper, deployed="auto-none", retention_days=1).progress()
+
+		assert result.deleted == ["auto-0ddba11"]
+		assert "auto-deadbeef" in result.kept
+		assert "origin/auto-deadbeef" not in _tracking_refs(repo_helper)
+
+	def test_branches_of_unknown_age_are_kept(self, repo_helper: RemoteRepoHelper,
+	                                          monkeypatch: pytest.MonkeyPatch) -> None:
+		self._auto_branches(repo_helper)
+		self._push_from_elsewhere(repo_helper, "auto-deadbeef", age_days=30)
+		monkeypatch.setattr(AutoBranchGC, "_fetch_tips", lambda self, repo, names: None)
+
+		result = self._gc(repo_helper, deployed="auto-none", retention_days=0).progress()
+
+		assert "auto-deadbeef" in result.kept and "auto-deadbeef" not in result.deleted
+		assert "auto-deadbeef" in _remote_branches(repo_helper)
+
+	def _other_env(self, repo_helper: RemoteRepoHelper, env_id: str, url: str, deployed: Callable[[], str]) -> Environment:
+		clone = GitClone(url=url, repo_path=repo_helper.local_dir)
+		return Environment(id=env_id, state=SharedStateHolderInMemory(unmerge=None),
+		                   pipeline=[clone, GitUnmerge(wd=clone, check=MockDockerSwarmCheck(deployed))])
+
+	def test_branches_used_by_other_environments_on_the_remote_are_kept(self, repo_helper: RemoteRepoHelper) -> None:
+		names = self._auto_branches(repo_helper)
+		gc = self._gc(repo_helper, deployed="auto-none", retention_days=0)
+		gc.environments = [
+			repo_helper.env,
+			self._other_env(repo_helper, "other", repo_helper.remote_dir, lambda: names[1]),
+			self._other_env(repo_helper, "unrelated", "/elsewhere.git", lambda: names[0]),
+		]
+
+		result = gc.progress()
+
+		assert result.kept == [names[1]] and result.deleted == [names[0]]
+		assert names[1] in _remote_branches(repo_helper)
+
+	def test_nothing_is_deleted_while_another_environment_is_unknown(self, repo_helper: RemoteRepoHelper) -> None:
+		names = self._auto_branches(repo_helper)
+
+		def unknown() -> str:
+			raise BaseException("swarm unreachable")
+
+		gc = self._gc(repo_helper, deployed="auto-none", retention_days=0)
+		gc.environments = [self._other_env(repo_helper, "other", repo_helper.remote_dir, unknown)]
+
+		with pytest.raises(BaseException, match="Versions used by other are unknown"):
+			gc.progress()
+		assert set(names) <= set(_remote_branches(repo_helper))
+
+	def test_dry_mode_only_reports(self, repo_helper: RemoteRepoHelper) -> None:
+		names = self._auto_branches(repo_helper)
+		repo_helper.env.state.set_dry(True)
+
+		result = self._gc(repo_helper, deployed="auto-none", retention_days=0).progress()
+
+		assert result.dry and sorted(result.deleted) == names
+		assert set(names) <= set(_remote_branches(repo_helper))
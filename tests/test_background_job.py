@@ -0,0 +1,146 @@
+"""
+Unit tests for background-job mode of AbstractStep (run_job / BackgroundJob).
+"""
+import threading
+from typing import Any
+
+import pytest
+
+from enironment import AbstractStep, Environment
+from steps.shared_state import SharedStateHolderInMemory
+from steps.step import BackgroundJob, CachingStep, JobInProgressException
+
+from .conftest import EventuallyFn
+
+
+class GatedStep(AbstractStep[str]):
+	"""Step whose work blocks until the test releases the gate."""
+
+	def __init__(self, background: bool = True) -> None:
+		super().__init__()
+		self.background = background
+		self.gate = threading.Event()
+		self.key = "k1"
+		self.fail = False
+		self.work_count = 0
+
+	def _work(self, job: BackgroundJob[str]) -> str:
+		self.work_count += 1
+		job.report("building", 1, 2, image="img")
+		self.gate.wait(timeout=5)
+		if self.fail:
+			raise RuntimeError("work failed")
+		return f"done-{self.key}"
+
+	def progress(self) -> str:
+		return self.run_job(self.key, self._work, background=self.background)
+
+
+def _make_env(steps: list[AbstractStep[Any]]) -> Environment:
+	return Environment(id="test", state=SharedStateHolderInMemory(unmerge=None), pipeline=steps)
+
+
+class TestBackgroundJob:
+	def test_foreground_runs_inline(self) -> None:
+		step = GatedStep(background=False)
+		step.gate.set()
+
+		assert step.progress() == "done-k1"
+		assert step._job is None
+
+	def test_background_polls_until_done(self, eventually: EventuallyFn) -> None:
+		step = GatedStep()
+
+		with pytest.raises(JobInProgressException) as exc:
+			step.progress()
+		job = exc.value.job
+		eventually(lambda: assert_phase(job, "building"))
+
+		# Polling again does not start a second job
+		with pytest.raises(JobInProgressException):
+			step.progress()
+
+		step.gate.set()
+		eventually(lambda: assert_result(step, "done-k1"))
+		assert step.work_count == 1
+
+	def test_new_key_starts_new_job(self, eventually: EventuallyFn) -> None:
+		step = GatedStep()
+		with pytest.raises(JobInProgressException):
+			step.progress()
+		step.gate.set()
+		eventually(lambda: assert_result(step, "done-k1"))
+
+		step.gate.clear()
+		step.key = "k2"
+		with pytest.raises(JobInProgressException):
+			step.progress()
+		step.gate.set()
+		eventually(lambda: assert_result(step, "done-k2"))
+		assert step.work_count == 2
+
+	def test_new_key_waits_for_running_job(self, eventually: EventuallyFn) -> None:
+		step = GatedStep()
+		with pytest.raises(JobInProgressException) as first:
+			step.progress()
+
+		step.key = "k2"
+		with pytest.raises(JobInProgressException) as exc:
+			step.progress()
+		assert exc.value.job is first.value.job
+		assert step.work_count == 1
+
+		step.gate.set()
+		eventually(lambda: assert_done(first.value.job))
+		eventually(lambda: assert_result(step, "done-k2"))
+		assert step.work_count == 2
+
+	def test_failed_job_is_retried(self, eventually: EventuallyFn) -> None:
+		step = GatedStep()
+		step.fail = True
+		with pytest.raises(JobInProgressException) as exc:
+			step.progress()
+		step.gate.set()
+		eventually(lambda: assert_done(exc.value.job))
+
+		with pytest.raises(RuntimeError, match="work failed"):
+			step.progress()
+
+		step.fail = False
+		step.gate.clear()
+		with pytest.raises(JobInProgressException):
+			step.progress()
+		step.gate.set()
+		eventually(lambda: assert_result(step, "done-k1"))
+		assert step.work_count == 2
+
+	def test_caching_step_keeps_polling_running_job(self, eventually: EventuallyFn) -> None:
+		inner = GatedStep()
+		cached = CachingStep(inner)
+		_make_env([cached])
+
+		with pytest.raises(JobInProgressException):
+			cached.progress()
+		assert isinstance(cached._result, JobInProgressException)
+		assert cached._result.job.snapshot()["step"] == "GatedStep"
+
+		inner.gate.set()
+		eventually(lambda: assert_result(cached, "done-k1"))
+
+
+def assert_phase(job: BackgroundJob[Any], phase: str) -> None:
+	snapshot = job.snapshot()
+	assert snapshot["phase"] == phase, f"Expected phase {phase}, got {snapshot}"
+	assert snapshot["current"] == 1 and snapshot["total"] == 2
+
+
+def assert_done(job: BackgroundJob[Any]) -> None:
+	assert job.done, "Job is not finished"
+
+
+def assert_result(step: AbstractStep[str], expected: str) -> None:
+	try:
+		result = step.progress()
+	except JobInProgressException as e:
+		raise AssertionError("Job still running") from e
+	assert result == expected, f"Expected {expected}, got {result}"
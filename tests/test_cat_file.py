@@ -0,0 +1,124 @@
+"""
+Tests for the persistent cat-file reader and the commit header cache.
+"""
+import os
+from pathlib import Path
+
+import git
+import pytest
+
+from steps.git import CatFile, CommitInfo, GitClone, cat_file, close_cat_file
+from tests.test_remote_repo import RemoteRepoHelper
+
+
+@pytest.fixture
+def repo(tmp_path: Path) -> git.Repo:
+	repo = git.Repo.init(tmp_path, initial_branch="master")
+	with repo.config_writer() as cw:
+		cw.set_value("user", "email", "test@example.com")
+		cw.set_value("user", "name", "Test User")
+	return repo
+
+
+def _commit(repo: git.Repo, filename: str, message: str, date: str = "1714537800 +0530") -> git.Commit:
+	with open(os.path.join(str(repo.working_dir), filename), "w") as f:
+		f.write(filename)
+	repo.index.add([filename])
+	return repo.index.commit(message, author_date=date, commit_date=date)
+
+
+def _assert_same(info: CommitInfo | None, commit: git.Commit) -> None:
+	assert info is not None
+	assert info.sha == commit.hexsha
+	assert list(info.parents) == [p.hexsha for p in commit.parents]
+	assert info.author == commit.author.name
+	assert info.committed_at == commit.committed_date
+	assert info.committed_datetime.isoformat() == commit.committed_datetime.isoformat()
+	assert info.message == str(commit.message).strip()
+
+
+class TestCatFile:
+	def test_headers_match_gitpython(self, repo: git.Repo) -> None:
+		first = _commit(repo, "a.txt", "Subject line\n\nBody with\nseveral lines\n")
+		second = _commit(repo, "b.txt", "Second", date="1714654800 -0300")
+		repo.git.checkout("-b", "side", first.hexsha)
+		side = _commit(repo, "c.txt", "Side")
+		repo.git.checkout("master")
+		repo.git.merge("--no-ff", "--no-edit", "side")
+		merge = repo.head.commit
+		reader = CatFile(str(repo.working_dir))
+
+		for commit in [first, second, side, merge]:
+			_assert_same(reader.commit(commit.hexsha), commit)
+		info = reader.commit(first.hexsha)
+		assert info is not None and info.subject == "Subject line"
+		reader.close()
+
+	def test_resolves_refs_and_abbreviations(self, repo: git.Repo) -> None:
+		commit = _commit(repo, "a.txt", "First")
+		repo.create_tag("annotated", message="tag message")
+		reader = CatFile(str(repo.working_dir))
+
+		for rev in [commit.hexsha[:8], "master", "annotated"]:
+			info = reader.commit(rev)
+			assert info is not None and info.sha == commit.hexsha
+		assert reader.commit("0" * 40) is None
+		assert reader.commit("no-such-branch") is None
+		reader.close()
+
+	def test_lru_cache(self, repo: git.Repo) -> None:
+		commits = [_commit(repo, f"{i}.txt", f"Commit {i}") for i in range(3)]
+		reader = CatFile(str(repo.working_dir), cache_size=2)
+
+		for commit in commits:
+			reader.commit(commit.hexsha)
+		assert list(reader._cache) == [commits[1].hexsha, commits[2].hexsha]
+		reader.commit(commits[1].hexsha)
+		reader.commit(commits[0].hexsha)
+		assert list(reader._cache) == [commits[1].hexsha, commits[0].hexsha]
+		reader.close()
+
+	def test_one_process_survives_new_objects_and_restarts(self, repo: git.Repo) -> None:
+		first = _commit(repo, "a.txt", "First")
+		reader = CatFile(str(repo.working_dir))
+		reader.commit(first.hexsha)
+		process = reader._process
+		assert process is not None
+
+		second = _commit(repo, "b.txt", "Second")
+		_assert_same(reader.commit(second.hexsha), second)
+		assert reader._process is process
+
+		process.kill()
+		process.wait()
+		third = _commit(repo, "c.txt", "Third")
+		_assert_same(reader.commit(third.hexsha), third)
+		assert reader._process is not process
+		reader.close()
+
+	def test_shared_per_repository(self, repo: git.Repo) -> None:
+		assert cat_file(repo) is cat_file(str(repo.working_dir))
+		close_cat_file(str(repo.working_dir))
+		assert cat_file(repo) is not None
+
+	def test_get_branches_output(self, repo_helper: RemoteRepoHelper) -> None:
+		repo_helper.create_commit(repo_helper.repo, "master", "master", "file1.txt", "content1", "Initial commit")
+		repo_helper.create_commit(repo_helper.repo, "master", "branch1", "file2.txt", "content2", "Branch1\n\nbody")
+		clone = repo_helper.git_clone
+		assert isinstance(clone, GitClone)
+		clone.progress()
+
+		branches = clone.get_branches()
+
+		local = git.Repo(repo_helper.local_dir)
+		for name, entries in branches.items():
+			commit = local.commit(f"origin/{name}")
+			expected = []
+			for c in [commit] + list(commit.iter_parents()):
+				expected.append({
+					'hexsha': c.hexsha,
+					'author': c.author.name,
+					'date': c.committed_datetime.isoformat(),
+					'message': str(c.message).strip()
+				})
+			assert entries == expected
@@ -0,0 +1,81 @@
+"""
+Unit tests for DockerContainerDeploy restarts, with the Docker client replaced by stand-ins.
+"""
+from typing import Any, Dict, List
+
+import docker
+import pytest
+
+from enironment import AbstractStep, Environment
+from steps.docker_plain import DockerContainerDeploy, DockerImageBuildResult
+from steps.shared_state import SharedStateHolderInMemory
+from steps.step import BackgroundJob, JobInProgressException
+
+from .conftest import EventuallyFn
+
+
+class FakeImage:
+	tags = ["app:v1"]
+
+
+class FakeContainer:
+	id = "c0ffee"
+	image = FakeImage()
+	ports: Dict[str, Any] = {}
+
+	def __init__(self, labels: Dict[str, str]) -> None:
+		self.labels = labels
+		self.status = "exited"
+
+	def reload(self) -> None:
+		pass
+
+
+class FakeClient:
+	def __init__(self, container: FakeContainer) -> None:
+		self.containers = self
+		self.container = container
+
+	def list(self, **kwargs: Any) -> List[FakeContainer]:
+		return [self.container]
+
+
+class Built(AbstractStep[DockerImageBuildResult]):
+	def progress(self) -> DockerImageBuildResult:
+		return DockerImageBuildResult(image_name="app", image_tag="v1", full_image="app:v1")
+
+
+class TestContainerDeploy:
+	@pytest.fixture
+	def deploy(self, monkeypatch: pytest.MonkeyPatch) -> DockerContainerDeploy:
+		deploy = DockerContainerDeploy(image_build=Built(), container_name="app")  # type: ignore[arg-type]
+		Environment(id="plain", state=SharedStateHolderInMemory(unmerge=None), pipeline=[deploy])
+		container = FakeContainer({"config_hash": deploy._get_config_hash()})
+		monkeypatch.setattr(docker, "DockerClient", lambda **kwargs: FakeClient(container))
+		self.container = container
+		self.starts = 0
+
+		def start(step: DockerContainerDeploy, job: BackgroundJob[float], client: Any, c: FakeContainer) -> float:
+			self.starts += 1
+			c.status = "running"
+			return 1.0
+
+		monkeypatch.setattr(DockerContainerDeploy, "_start", start)
+		return deploy
+
+	def test_stopped_container_is_started_again(self, deploy: DockerContainerDeploy,
+	                                           eventually: EventuallyFn) -> None:
+		eventually(lambda: _assert_started(deploy, 1.0))
+		assert self.starts == 1
+
+		self.container.status = "exited"
+		eventually(lambda: _assert_started(deploy, 1.0))
+		assert self.starts == 2
+
+
+def _assert_started(deploy: DockerContainerDeploy, ready_seconds: float) -> None:
+	try:
+		result = deploy.progress()
+	except JobInProgressException as e:
+		raise AssertionError("Start still running") from e
+	assert result.status == "running" and result.ready_seconds == ready_seconds
@@ -0,0 +1,80 @@
+"""
+Unit tests for lazy config discovery: only modules declaring the selected environments are imported.
+"""
+import importlib
+import os
+import sys
+import tempfile
+import uuid
+from types import ModuleType
+from typing import Generator
+
+import pytest
+
+from discover_envs import ParsedEnvArgs, _discover_environments, index_configs, parse_arguments
+
+CONFIG = """
+from enironment import Environment
+from steps.shared_state import SharedStateHolderInMemory
+
+{name} = Environment(id={id_expr}, state=SharedStateHolderInMemory(unmerge=None), pipeline=[])
+"""
+
+
+@pytest.fixture
+def configs_package() -> Generator[ModuleType, None, None]:
+	name = f"lazy_configs_{uuid.uuid4().hex[:8]}"
+	with tempfile.TemporaryDirectory() as root:
+		package_dir = os.path.join(root, name)
+		os.makedirs(package_dir)
+		open(os.path.join(package_dir, "__init__.py"), "w").close()
+		for module, id_expr in [("alpha", '"alpha"'), ("beta", '"beta"'), ("dynamic", '"dyn" + "amic"')]:
+			with open(os.path.join(package_dir, f"{module}.py"), "w") as f:
+				f.write(CONFIG.format(name=module, id_expr=id_expr))
+		with open(os.path.join(package_dir, "helpers.py"), "w") as f:
+			f.write("VALUE = 1\n")
+		sys.path.insert(0, root)
+		try:
+			yield importlib.import_module(name)
+		finally:
+			sys.path.remove(root)
+			for module_name in [m for m in sys.modules if m.startswith(name)]:
+				del sys.modules[module_name]
+
+
+def _imported(package: ModuleType) -> set[str]:
+	prefix = f"{package.__name__}."
+	return {m[len(prefix):] for m in sys.modules if m.startswith(prefix)}
+
+
+class TestDiscoverEnvs:
+	def test_index_reads_literal_ids(self, configs_package: ModuleType) -> None:
+		index = index_configs(configs_package)
+
+		assert index.module_of("alpha") == f"{configs_package.__name__}.alpha"
+		assert index.modules[f"{configs_package.__name__}.helpers"] == []
+		assert index.unknown == [f"{configs_package.__name__}.dynamic"]
+		assert _imported(configs_package) == set()
+
+	def test_includes_import_only_selected(self, configs_package: ModuleType) -> None:
+		envs = _discover_environments(parse_arguments("alpha"), configs_package)
+
+		assert set(envs) == {"alpha", "dynamic"}
+		assert _imported(configs_package) == {"alpha", "dynamic"}
+
+	def test_excludes_skip_excluded_modules(self, configs_package: ModuleType) -> None:
+		envs = _discover_environments(parse_arguments("-alpha"), configs_package)
+
+		assert set(envs) == {"beta", "dynamic"}
+		assert "alpha" not in _imported(configs_package)
+
+	def test_unknown_id_imports_everything(self, configs_package: ModuleType) -> None:
+		envs = _discover_environments(parse_arguments("missing"), configs_package)
+
+		assert set(envs) == {"alpha", "beta", "dynamic"}
+		assert _imported(configs_package) == {"alpha", "beta", "dynamic", "helpers"}
+
+	def test_no_arguments_import_everything(self, configs_package: ModuleType) -> None:
+		envs = _discover_environments(ParsedEnvArgs(), configs_package)
+
+		assert set(envs) == {"alpha", "beta", "dynamic"}
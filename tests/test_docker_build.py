@@ -0,0 +1,69 @@
+"""
+Tests for DockerComposeBuild background builds, with the Docker build replaced by a stand-in.
+"""
+import threading
+from typing import Any, Dict, List, Tuple
+
+import git
+import pytest
+
+from steps.docker import DockerComposeBuild
+from steps.git import GitClone
+from steps.step import BackgroundJob, JobInProgressException
+from tests.test_remote_repo import RemoteRepoHelper
+
+from .conftest import EventuallyFn
+
+COMPOSE = """
+services:
+  app:
+    build: .
+    image: registry.local/app:v1
+"""
+
+
+class TestDockerComposeBuild:
+	def test_background_build_keeps_the_commit_it_started_with(self, repo_helper: RemoteRepoHelper,
+	                                                            monkeypatch: pytest.MonkeyPatch,
+	                                                            eventually: EventuallyFn) -> None:
+		repo = repo_helper.repo
+		repo_helper.create_commit(repo, "master", "master", "docker-compose.yml", COMPOSE, "Compose")
+		first = repo_helper.create_commit(repo, "master", "master", "Dockerfile", "FROM scratch # v1", "v1")
+		second = repo_helper.create_commit(repo, "master", "master", "Dockerfile", "FROM scratch # v2", "v2")
+		clone = repo_helper.git_clone
+		assert isinstance(clone, GitClone)
+		local = git.Repo(clone.progress())
+		local.git.checkout(first.hexsha, detach=True)
+
+		gate = threading.Event()
+		seen: List[str] = []
+
+		def build_all(self: DockerComposeBuild, job: BackgroundJob[Dict[str, str]],
+		              targets: List[Tuple[str, str, str]]) -> Dict[str, str]:
+			gate.wait(timeout=5)
+			for _, _, dockerfile in targets:
+				with open(dockerfile) as f:
+					seen.append(f.read())
+			return {image: "sha256:1" for image, _, _ in targets}
+
+		monkeypatch.setattr(DockerComposeBuild, "_build_all", build_all)
+		build = DockerComposeBuild(wd=clone, docker_repo_username="", docker_repo_password="",
+		                           docker_compose_path="docker-compose.yml", docker_repo_url="", publish=False,
+		                           envs=lambda: {}, background=True)
+		build.env = repo_helper.env
+
+		with pytest.raises(JobInProgressException) as exc:
+			build.progress()
+		job: BackgroundJob[Any] = exc.value.job
+		# The next merge is checked out while the image builds
+		local.git.checkout(second.hexsha, detach=True)
+		gate.set()
+		eventually(lambda: _assert_done(job))
+
+		assert job.result() == {"registry.local/app:v1": "sha256:1"}
+		assert seen == ["FROM scratch # v1"]
+		assert len(local.git.worktree("list").splitlines()) == 1
+
+
+def _assert_done(job: BackgroundJob[Any]) -> None:
+	assert job.done, "Job is not finished"
@@ -0,0 +1,112 @@
+"""
+Tests for skipping no-op fetches in GitClone and for fingerprint-aware caching downstream.
+"""
+import os
+import shutil
+from typing import Any, List
+
+import git
+import pytest
+
+import metrics
+import processing
+from enironment import get_step, wrap_in_cached
+from steps.git import CheckoutMerged
+from tests.test_remote_repo import RemoteRepoHelper
+
+
+@pytest.fixture
+def fetches(monkeypatch: pytest.MonkeyPatch) -> List[str]:
+	"""Records every fetch done through GitPython."""
+	calls: List[str] = []
+	original = git.Remote.fetch
+
+	def fetch(remote: git.Remote, *args: Any, **kwargs: Any) -> Any:
+		calls.append(remote.url)
+		return original(remote, *args, **kwargs)
+
+	monkeypatch.setattr(git.Remote, "fetch", fetch)
+	return calls
+
+
+def _populate(repo_helper: RemoteRepoHelper) -> None:
+	repo_helper.create_commit(repo_helper.repo, "master", "master", "file1.txt", "content1", "Initial commit")
+	repo_helper.create_commit(repo_helper.repo, "master", "branch1", "file2.txt", "content2", "Branch1 commit")
+	repo_helper.create_commit(repo_helper.repo, "master", "branch2", "file3.txt", "content3", "Branch2 commit")
+
+
+class TestFetchFingerprint:
+	def test_unchanged_remote_is_not_fetched(self, repo_helper: RemoteRepoHelper, fetches: List[str]) -> None:
+		_populate(repo_helper)
+		repo_helper.git_clone.progress()
+		fingerprint = repo_helper.git_clone.fingerprint()
+		assert fingerprint is not None
+		assert len(fetches) == 1
+		skipped = metrics.git_fetches.value("test1", "skipped")
+
+		repo_helper.git_clone.progress()
+
+		assert len(fetches) == 1, "Fetched although nothing changed"
+		assert repo_helper.git_clone.fingerprint() == fingerprint
+		assert metrics.git_fetches.value("test1", "skipped") == skipped + 1
+
+	def test_new_commit_is_fetched(self, repo_helper: RemoteRepoHelper, fetches: List[str]) -> None:
+		_populate(repo_helper)
+		repo_helper.git_clone.progress()
+		fingerprint = repo_helper.git_clone.fingerprint()
+
+		commit = repo_helper.create_commit(repo_helper.repo, "branch1", "branch1", "file4.txt", "content4", "More")
+		repo_helper.git_clone.progress()
+
+		assert len(fetches) == 2
+		assert repo_helper.git_clone.fingerprint() != fingerprint
+		assert git.Repo(repo_helper.local_dir).commit("origin/branch1") == commit
+
+	def test_deleted_branch_is_pruned(self, repo_helper: RemoteRepoHelper, fetches: List[str]) -> None:
+		_populate(repo_helper)
+		repo_helper.git_clone.progress()
+
+		repo_helper.repo.git.checkout("master")
+		repo_helper.repo.delete_head("branch2", force=True)
+		repo_helper.git_clone.progress()
+
+		assert len(fetches) == 2
+		assert "origin/branch2" not in [ref.name for ref in git.Repo(repo_helper.local_dir).refs]
+
+	def test_deterministic_steps_survive_cache_reset(self, repo_helper: RemoteRepoHelper) -> None:
+		_populate(repo_helper)
+		env = wrap_in_cached(repo_helper.env)
+		checkout = get_step(env.pipeline, CheckoutMerged)
+		repo_helper.set_desired_branches([("branch1", "HEAD"), ("branch2", "HEAD")])
+
+		def executions() -> float:
+			return metrics.step_executions.value(env.id, checkout.name, "ok")
+
+		first = checkout.progress()
+		runs = executions()
+
+		processing.reset_caches([env])
+		assert checkout.progress() == first
+		assert executions() == runs, "CheckoutMerged ran again although the remote did not change"
+
+		repo_helper.create_commit(repo_helper.repo, "branch2", "branch2", "file4.txt", "content4", "More")
+		processing.reset_caches([env])
+		second = checkout.progress()
+
+		assert executions() == runs + 1
+		assert second.commit_hash != first.commit_hash
+
+	def test_recreated_clone_is_checked_out_again(self, repo_helper: RemoteRepoHelper) -> None:
+		_populate(repo_helper)
+		env = wrap_in_cached(repo_helper.env)
+		checkout = get_step(env.pipeline, CheckoutMerged)
+		repo_helper.set_desired_branches([("branch1", "HEAD"), ("branch2", "HEAD")])
+		checkout.progress()
+
+		shutil.rmtree(repo_helper.local_dir)
+		processing.reset_caches([env])
+		result = checkout.progress()
+
+		assert os.path.exists(os.path.join(repo_helper.local_dir, "file2.txt"))
+		assert os.path.exists(os.path.join(repo_helper.local_dir, "file3.txt"))
+		assert git.Repo(repo_helper.local_dir).head.commit.hexsha == result.commit_hash
@@ -6,9 +6,13 @@ They simulate remote and local git repositories and test various merge scenarios
 """
 import os
 
+from typing import Any, Dict, List, Tuple
+
 import git
 import pytest
-from steps.git import CheckoutAndMergeResult, GitUnmergeResult
+from steps.docker import DockerSwarmCheckResult
+from steps.git import (CheckoutAndMergeResult, CheckoutMerged, GitClone, GitUnmergeResult, deployed_version,
+                       find_common_merge_commit, merge_cache_ref)
 
 from .test_remote_repo import RemoteRepoHelper
 
@@ -201,6 +205,65 @@ class TestGitIntegration:
 			('file3.txt', 'content3')
 		])
 
+	def test_checkout_merged_reuses_cached_merge(self, repo_helper: RemoteRepoHelper,
+	                                             monkeypatch: pytest.MonkeyPatch) -> None:
+		"""A commit combination merged before is resolved from refs/brencher/merges without merging again"""
+		repo_helper.create_commit(repo_helper.repo, "master", "master", "file1.txt", "content1", "Initial commit")
+		commit2 = repo_helper.create_commit(repo_helper.repo, "master", "branch1", "file2.txt", "content2",
+		                                    "Branch1 commit")
+		commit3 = repo_helper.create_commit(repo_helper.repo, "master", "branch2", "file3.txt", "content3",
+		                                    "Branch2 commit")
+
+		repo_helper.set_desired_branches([("branch1", "HEAD"), ("branch2", "HEAD")])
+		result1 = repo_helper.checkout_merged.progress()
+
+		local = git.Repo(repo_helper.local_dir)
+		cache_ref = merge_cache_ref([commit3, commit2])
+		assert local.git.rev_parse(cache_ref) == result1.commit_hash
+
+		def merge_again(*args: Any) -> None:
+			raise AssertionError("Cached combination was merged again")
+
+		monkeypatch.setattr("steps.git.merge_in_odb", merge_again)
+		monkeypatch.setattr("steps.git.merge_in_worktree", merge_again)
+		local.git.checkout(commit2.hexsha, detach=True)
+		repo_helper.set_desired_branches([("branch2", "HEAD"), ("branch1", "HEAD")])
+		result2 = repo_helper.checkout_merged.progress()
+
+		assert result2.commit_hash == result1.commit_hash
+		repo_helper.verify_working_directory_files([
+			('file1.txt', 'content1'),
+			('file2.txt', 'content2'),
+			('file3.txt', 'content3')
+		])
+
+	def test_checkout_merged_without_checkout(self, repo_helper: RemoteRepoHelper) -> None:
+		"""With checkout=False the merge is done in the object database only: HEAD and files stay as they were"""
+		commit1 = repo_helper.create_commit(repo_helper.repo, "master", "master", "file1.txt", "content1",
+		                                    "Initial commit")
+		repo_helper.create_commit(repo_helper.repo, "master", "branch1", "file2.txt", "content2", "Branch1 commit")
+		repo_helper.create_commit(repo_helper.repo, "master", "branch2", "file3.txt", "content3", "Branch2 commit")
+		repo_helper.git_clone.progress()
+
+		local = git.Repo(repo_helper.local_dir)
+		local.git.checkout(commit1.hexsha, detach=True)
+		step = repo_helper.checkout_merged
+		inner = getattr(step, "_step", step)
+		assert isinstance(inner, CheckoutMerged)
+		inner.checkout = False
+		inner.push = True
+
+		repo_helper.set_desired_branches([("branch1", "HEAD"), ("branch2", "HEAD")])
+		result = step.progress()
+
+		assert local.head.commit.hexsha == commit1.hexsha, "HEAD moved"
+		repo_helper.verify_working_directory_files([('file1.txt', 'content1')])
+		merged = local.commit(result.commit_hash)
+		assert len(merged.parents) == 2
+		files: List[str] = [str(it.path) for it in merged.tree.traverse() if isinstance(it, git.Blob)]
+		assert sorted(files) == ['file1.txt', 'file2.txt', 'file3.txt']
+		assert repo_helper.repo.git.rev_parse(f"auto-{result.version}") == result.commit_hash
+
 	def test_checkout_merged_and_unmerge_valid_version(self, repo_helper: RemoteRepoHelper) -> None:
 		"""Test merging branches and then unmerging with valid version string"""
 
@@ -370,6 +433,146 @@ class TestGitIntegration:
 		assert local_repo.commit("origin/master").hexsha == commit2.hexsha, "Repository should be re-fetched"
 		assert local_repo.commit("origin/master").hexsha != commit1.hexsha, "Old state should be replaced"
 
+	def test_ref_index_built_once_per_fetch(self, repo_helper: RemoteRepoHelper) -> None:
+		repo_helper.create_commit(repo_helper.repo, "master", "master", "file1.txt", "content1", "Initial commit")
+		commit2 = repo_helper.create_commit(repo_helper.repo, "master", "branch1", "file2.txt", "content2",
+		                                    "Branch1 commit")
+		repo_helper.repo.create_head("branch1-copy", commit2)
+		clone = repo_helper.git_clone
+		assert isinstance(clone, GitClone)
+		clone.progress()
+
+		index = clone.ref_index()
+		assert clone.ref_index() is index
+		assert index.names(commit2.hexsha) == ["branch1", "branch1-copy"]
+		assert index.branches["branch1"] == commit2.hexsha
+
+		commit3 = repo_helper.create_commit(repo_helper.repo, "branch1", "branch1", "file3.txt", "content3", "More")
+		clone.progress()
+
+		assert clone.ref_index() is not index
+		assert clone.ref_index().names(commit3.hexsha) == ["branch1"]
+		assert clone.ref_index().names(commit2.hexsha) == ["branch1-copy"]
+
+	def test_ref_lookups_use_the_index(self, repo_helper: RemoteRepoHelper, monkeypatch: pytest.MonkeyPatch) -> None:
+		"""CheckoutMerged, GitUnmerge and get_branches never iterate GitPython refs"""
+		repo_helper.create_commit(repo_helper.repo, "master", "master", "file1.txt", "content1", "Initial commit")
+		commit2 = repo_helper.create_commit(repo_helper.repo, "master", "branch1", "file2.txt", "content2",
+		                                    "Branch1 commit")
+		commit3 = repo_helper.create_commit(repo_helper.repo, "master", "branch2", "file3.txt", "content3",
+		                                    "Branch2 commit")
+		repo_helper.git_clone.progress()
+
+		def no_refs(self: Any) -> None:
+			raise AssertionError("Refs iterated")
+
+		monkeypatch.setattr(git.Repo, "refs", property(no_refs))
+		monkeypatch.setattr(git.Remote, "refs", property(no_refs))
+
+		repo_helper.set_desired_branches([("branch1", "HEAD")])
+		assert repo_helper.checkout_merged.progress().remote_branch_name == "branch1"
+		repo_helper.set_desired_branches([("branch1", "HEAD"), ("branch2", "HEAD")])
+		repo_helper.checkout_merged.progress()
+		assert sorted(repo_helper.git_unmerge.progress().branches) == [("branch1", commit2.hexsha),
+		                                                                ("branch2", commit3.hexsha)]
+		clone = repo_helper.git_clone
+		assert isinstance(clone, GitClone)
+		assert sorted(clone.get_branches()) == ["branch1", "branch2", "master"]
+
+
+class TestFindCommonMergeCommit:
+	"""find_common_merge_commit on a local repository with hand-made merges"""
+
+	@pytest.fixture
+	def repo(self, tmp_path: Any) -> git.Repo:
+		repo = git.Repo.init(tmp_path, initial_branch="master")
+		with repo.config_writer() as cw:
+			cw.set_value("user", "email", "test@example.com")
+			cw.set_value("user", "name", "Test User")
+		self._commit(repo, "base.txt")
+		return repo
+
+	def _commit(self, repo: git.Repo, filename: str) -> git.Commit:
+		with open(os.path.join(repo.working_dir, filename), "w") as f:
+			f.write(filename)
+		repo.index.add([filename])
+		return repo.index.commit(filename)
+
+	def _branch(self, repo: git.Repo, name: str, filename: str) -> git.Commit:
+		repo.git.checkout("master")
+		repo.git.checkout("-b", name)
+		return self._commit(repo, filename)
+
+	def _merge(self, repo: git.Repo, name: str, *commits: git.Commit) -> git.Commit:
+		repo.git.checkout("-b", name, commits[0].hexsha)
+		repo.git.merge("--no-ff", "--no-edit", *[c.hexsha for c in commits[1:]])
+		return repo.head.commit
+
+	def test_no_merge_yet(self, repo: git.Repo) -> None:
+		a = self._branch(repo, "a", "a.txt")
+		b = self._branch(repo, "b", "b.txt")
+
+		assert find_common_merge_commit(repo, [a, b]) is None
+
+	def test_contained_commit_is_dropped(self, repo: git.Repo) -> None:
+		a = self._branch(repo, "a", "a.txt")
+		a2 = self._commit(repo, "a2.txt")
+
+		assert find_common_merge_commit(repo, [a, a2]) == a2
+
+	def test_existing_merge_found(self, repo: git.Repo) -> None:
+		a = self._branch(repo, "a", "a.txt")
+		b = self._branch(repo, "b", "b.txt")
+		merged = self._merge(repo, "ab", a, b)
+
+		assert find_common_merge_commit(repo, [b, a]) == merged
+
+	def test_merge_with_foreign_commits_rejected(self, repo: git.Repo) -> None:
+		a = self._branch(repo, "a", "a.txt")
+		b = self._branch(repo, "b", "b.txt")
+		c = self._branch(repo, "c", "c.txt")
+		self._merge(repo, "abc", a, b, c)
+		merged = self._merge(repo, "ab", a, b)
+		self._commit(repo, "on-top.txt")
+
+		assert find_common_merge_commit(repo, [a, b]) == merged
+
+	def test_merge_of_merges_found(self, repo: git.Repo) -> None:
+		a = self._branch(repo, "a", "a.txt")
+		b = self._branch(repo, "b", "b.txt")
+		c = self._branch(repo, "c", "c.txt")
+		ab = self._merge(repo, "ab", a, b)
+		abc = self._merge(repo, "abc", ab, c)
+
+		assert find_common_merge_commit(repo, [a, b, c]) == abc
+
+	def test_closest_merge_chosen(self, repo: git.Repo) -> None:
+		a = self._branch(repo, "a", "a.txt")
+		b = self._branch(repo, "b", "b.txt")
+		ab = self._merge(repo, "ab", a, b)
+		ba = self._merge(repo, "ba", b, a)
+		self._merge(repo, "ab-again", ab, ba)
+
+		# Same generation: the lowest sha wins, whatever the branch order
+		expected = min(ab, ba, key=lambda c: c.hexsha)
+		assert find_common_merge_commit(repo, [a, b]) == expected
+		assert find_common_merge_commit(repo, [b, a]) == expected
+
+
+
+class TestDeployedVersion:
+	def _services(self, *versions: str) -> Dict[str, DockerSwarmCheckResult]:
+		return {f"svc{i}": DockerSwarmCheckResult(name=f"svc{i}", image="img", stack="stack", version=v)
+		        for i, v in enumerate(versions)}
+
+	def test_single_version(self) -> None:
+		assert deployed_version(self._services("auto-1234", "auto-1234")) == "auto-1234"
+
+	@pytest.mark.parametrize("versions", [(), ("auto-1234", "auto-5678"), ("", "")])
+	def test_unknown_version_raises(self, versions: Tuple[str, ...]) -> None:
+		with pytest.raises(BaseException, match="Expected exactly one version"):
+			deployed_version(self._services(*versions))
+
 
 if __name__ == "__main__":
 	pytest.main([__file__, "-v"])
@@ -0,0 +1,148 @@
+"""
+Unit tests for LoadProbe against a local stand-in HTTP server.
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Generator
+
+import pytest
+
+from enironment import AbstractStep
+from steps.checks import LoadProbe
+
+
+class _Handler(BaseHTTPRequestHandler):
+	delay = 0.0
+	status = 200
+	hits = 0
+	lock = threading.Lock()
+
+	def do_GET(self) -> None:
+		with _Handler.lock:
+			_Handler.hits += 1
+		time.sleep(_Handler.delay)
+		body = b"ok"
+		self.send_response(_Handler.status)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format: str, *args: Any) -> None:
+		pass
+
+
+@pytest.fixture
+def server_url() -> Generator[str, None, None]:
+	_Handler.delay, _Handler.status, _Handler.hits = 0.0, 200, 0
+	server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	yield f"http://127.0.0.1:{server.server_address[1]}"
+	server.shutdown()
+	server.server_close()
+
+
+class NotDeployed(AbstractStep[str]):
+	def progress(self) -> str:
+		raise BaseException("Services not started yet")
+
+
+class PendingDeploy(AbstractStep[Dict[str, Any]]):
+	"""What DockerSwarmDeploy returns in dry mode."""
+
+	def progress(self) -> Dict[str, Any]:
+		return {"diffs": [{"service": "web", "stack": "stack"}]}
+
+
+class TestLoadProbe:
+	def test_burst_records_throughput_and_percentiles(self, server_url: str) -> None:
+		_Handler.delay = 0.05
+		probe = LoadProbe(url=server_url, request_count=20, concurrency=5)
+
+		result = probe.progress()
+
+		assert _Handler.hits == 20
+		assert result.errors == 0 and result.requests == 20
+		assert result.p50_ms is not None and result.p50_ms >= 50
+		# 20 requests of 50ms with 5 workers take ~0.2s, not 1s
+		assert result.duration_s < 0.8
+		assert result.throughput_rps > 25
+
+	def test_waits_for_deploy(self, server_url: str) -> None:
+		probe = LoadProbe(url=server_url, deploy=NotDeployed(), request_count=5)
+
+		with pytest.raises(BaseException, match="Services not started yet"):
+			probe.progress()
+		assert _Handler.hits == 0
+
+	def test_pending_deploy_is_not_probed(self, server_url: str) -> None:
+		probe = LoadProbe(url=server_url, deploy=PendingDeploy(), request_count=5, version=lambda: "v1")
+
+		with pytest.raises(BaseException, match="pending changes"):
+			probe.progress()
+		assert _Handler.hits == 0 and len(probe.history) == 0
+
+	def test_unknown_version_is_not_probed(self, server_url: str) -> None:
+		def version() -> str:
+			raise BaseException("Expected exactly one version")
+
+		probe = LoadProbe(url=server_url, request_count=5, version=version)
+
+		with pytest.raises(BaseException, match="version unknown"):
+			probe.progress()
+		assert _Handler.hits == 0 and len(probe.history) == 0
+
+	def test_without_version_is_probed_once(self, server_url: str) -> None:
+		probe = LoadProbe(url=server_url, request_count=5)
+
+		first = probe.progress()
+		second = probe.progress()
+
+		assert first.probed_at == second.probed_at
+		assert _Handler.hits == 5
+
+	def test_same_version_is_probed_once(self, server_url: str) -> None:
+		probe = LoadProbe(url=server_url, request_count=5, version=lambda: "v1")
+
+		first = probe.progress()
+		second = probe.progress()
+
+		assert first.probed_at == second.probed_at
+		assert _Handler.hits == 5
+
+	def test_regression_against_previous_version(self, server_url: str) -> None:
+		version = "v1"
+		probe = LoadProbe(url=server_url, request_count=10, concurrency=5, version=lambda: version,
+		                  max_p95_regression_pct=50, on_regression="fail")
+		_Handler.delay = 0.01
+		probe.progress()
+
+		version = "v2"
+		_Handler.delay = 0.1
+		with pytest.raises(Exception, match="p95 .* slower than v1"):
+			probe.progress()
+		# The verdict for the version is kept without firing another burst
+		with pytest.raises(Exception, match="regressed"):
+			probe.progress()
+		assert _Handler.hits == 20
+
+		last = probe.history[-1]
+		assert last.version == "v2" and last.regressed
+		assert last.p95_change_pct is not None and last.p95_change_pct > 50
+
+	def test_errors_are_counted(self, server_url: str) -> None:
+		_Handler.status = 503
+		probe = LoadProbe(url=server_url, request_count=4, concurrency=2)
+
+		result = probe.progress()
+
+		assert result.errors == 4
+		assert result.p95_ms is None
+		assert result.problems == ["4 of 4 requests failed"]
+
+	def test_burst_is_bounded(self) -> None:
+		with pytest.raises(BaseException, match="request_count"):
+			LoadProbe(url="http://localhost", request_count=100_000)
+		with pytest.raises(BaseException, match="concurrency"):
+			LoadProbe(url="http://localhost", concurrency=1000)
@@ -0,0 +1,95 @@
+"""
+Tests for background git maintenance of the managed clones.
+"""
+import os
+import threading
+import time
+from pathlib import Path
+
+import git
+
+from enironment import Environment
+from maintenance import MAINTENANCE_TASKS, MaintenanceThread, maintain_repository, managed_repositories
+from steps.git import GitClone
+from steps.shared_state import SharedStateHolderInMemory
+from tests.test_remote_repo import RemoteRepoHelper
+
+from .conftest import EventuallyFn
+
+
+def _populate(repo_helper: RemoteRepoHelper) -> None:
+	repo_helper.create_commit(repo_helper.repo, "master", "master", "file1.txt", "content1", "Initial commit")
+	repo_helper.create_commit(repo_helper.repo, "master", "branch1", "file2.txt", "content2", "Branch1 commit")
+	repo_helper.create_commit(repo_helper.repo, "master", "branch2", "file3.txt", "content3", "Branch2 commit")
+	repo_helper.git_clone.progress()
+	repo_helper.set_desired_branches([("branch1", "HEAD"), ("branch2", "HEAD")])
+	repo_helper.checkout_merged.progress()
+
+
+class TestMaintenance:
+	def test_maintain_repository(self, repo_helper: RemoteRepoHelper) -> None:
+		_populate(repo_helper)
+		objects = os.path.join(repo_helper.local_dir, ".git", "objects")
+
+		report = maintain_repository(repo_helper.local_dir)
+
+		assert [t.task for t in report.tasks] == [task for task, _ in MAINTENANCE_TASKS]
+		assert all(t.error is None for t in report.tasks), report.tasks
+		assert os.path.exists(os.path.join(objects, "info", "commit-graphs", "commit-graph-chain"))
+		assert os.path.exists(os.path.join(objects, "pack", "multi-pack-index"))
+		local = git.Repo(repo_helper.local_dir)
+		local.git.commit_graph("verify")
+		local.git.fsck("--connectivity-only")
+		assert local.git.count_objects("-v").splitlines()[0] == "count: 0", "Loose objects left"
+
+	def test_failed_task_does_not_stop_the_others(self, repo_helper: RemoteRepoHelper) -> None:
+		_populate(repo_helper)
+		local = git.Repo(repo_helper.local_dir)
+		lock = os.path.join(local.git_dir, "packed-refs.lock")
+		open(lock, "w").close()
+
+		report = maintain_repository(repo_helper.local_dir)
+
+		errors = {t.task: t.error for t in report.tasks}
+		assert errors.pop("pack-refs") is not None
+		assert all(error is None for error in errors.values())
+		assert "FAILED" in report.summary()
+
+	def test_managed_repositories(self, repo_helper: RemoteRepoHelper, tmp_path: Path) -> None:
+		not_cloned = GitClone(url=repo_helper.remote_dir, repo_path=os.path.join(tmp_path, "missing"))
+		same_dir = GitClone(url=repo_helper.remote_dir, repo_path=repo_helper.local_dir)
+		other = Environment(id="other", state=SharedStateHolderInMemory(unmerge=None), pipeline=[same_dir, not_cloned])
+		assert managed_repositories([repo_helper.env, other]) == []
+
+		_populate(repo_helper)
+
+		assert managed_repositories([repo_helper.env, other]) == [repo_helper.local_dir]
+
+	def test_thread_runs_periodically(self, repo_helper: RemoteRepoHelper, eventually: EventuallyFn) -> None:
+		_populate(repo_helper)
+		thread = MaintenanceThread([repo_helper.env], interval=0.1)
+		thread.start()
+		try:
+			eventually(lambda: _assert_reported(thread, repo_helper.local_dir), timeout=10)
+		finally:
+			thread.stop()
+			thread.join(timeout=10)
+		assert not thread.is_alive()
+
+	def test_waits_for_the_processing_lock(self, repo_helper: RemoteRepoHelper, eventually: EventuallyFn) -> None:
+		_populate(repo_helper)
+		lock = threading.Lock()
+		thread = MaintenanceThread([repo_helper.env], interval=0.05, lock=lock)
+		try:
+			with lock:
+				thread.start()
+				time.sleep(0.5)
+				assert thread.reports == [], "Maintenance ran while processing held the lock"
+			eventually(lambda: _assert_reported(thread, repo_helper.local_dir), timeout=10)
+		finally:
+			thread.stop()
+			thread.join(timeout=10)
+
+
+def _assert_reported(thread: MaintenanceThread, repo_path: str) -> None:
+	assert [r.repo_path for r in thread.reports] == [repo_path]
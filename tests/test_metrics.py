@@ -0,0 +1,52 @@
+"""
+Unit tests for the metrics registry and CachingStep instrumentation.
+"""
+import metrics
+from metrics import Counter, Gauge, Histogram, Registry
+from steps.checks import SimpleLog
+from steps.step import CachingStep
+
+from .test_caching_step import _make_env
+
+
+class TestMetrics:
+	def test_prometheus_text_format(self) -> None:
+		registry = Registry()
+		counter = registry.register(Counter("jobs_total", "Jobs", ("env",)))
+		gauge = registry.register(Gauge("clients", "Clients"))
+		histogram = registry.register(Histogram("duration_seconds", "Duration", ("env",), buckets=(0.1, 1.0)))
+
+		counter.inc("a")
+		counter.inc("a", amount=2)
+		counter.inc('q"uote')
+		gauge.set(3)
+		gauge.dec()
+		histogram.observe(0.05, "a")
+		histogram.observe(0.5, "a")
+		histogram.observe(5, "a")
+
+		text = registry.render()
+		assert "# TYPE jobs_total counter" in text
+		assert 'jobs_total{env="a"} 3' in text
+		assert 'jobs_total{env="q\\"uote"} 1' in text
+		assert "clients 2" in text
+		assert 'duration_seconds_bucket{env="a",le="0.1"} 1' in text
+		assert 'duration_seconds_bucket{env="a",le="1"} 2' in text
+		assert 'duration_seconds_bucket{env="a",le="+Inf"} 3' in text
+		assert 'duration_seconds_sum{env="a"} 5.55' in text
+		assert 'duration_seconds_count{env="a"} 3' in text
+
+	def test_caching_step_counts_hits_and_executions(self) -> None:
+		step = CachingStep(SimpleLog(message="m", n="metrics_log"))
+		env = _make_env([step])
+		executions = metrics.step_executions.value(env.id, "metrics_log", "ok")
+		hits = metrics.step_cache_hits.value(env.id, "metrics_log")
+
+		step.progress()
+		step.progress()
+		step.progress()
+
+		assert metrics.step_executions.value(env.id, "metrics_log", "ok") == executions + 1
+		assert metrics.step_cache_hits.value(env.id, "metrics_log") == hits + 2
+		assert metrics.step_duration.count(env.id, "metrics_log") >= 1
+		assert 'brencher_step_cache_hits_total{env="test",step="metrics_log"}' in metrics.REGISTRY.render()
@@ -0,0 +1,98 @@
+"""
+Integration tests for partial (blobless/treeless), sparse and shallow GitClone modes.
+"""
+import os
+from typing import List
+
+import git
+
+from steps.git import GitClone
+from tests.test_remote_repo import RemoteRepoHelper
+
+
+def _commit(repo_helper: RemoteRepoHelper, from_branch: str, to_branch: str, path: str, content: str) -> git.Commit:
+	os.makedirs(os.path.join(repo_helper.remote_dir, os.path.dirname(path)), exist_ok=True)
+	return repo_helper.create_commit(repo_helper.repo, from_branch, to_branch, path, content, f"Update {path}")
+
+
+def _populate(repo_helper: RemoteRepoHelper, history: int = 1) -> None:
+	"""master with history commits, branch1 and branch2 forked from it touching app/ and other/"""
+	with repo_helper.repo.config_writer() as cw:
+		cw.set_value("uploadpack", "allowFilter", "true")
+	_commit(repo_helper, "master", "master", "app/compose.yml", "compose")
+	for i in range(history):
+		_commit(repo_helper, "master", "master", "other/big.txt", f"big {i}")
+	_commit(repo_helper, "master", "branch1", "app/one.txt", "one")
+	_commit(repo_helper, "branch1", "branch1", "other/one.txt", "one")
+	_commit(repo_helper, "master", "branch2", "app/two.txt", "two")
+
+
+def _narrow(repo_helper: RemoteRepoHelper, **options: object) -> GitClone:
+	clone = repo_helper.git_clone
+	assert isinstance(clone, GitClone)
+	for name, value in options.items():
+		setattr(clone, name, value)
+	return clone
+
+
+def _exists(repo_helper: RemoteRepoHelper, paths: List[str]) -> List[bool]:
+	return [os.path.exists(os.path.join(repo_helper.local_dir, path)) for path in paths]
+
+
+class TestNarrowClone:
+	def test_blobless_sparse_merge_and_unmerge(self, repo_helper: RemoteRepoHelper) -> None:
+		_populate(repo_helper)
+		_narrow(repo_helper, clone_filter="blob:none", sparse_paths=["app"])
+		repo_helper.git_clone.progress()
+
+		local = git.Repo(repo_helper.local_dir)
+		assert local.config_reader().get_value('remote "origin"', "promisor") is True
+		missing = [line for line in local.git.rev_list("--objects", "--missing=print", "--all").splitlines()
+		           if line.startswith("?")]
+		assert len(missing) > 0, "Blobs were fetched by the partial clone"
+
+		repo_helper.set_desired_branches([("branch1", "HEAD"), ("branch2", "HEAD")])
+		result = repo_helper.checkout_merged.progress()
+
+		assert _exists(repo_helper, ["app/compose.yml", "app/one.txt", "app/two.txt"]) == [True, True, True]
+		assert _exists(repo_helper, ["other/big.txt", "other/one.txt"]) == [False, False]
+		assert local.head.commit.hexsha == result.commit_hash
+		assert sorted(b for b, _ in repo_helper.git_unmerge.progress().branches) == ["branch1", "branch2"]
+
+	def test_treeless_clone_lists_branches(self, repo_helper: RemoteRepoHelper) -> None:
+		_populate(repo_helper)
+		clone = _narrow(repo_helper, clone_filter="tree:0")
+		clone.progress()
+
+		branches = clone.get_branches()
+
+		assert sorted(branches) == ["branch1", "branch2", "master"]
+		assert len(branches["branch1"]) == 4
+
+	def test_sparse_paths_can_be_changed(self, repo_helper: RemoteRepoHelper) -> None:
+		_populate(repo_helper)
+		clone = _narrow(repo_helper, sparse_paths=["app/compose.yml"])
+		repo_helper.set_desired_branches([("branch1", "HEAD")])
+		repo_helper.checkout_merged.progress()
+		assert _exists(repo_helper, ["app/compose.yml", "app/one.txt", "other/one.txt"]) == [True, False, False]
+
+		clone.sparse_paths = None
+		clone.progress()
+
+		assert _exists(repo_helper, ["app/compose.yml", "app/one.txt", "other/one.txt"]) == [True, True, True]
+
+	def test_shallow_clone_deepens_for_merge(self, repo_helper: RemoteRepoHelper) -> None:
+		_populate(repo_helper, history=5)
+		clone = _narrow(repo_helper, depth=1)
+		clone.progress()
+		local = git.Repo(repo_helper.local_dir)
+		assert local.git.rev_parse("--is-shallow-repository") == "true"
+		assert len(clone.get_branches()["branch1"]) == 1
+
+		repo_helper.set_desired_branches([("branch1", "HEAD"), ("branch2", "HEAD")])
+		result = repo_helper.checkout_merged.progress()
+
+		merged = local.commit(result.commit_hash)
+		assert len(merged.parents) == 2
+		assert _exists(repo_helper, ["app/one.txt", "app/two.txt", "other/one.txt"]) == [True, True, True]
+		assert sorted(b for b, _ in repo_helper.git_unmerge.progress().branches) == ["branch1", "branch2"]
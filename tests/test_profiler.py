@@ -0,0 +1,44 @@
+"""
+Unit tests for the sampling profiler.
+"""
+import threading
+import time
+
+from profiler import SamplingProfiler
+
+
+def _busy_wait_for(stop: threading.Event) -> None:
+	while not stop.is_set():
+		sum(range(1000))
+
+
+class TestSamplingProfiler:
+	def test_collapsed_stacks_of_selected_thread(self) -> None:
+		stop = threading.Event()
+		worker = threading.Thread(target=_busy_wait_for, args=(stop,), name="busy-worker")
+		worker.start()
+		try:
+			assert worker.ident is not None
+			profiler = SamplingProfiler(interval=0.001, thread_ids={worker.ident}).run(0.2)
+		finally:
+			stop.set()
+			worker.join()
+
+		lines = profiler.collapsed().splitlines()
+		assert profiler.sample_count > 10
+		assert lines and all(line.startswith("busy-worker;") for line in lines)
+		assert any("_busy_wait_for (test_profiler.py:" in line for line in lines)
+		stack, count = lines[0].rsplit(" ", 1)
+		assert int(count) > 0 and stack.split(";")[1].startswith("_bootstrap")
+
+	def test_profiler_skips_its_own_thread(self) -> None:
+		profiler = SamplingProfiler(interval=0.001)
+		profiler.sample_once()
+
+		assert not any("sample_once" in stack for stack in profiler.samples)
+
+	def test_duration_is_bounded(self) -> None:
+		started = time.monotonic()
+		SamplingProfiler(interval=0.01, thread_ids=set()).run(0.05)
+
+		assert time.monotonic() - started < 1
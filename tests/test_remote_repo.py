@@ -13,7 +13,8 @@ import git
 
 from enironment import Environment, AbstractStep, SharedStateHolder, get_step
 from steps.docker import DockerSwarmCheckResult
-from steps.git import CheckoutAndMergeResult, CheckoutMerged, GitUnmerge, GitClone, HasVersion, GitUnmergeResult
+from steps.git import CheckoutAndMergeResult, CheckoutMerged, GitUnmerge, GitClone, HasVersion, GitUnmergeResult, \
+    close_cat_file
 from steps.shared_state import SharedStateHolderInMemory
 from steps.step import CachingStep  # noqa: F401
 
@@ -111,6 +112,7 @@ class RemoteRepoHelper:
         if self.remote_dir:
             shutil.rmtree(self.remote_dir, ignore_errors=True)
         if self.local_dir:
+            close_cat_file(self.local_dir)
             shutil.rmtree(self.local_dir, ignore_errors=True)
 
     def create_commit(self, repo: git.Repo, from_branch: str, to_branch: str, filename: str, content: str,
@@ -0,0 +1,44 @@
+"""
+Unit tests for the per-step bounded log buffer.
+"""
+from enironment import wrap_in_cached
+from steps.checks import SimpleLog
+from steps.step import CachingStep, StepLog
+
+from .test_caching_step import _make_env
+
+
+class TestStepLog:
+	def test_since_returns_only_new_lines(self) -> None:
+		log = StepLog()
+		log.append("one\n")
+		log.append("two")
+
+		lines = log.since(0)
+		assert [it["line"] for it in lines] == ["one", "two"]
+		assert log.since(lines[-1]["seq"]) == []
+
+		log.append("three")
+		assert [it["line"] for it in log.since(lines[-1]["seq"])] == ["three"]
+
+	def test_blank_lines_are_skipped(self) -> None:
+		log = StepLog()
+		log.append("  \n")
+		assert log.last_seq == 0
+
+	def test_buffer_is_bounded(self) -> None:
+		log = StepLog(capacity=3)
+		for i in range(10):
+			log.append(f"line {i}")
+
+		lines = log.since(0)
+		assert [it["line"] for it in lines] == ["line 7", "line 8", "line 9"]
+		assert lines[0]["seq"] == 8
+
+	def test_caching_step_shares_inner_log(self) -> None:
+		env = wrap_in_cached(_make_env([SimpleLog(message="m")]))
+		cached = env.pipeline[0]
+		assert isinstance(cached, CachingStep)
+
+		cached._step.log.append("from inner")
+		assert [it["line"] for it in cached.log.since(0)] == ["from inner"]
@@ -0,0 +1,290 @@
+"""
+Unit tests for DockerSwarmDeploy decisions that do not need a Docker daemon.
+"""
+import os
+import queue
+import tempfile
+import threading
+from typing import Any, Dict, Iterator, List, Tuple
+
+import docker
+import pytest
+
+from steps.docker import ComposeCache, ConvergenceWatcher, DockerSwarmCheckResult, DockerSwarmDeploy, \
+	RenderedCompose, SPEC_HASH_LABEL, STACK_HASH_LABEL, VERSION_LABEL, _render_stack, swarm_service_ready
+from steps.git import GitClone
+from steps.step import BackgroundJob
+
+
+def _deploy() -> DockerSwarmDeploy:
+	return DockerSwarmDeploy(
+		wd=GitClone(url="unused"),
+		buildDocker=None,
+		stackChecker=None,  # type: ignore[arg-type]
+		docker_compose_path="docker-compose.yml",
+		envs=lambda: {},
+		stack_name="stack",
+		targeted=True,
+	)
+
+
+def _labels(version: str, spec: str = "spec1", stack: str = "stack1") -> Dict[str, str]:
+	return {VERSION_LABEL: version, SPEC_HASH_LABEL: spec, STACK_HASH_LABEL: stack}
+
+
+def _running(labels: Dict[str, str]) -> DockerSwarmCheckResult:
+	return DockerSwarmCheckResult(name="web", image="web:old", stack="stack", version=labels[VERSION_LABEL], labels=labels)
+
+
+def _expected(labels: Dict[str, str]) -> Dict[str, Any]:
+	return {"web": {"image": "web:new", "labels": labels}}
+
+
+class TestTargetedPlan:
+	def test_only_image_changed_updates_service(self) -> None:
+		plan = _deploy()._targeted_plan(
+			[{"service": "web"}],
+			_expected(_labels("v2")),
+			{"web": _running(_labels("v1"))},
+		)
+		assert plan == [("web", "web:new", _labels("v2"))]
+
+	def test_changed_service_spec_falls_back(self) -> None:
+		plan = _deploy()._targeted_plan(
+			[{"service": "web"}],
+			_expected(_labels("v2", spec="spec2")),
+			{"web": _running(_labels("v1"))},
+		)
+		assert plan is None
+
+	def test_changed_networks_fall_back(self) -> None:
+		plan = _deploy()._targeted_plan(
+			[{"service": "web"}],
+			_expected(_labels("v2", stack="stack2")),
+			{"web": _running(_labels("v1"))},
+		)
+		assert plan is None
+
+	def test_new_service_falls_back(self) -> None:
+		plan = _deploy()._targeted_plan([{"service": "web"}], _expected(_labels("v2")), {})
+		assert plan is None
+
+	def test_update_keeps_existing_container_labels(self, monkeypatch: pytest.MonkeyPatch) -> None:
+		updates: List[Dict[str, Any]] = []
+
+		class Service:
+			attrs = {"Spec": {
+				"Labels": {"com.docker.stack.namespace": "stack", "com.docker.stack.image": "web:old"},
+				"TaskTemplate": {"ContainerSpec": {"Labels": {"com.docker.stack.namespace": "stack", "other": "x",
+				                                              **_labels("v1")}}},
+			}}
+
+			def update(self, **kwargs: Any) -> None:
+				updates.append(kwargs)
+
+		class Services:
+			def get(self, name: str) -> Service:
+				return Service()
+
+		class Client:
+			services = Services()
+
+		monkeypatch.setattr(docker, "DockerClient", lambda **kwargs: Client())
+		deploy = _deploy()
+		monkeypatch.setattr(deploy, "_wait_converged", lambda *args: {})
+
+		job: BackgroundJob[Dict[str, Any]] = BackgroundJob("k", "deploy", lambda job: {})
+		deploy._update_services(job, [("web", "web:new", _labels("v2"))], ["web"])
+
+		assert updates[0]["container_labels"] == {"com.docker.stack.namespace": "stack", "other": "x", **_labels("v2")}
+		assert updates[0]["labels"]["com.docker.stack.image"] == "web:new"
+
+
+class FakeEvents:
+	"""Blocking event stream like docker's CancellableStream."""
+
+	def __init__(self) -> None:
+		self.queue: queue.Queue[Any] = queue.Queue()
+		self.closed = False
+
+	def __iter__(self) -> Iterator[Any]:
+		while (item := self.queue.get()) is not None:
+			yield item
+
+	def close(self) -> None:
+		self.closed = True
+		self.queue.put(None)
+
+
+class FakeClient:
+	def __init__(self) -> None:
+		self.stream = FakeEvents()
+
+	def events(self, decode: bool, filters: Dict[str, Any]) -> FakeEvents:
+		return self.stream
+
+
+class TestConvergenceWatcher:
+	def test_event_wakes_watcher_before_poll_interval(self) -> None:
+		client = FakeClient()
+		running = threading.Event()
+
+		def is_ready(name: str) -> Tuple[bool, str]:
+			return running.is_set(), "1/1 replicas running" if running.is_set() else "0/1 replicas running"
+
+		def start_service() -> None:
+			running.set()
+			client.stream.queue.put({"Type": "service", "Action": "update"})
+
+		threading.Timer(0.2, start_service).start()
+		watcher = ConvergenceWatcher(client, ["stack_web"], is_ready, {}, timeout=10, poll_interval=30)  # type: ignore[arg-type]
+		ready = watcher.wait()
+
+		assert list(ready) == ["stack_web"]
+		assert ready["stack_web"] < 5
+		assert client.stream.closed
+
+	def test_timeout_reports_pending_services(self) -> None:
+		client = FakeClient()
+		watcher = ConvergenceWatcher(client, ["stack_web"], lambda name: (False, "0/2 replicas running"), {},  # type: ignore[arg-type]
+		                             timeout=0.3, poll_interval=0.1)
+
+		with pytest.raises(BaseException, match=r"stack_web \(0/2 replicas running\)"):
+			watcher.wait()
+		assert client.stream.closed
+
+
+class FakeService:
+	def __init__(self, version: str, tasks: List[Dict[str, Any]], update_state: str | None = None) -> None:
+		self.attrs: Dict[str, Any] = {"Spec": {
+			"Mode": {"Replicated": {"Replicas": 2}},
+			"TaskTemplate": {"ContainerSpec": _container_spec(version)},
+		}}
+		if update_state is not None:
+			self.attrs["UpdateStatus"] = {"State": update_state}
+		self._tasks = tasks
+
+	def tasks(self) -> List[Dict[str, Any]]:
+		return self._tasks
+
+
+class FakeServices:
+	def __init__(self, service: FakeService) -> None:
+		self.service = service
+
+	def list(self, filters: Dict[str, Any]) -> List[FakeService]:
+		return [self.service]
+
+
+def _container_spec(version: str) -> Dict[str, Any]:
+	return {"Image": f"web:{version}", "Labels": {VERSION_LABEL: version}}
+
+
+def _task(version: str, state: str = "running") -> Dict[str, Any]:
+	return {"Status": {"State": state}, "DesiredState": "running", "Spec": {"ContainerSpec": _container_spec(version)}}
+
+
+def _ready(service: FakeService) -> Tuple[bool, str]:
+	client = FakeClient()
+	client.services = FakeServices(service)  # type: ignore[attr-defined]
+	return swarm_service_ready(client)("stack_web")  # type: ignore[arg-type]
+
+
+class TestSwarmServiceReady:
+	def test_tasks_of_previous_version_do_not_count(self) -> None:
+		ready, state = _ready(FakeService("v2", [_task("v1"), _task("v1"), _task("v2", "starting")]))
+
+		assert not ready and state == "0/2 replicas running"
+
+	def test_ready_once_replicas_run_current_spec(self) -> None:
+		assert _ready(FakeService("v2", [_task("v2"), _task("v2"), _task("v1", "shutdown")]))[0]
+
+	def test_update_in_progress_is_not_ready(self) -> None:
+		ready, state = _ready(FakeService("v2", [_task("v2"), _task("v2")], update_state="updating"))
+
+		assert not ready and state.startswith("update updating")
+		assert _ready(FakeService("v2", [_task("v2"), _task("v2")], update_state="completed"))[0]
+
+
+COMPOSE = """
+services:
+  web:
+    image: web:${version}
+    build: .
+networks:
+  default: {}
+"""
+
+
+class TestComposeCache:
+	def _write(self, directory: str, content: str) -> None:
+		with open(os.path.join(directory, "docker-compose.yml"), "w") as f:
+			f.write(content)
+
+	def test_repeated_render_is_cached(self) -> None:
+		calls = []
+
+		def render(raw: str) -> RenderedCompose:
+			calls.append(raw)
+			return _render_stack(raw, {"version": "v1"})
+
+		with tempfile.TemporaryDirectory() as d:
+			self._write(d, COMPOSE)
+			cache = ComposeCache()
+			first = cache.get(d, "docker-compose.yml", {"version": "v1"}, "stack", render)
+			second = cache.get(d, "docker-compose.yml", {"version": "v1"}, "stack", render)
+
+		assert first is second
+		assert len(calls) == 1
+		assert first.document["services"]["web"]["image"] == "web:v1"
+		assert "build" not in first.document["services"]["web"]
+		assert "image: web:v1" in first.text
+
+	def test_env_and_kind_are_part_of_key(self) -> None:
+		calls = []
+
+		def render(raw: str) -> RenderedCompose:
+			calls.append(raw)
+			return RenderedCompose(document={}, text=raw)
+
+		with tempfile.TemporaryDirectory() as d:
+			self._write(d, COMPOSE)
+			cache = ComposeCache()
+			cache.get(d, "docker-compose.yml", {"version": "v1"}, "stack", render)
+			cache.get(d, "docker-compose.yml", {"version": "v2"}, "stack", render)
+			cache.get(d, "docker-compose.yml", {"version": "v2"}, "build", render)
+
+		assert len(calls) == 3
+
+	def test_changed_file_is_rendered_again(self) -> None:
+		calls = []
+
+		def render(raw: str) -> RenderedCompose:
+			calls.append(raw)
+			return RenderedCompose(document={}, text=raw)
+
+		with tempfile.TemporaryDirectory() as d:
+			self._write(d, COMPOSE)
+			cache = ComposeCache()
+			cache.get(d, "docker-compose.yml", {}, "build", render)
+			self._write(d, COMPOSE + "\nvolumes: {}\n")
+			cache.get(d, "docker-compose.yml", {}, "build", render)
+
+		assert len(calls) == 2
+
+	def test_cache_is_bounded(self) -> None:
+		with tempfile.TemporaryDirectory() as d:
+			self._write(d, COMPOSE)
+			cache = ComposeCache(max_entries=2)
+			for i in range(5):
+				cache.get(d, "docker-compose.yml", {"version": str(i)}, "build", lambda raw: RenderedCompose({}, raw))
+
+		assert len(cache._entries) == 2
+
+	def test_stack_labels_include_hashes(self) -> None:
+		rendered = _render_stack(COMPOSE, {"version": "v1", "services": {"web": {"environment": {"A": "1"}}}})
+		labels = rendered.document["services"]["web"]["labels"]
+
+		assert labels[VERSION_LABEL] == "v1"
+		assert SPEC_HASH_LABEL in labels and STACK_HASH_LABEL in labels
+		assert rendered.document["services"]["web"]["environment"] == {"A": "1"}
@@ -0,0 +1,152 @@
+"""
+Unit tests for UrlCheck against a local HTTP server.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Generator, List
+
+import pytest
+import requests
+
+from enironment import AbstractStep, Environment, wrap_in_cached
+from processing import process_all_jobs
+from steps.checks import UrlCheck, UrlCheckResult, percentile
+from steps.shared_state import SharedStateHolderInMemory
+
+
+class _Handler(BaseHTTPRequestHandler):
+	def do_GET(self) -> None:
+		if self.path.startswith("/slow"):
+			time.sleep(0.5)
+		if self.path.startswith("/missing"):
+			self.send_response(404)
+			self.end_headers()
+			return
+		body = json.dumps({"res": "pong"}).encode()
+		self.send_response(200)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format: str, *args: Any) -> None:
+		pass
+
+
+@pytest.fixture
+def server_url() -> Generator[str, None, None]:
+	server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	yield f"http://127.0.0.1:{server.server_address[1]}"
+	server.shutdown()
+	server.server_close()
+
+
+def _make_env(env_id: str, check: UrlCheck) -> Environment:
+	return Environment(id=env_id, state=SharedStateHolderInMemory(unmerge=None), pipeline=[check])
+
+
+class TestUrlCheck:
+	def test_reports_latency(self, server_url: str) -> None:
+		result = UrlCheck(url=f"{server_url}/ping", expected={"res": "pong"}).progress()
+
+		assert isinstance(result, UrlCheckResult)
+		assert result.status == "Ok" and result.status_code == 200
+		assert result.latency_ms >= 0
+
+	def test_status_code_failure(self, server_url: str) -> None:
+		with pytest.raises(Exception, match="status code 404"):
+			UrlCheck(url=f"{server_url}/missing", expected={}).progress()
+
+	def test_read_timeout(self, server_url: str) -> None:
+		with pytest.raises(requests.exceptions.ReadTimeout):
+			UrlCheck(url=f"{server_url}/slow", expected={}, read_timeout=0.1).progress()
+
+	def test_checks_of_all_environments_run_concurrently(self, server_url: str) -> None:
+		envs = [_make_env(f"env{i}", UrlCheck(url=f"{server_url}/slow", expected={"res": "pong"})) for i in range(4)]
+		failing = _make_env("failing", UrlCheck(url=f"{server_url}/missing", expected={}))
+
+		started = time.monotonic()
+		has_error = process_all_jobs(envs + [failing], lambda: None)
+		elapsed = time.monotonic() - started
+
+		assert has_error
+		assert elapsed < 1.5, f"Checks ran sequentially: {elapsed:.2f}s"
+
+	def test_checks_run_after_the_pipeline(self, server_url: str) -> None:
+		events: List[str] = []
+
+		class Deploy(AbstractStep[str]):
+			def progress(self) -> str:
+				events.append("deploy")
+				return "v2"
+
+		class Probe(AbstractStep[str]):
+			def progress(self) -> str:
+				events.append(f"probe after {len(check.history)} checks")
+				return "ok"
+
+		def version() -> str:
+			events.append(f"version on {threading.current_thread().name}")
+			return "v2"
+
+		check = UrlCheck(url=f"{server_url}/ping", expected={"res": "pong"}, version=version)
+		env = wrap_in_cached(Environment(id="ordered", state=SharedStateHolderInMemory(unmerge=None),
+		                                 pipeline=[Deploy(), check, Probe()]))
+		other = _make_env("other", UrlCheck(url=f"{server_url}/ping", expected={"res": "pong"}))
+
+		assert not process_all_jobs([env, other], lambda: None)
+
+		assert events == ["deploy", f"version on {threading.current_thread().name}", "probe after 1 checks"]
+		assert [it.version for it in check.history] == ["v2"]
+
+
+class TestUrlCheckSlo:
+	def test_percentiles_and_size(self, server_url: str) -> None:
+		result = UrlCheck(url=f"{server_url}/ping", expected={"res": "pong"}, samples=5).progress()
+
+		assert result.samples == 5
+		assert result.p50_ms is not None and result.p95_ms is not None and result.p99_ms is not None
+		assert result.p50_ms <= result.p95_ms <= result.p99_ms
+		assert result.response_bytes == len(b'{"res": "pong"}')
+
+	def test_budget_exceeded_fails(self, server_url: str) -> None:
+		check = UrlCheck(url=f"{server_url}/slow", expected={}, samples=2, latency_budget_ms=100)
+
+		with pytest.raises(Exception, match="latency budget exceeded"):
+			check.progress()
+		assert len(check.history) == 1 and check.history[0].budget_exceeded
+
+	def test_budget_exceeded_warns(self, server_url: str) -> None:
+		check = UrlCheck(url=f"{server_url}/slow", expected={}, latency_budget_ms=100, on_budget_exceeded="warn")
+
+		result = check.progress()
+
+		assert result.status == "Slow"
+		assert result.budget_exceeded
+
+	def test_baseline_is_previous_version(self, server_url: str) -> None:
+		version = "v1"
+		check = UrlCheck(url=f"{server_url}/ping", expected={}, version=lambda: version, history_size=3)
+
+		first = check.progress()
+		second = check.progress()
+		version = "v2"
+		third = check.progress()
+
+		assert first.baseline is None
+		assert second.baseline is None
+		assert third.baseline is not None and third.baseline.version == "v1"
+		assert third.baseline.checked_at == second.checked_at
+		assert [it.version for it in check.history] == ["v1", "v1", "v2"]
+
+	def test_percentile(self) -> None:
+		values = [float(v) for v in range(1, 101)]
+
+		assert percentile(values, 50) == 50
+		assert percentile(values, 95) == 95
+		assert percentile(values, 99) == 99
+		assert percentile([7.0], 99) == 7.0
@@ -0,0 +1,97 @@
+"""
+Unit tests for the cold-start warmup phase.
+"""
+import os
+import time
+from typing import Any, List, Sequence
+
+import git
+import pytest
+
+import processing
+from enironment import AbstractStep, Environment, wrap_in_cached
+from steps.git import GitClone
+from steps.shared_state import SharedStateHolderInMemory
+from steps.step import CachingStep
+from tests.test_remote_repo import RemoteRepoHelper
+from warmup import run_warmup
+
+
+class SleepStep(AbstractStep[str]):
+	def __init__(self, delay: float) -> None:
+		super().__init__()
+		self.delay = delay
+		self.calls = 0
+
+	def progress(self) -> str:
+		self.calls += 1
+		time.sleep(self.delay)
+		return "slept"
+
+
+def _make_env(env_id: str, steps: Sequence[AbstractStep[str]]) -> Environment:
+	return wrap_in_cached(Environment(id=env_id, state=SharedStateHolderInMemory(unmerge=None), pipeline=list(steps)))
+
+
+class TestWarmup:
+	def test_environments_warm_up_concurrently(self) -> None:
+		steps: List[SleepStep] = [SleepStep(0.3) for _ in range(4)]
+		envs = [_make_env("a", steps[:2]), _make_env("b", steps[2:])]
+
+		started = time.monotonic()
+		timeline = run_warmup(envs, lambda: None)
+		elapsed = time.monotonic() - started
+
+		assert elapsed < 1.0, f"Environments warmed up sequentially: {elapsed:.2f}s"
+		assert [p.phase for p in timeline.phases] == ["fetch", "pipelines"]
+		assert [p.phase for p in timeline.environments["a"]] == ["pipeline"]
+		assert timeline.for_environment("b")["environment"][0].duration_s >= 0.6
+
+		# Caches are populated and the periodic reset is postponed
+		processing.process_all_jobs(envs, lambda: None)
+		assert [s.calls for s in steps] == [1, 1, 1, 1]
+
+	def test_fetch_phase_records_clones(self, repo_helper: RemoteRepoHelper) -> None:
+		repo_helper.create_commit(repo_helper.repo, "master", "master", "file1.txt", "content1", "Initial commit")
+		repo_helper.set_desired_branches([("master", "HEAD")])
+		env = wrap_in_cached(repo_helper.env)
+
+		timeline = run_warmup([env], lambda: None)
+
+		fetch = [p for p in timeline.environments["test1"] if p.phase == "fetch"]
+		assert len(fetch) == 1 and fetch[0].errors == 0
+		clone = env.pipeline[0]
+		assert isinstance(clone, CachingStep)
+		assert clone._result == repo_helper.local_dir
+
+	def test_clones_of_one_remote_fetch_it_once(self, repo_helper: RemoteRepoHelper, tmp_path: Any,
+	                                           monkeypatch: pytest.MonkeyPatch) -> None:
+		repo_helper.create_commit(repo_helper.repo, "master", "master", "file1.txt", "content1", "Initial commit")
+		repo_helper.create_commit(repo_helper.repo, "master", "branch1", "file2.txt", "content2", "Branch1 commit")
+		fetches: List[str] = []
+		original = git.Remote.fetch
+
+		def fetch(self: git.Remote, *args: Any, **kwargs: Any) -> Any:
+			fetches.append(str(self.repo.working_dir))
+			return original(self, *args, **kwargs)
+
+		monkeypatch.setattr(git.Remote, "fetch", fetch)
+		paths = [os.path.join(tmp_path, name) for name in ("partial", "full", "other")]
+		envs = [
+			_make_env("partial", [GitClone(url=repo_helper.remote_dir, repo_path=paths[0], clone_filter="blob:none")]),
+			_make_env("full", [GitClone(url=repo_helper.remote_dir, repo_path=paths[1])]),
+			_make_env("other", [GitClone(url=repo_helper.remote_dir, repo_path=paths[2])]),
+		]
+
+		timeline = run_warmup(envs, lambda: None)
+
+		assert fetches == [paths[1]]
+		assert all(p.errors == 0 for env in ("partial", "full", "other") for p in timeline.environments[env])
+		expected = git.Repo(paths[1]).git.for_each_ref("refs/remotes/origin/")
+		for path in paths:
+			assert git.Repo(path).git.for_each_ref("refs/remotes/origin/") == expected
+		partial = git.Repo(paths[0])
+		assert partial.git.config("remote.origin.promisor") == "true"
+		assert "?" in partial.git.rev_list("--objects", "--missing=print", "refs/remotes/origin/branch1")
+		# Filtered blobs are fetched lazily from the remote
+		assert partial.git.show("refs/remotes/origin/branch1:file2.txt") == "content2"